@@ -0,0 +1,312 @@
+"""
+Benchmark of the map conversion on synthetic CK2 maps.
+
+For each size, a Voronoi province map, a fractal heightmap and a branching rivers map
+are generated, then converted to the CK3 map size by the real conversion functions,
+which time their phases (decode, resample, trace, draw, encode...) into a PhaseTimer.
+The peak RSS at the end of every phase and of each conversion is recorded.
+Each conversion runs in its own process so peak RSS values do not leak between them.
+
+    python -m benchmarks.map_pipeline --sizes 2048x2048 8192x4096 --output bench.json
+    python -m benchmarks.map_pipeline --sizes 2048x2048 --compare bench.json
+"""
+from pathlib import Path
+from PIL import Image
+from contextlib import redirect_stdout
+from typing import Dict, List
+import argparse
+import io
+import json
+import multiprocessing
+import platform
+import subprocess
+import tempfile
+import time
+import numpy as np
+from src.map.heightmap import convert_height_map
+from src.map.province import convert_province_map
+from src.map.rivers import RIVER_COLORS, RIVER_WIDTH_COLORS, convert_rivers_map
+from src.utils.timing import PhaseTimer, peak_rss_mb
+
+DEFAULT_SIZES = ["2048x2048", "4096x2048", "4096x4096", "8192x4096"]
+MAPS = ["heightmap", "provinces", "rivers"]
+
+
+# Synthetic inputs
+
+def voronoi_provinces(width: int, height: int, pixels_per_province: int = 2000, seed: int = 0) -> np.ndarray:
+    """RGB map of Voronoi cells around jittered grid sites, one unique color per cell"""
+    rng = np.random.default_rng(seed)
+    cell = max(4, int(np.sqrt(pixels_per_province)))
+    cells_y, cells_x = -(-height // cell), -(-width // cell)
+    sites_x = (np.arange(cells_x)[None, :] + rng.random((cells_y, cells_x))) * cell
+    sites_y = (np.arange(cells_y)[:, None] + rng.random((cells_y, cells_x))) * cell
+    colors = rng.choice(1 << 24, cells_y * cells_x, replace=False).astype(np.uint32)
+
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    xs = np.arange(width)
+    cell_x = xs // cell
+    for y in range(height):
+        # Nearest site among the 3x3 cells around the pixel cell
+        cell_y = y // cell
+        best = np.full(width, np.inf, dtype=np.float32)
+        label = np.zeros(width, dtype=np.int64)
+        for dy in (-1, 0, 1):
+            ny = cell_y + dy
+            if not 0 <= ny < cells_y:
+                continue
+            for dx in (-1, 0, 1):
+                nx = np.clip(cell_x + dx, 0, cells_x - 1)
+                distance = (sites_x[ny, nx] - xs) ** 2 + (sites_y[ny, nx] - y) ** 2
+                closer = distance < best
+                best[closer] = distance[closer]
+                label[closer] = ny * cells_x + nx[closer]
+        packed = colors[label]
+        image[y, :, 0] = packed >> 16
+        image[y, :, 1] = packed >> 8
+        image[y, :, 2] = packed
+    return image
+
+
+def fractal_heightmap(width: int, height: int, octaves: int = 8, seed: int = 0) -> np.ndarray:
+    """Grayscale fractal noise: bilinear upscaled random octaves with halving amplitudes"""
+    rng = np.random.default_rng(seed)
+    heights = np.zeros((height, width), dtype=np.float32)
+    amplitude = 1.
+    for octave in range(octaves):
+        size = (max(2, width >> (octaves - octave)), max(2, height >> (octaves - octave)))
+        noise = Image.fromarray(rng.random(size[::-1], dtype=np.float32))
+        heights += amplitude * np.asarray(noise.resize((width, height), Image.Resampling.BILINEAR))
+        amplitude /= 2
+    heights -= heights.min()
+    heights *= 255 / max(float(heights.max()), 1e-6)
+    return heights.astype(np.uint8)
+
+
+def _walk(rng, occupied, points: List[tuple[int, int]], length: int, directions, max_x: int) -> List[tuple[int, int]]:
+    """
+    Extend a river with a random 4-connected walk of up to length steps.
+    A new pixel may only touch the last two pixels of the walk, even diagonally,
+    so rivers never form 2x2 blocks nor touch each other.
+    """
+    height = occupied.shape[0]
+    x, y = points[-1]
+    for _ in range(length):
+        dx, dy = directions[rng.integers(len(directions))]
+        nx, ny = x + dx, y + dy
+        if not (1 <= nx < max_x and 1 <= ny < height - 1):
+            break
+        # Going back or touching another pixel: try another direction
+        if occupied[ny, nx]:
+            continue
+        around = occupied[ny - 1:ny + 2, nx - 1:nx + 2].sum()
+        if around > sum(abs(a - nx) <= 1 and abs(b - ny) <= 1 for a, b in points[-2:]):
+            continue
+        x, y = nx, ny
+        occupied[y, x] = True
+        points.append((x, y))
+    return points
+
+
+def branching_rivers(width: int, height: int, pixels_per_river: int = 20000, seed: int = 0) -> np.ndarray:
+    """
+    RGB rivers map following RIVER_COLORS: rivers start at a SOURCE pixel, flow east
+    with random width colors, and get tributaries joining through a TRIBUTARY pixel.
+    A strip of WATER on the east side stands for the sea.
+    """
+    rng = np.random.default_rng(seed)
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[...] = RIVER_COLORS['LAND']
+    sea = max(1, width // 200)
+    image[:, width - sea:] = RIVER_COLORS['WATER']
+    max_x = width - sea - 2
+    occupied = np.zeros((height, width), dtype=bool)
+
+    def random_width():
+        return RIVER_WIDTH_COLORS[rng.integers(len(RIVER_WIDTH_COLORS))]
+
+    for _ in range(width * height // pixels_per_river):
+        x, y = int(rng.integers(2, max(3, max_x - 20))), int(rng.integers(2, height - 2))
+        if occupied[y - 1:y + 2, x - 1:x + 2].any():
+            continue
+        occupied[y, x] = True
+        points = _walk(rng, occupied, [(x, y)], int(rng.integers(20, 400)), [(1, 0), (1, 0), (0, 1), (0, -1)], max_x)
+        if len(points) < 5:
+            occupied[tuple(np.array(points).T[::-1])] = False
+            continue
+        color = random_width()
+        for i, (a, b) in enumerate(points):
+            if i % 50 == 49:
+                color = random_width()
+            image[b, a] = color
+        image[y, x] = RIVER_COLORS['SOURCE']
+
+        for _ in range(int(rng.integers(0, 4))):
+            # Tributaries join a straight horizontal stretch from above or below
+            k = int(rng.integers(2, len(points) - 2))
+            (ax, ay), (px, py), (bx, by) = points[k - 1:k + 2]
+            if not ay == py == by:
+                continue
+            dy = 1 if rng.random() < 0.5 else -1
+            sx, sy = px, py + dy
+            if not (2 <= sy + dy < height - 2) or occupied[sy:sy + 2 * dy + dy:dy, sx - 1:sx + 2].any():
+                continue
+            occupied[sy, sx] = occupied[sy + dy, sx] = True
+            tributary = _walk(rng, occupied, [(px, py), (sx, sy), (sx, sy + dy)], int(rng.integers(5, 100)),
+                              [(0, dy), (0, dy), (-1, 0), (1, 0)], max_x)[1:]
+            color = random_width()
+            for a, b in tributary:
+                image[b, a] = color
+            image[sy, sx] = RIVER_COLORS['TRIBUTARY']
+            a, b = tributary[-1]
+            image[b, a] = RIVER_COLORS['SOURCE']
+    return image
+
+
+def generate_inputs(folder: Path, width: int, height: int, seed: int = 0) -> Dict[str, Path]:
+    """Write the synthetic CK2 maps of a size into folder, reusing them if already there"""
+    folder = Path(folder) / f"{width}x{height}_{seed}"
+    folder.mkdir(parents=True, exist_ok=True)
+    paths = {
+        "heightmap": folder / "topology.bmp",
+        "provinces": folder / "provinces.bmp",
+        "rivers": folder / "rivers.bmp",
+    }
+    if not paths["heightmap"].exists():
+        Image.fromarray(fractal_heightmap(width, height, seed=seed)).save(paths["heightmap"])
+    if not paths["provinces"].exists():
+        Image.fromarray(voronoi_provinces(width, height, seed=seed)).save(paths["provinces"])
+    if not paths["rivers"].exists():
+        Image.fromarray(branching_rivers(width, height, seed=seed)).save(paths["rivers"])
+    return paths
+
+
+# Timed phases
+# The conversions time their own phases into the timer, "total" wraps the whole call
+
+def bench_heightmap(source: Path, destination: Path, scale: float, offset, dimensions, timer: PhaseTimer):
+    with timer.phase("total"):
+        convert_height_map(source, destination, scale, offset, dimensions, timer=timer)
+
+
+def bench_provinces(source: Path, destination: Path, scale: float, offset, dimensions, timer: PhaseTimer,
+                    min_fragment_size: int = 0):
+    with timer.phase("total"):
+        convert_province_map(source, destination, scale, offset, dimensions, min_fragment_size, timer=timer)
+
+
+def bench_rivers(source: Path, destination: Path, scale: float, offset, dimensions, timer: PhaseTimer):
+    with timer.phase("total"):
+        convert_rivers_map(source, destination, scale, offset, dimensions, timer=timer)
+
+
+def run_case(map_name: str, source: str, scale: float, offset, dimensions, repeat: int,
+             min_fragment_size: int = 0) -> dict:
+    """
+    Benchmark one map conversion, meant to run in a fresh process. Keeps the fastest run of each phase
+    and the peak RSS of the process at the end of each phase.
+    """
+    bench = {"heightmap": bench_heightmap, "provinces": bench_provinces, "rivers": bench_rivers}[map_name]
+    kwargs = {"min_fragment_size": min_fragment_size} if map_name == "provinces" else {}
+    best: Dict[str, float] = {}
+    phase_peak_rss_mb: Dict[str, float] = {}
+    with tempfile.TemporaryDirectory() as folder:
+        destination = Path(folder) / f"{map_name}.png"
+        for _ in range(repeat):
+            timer = PhaseTimer()
+            # The conversions print progress, keep the benchmark output readable
+            with redirect_stdout(io.StringIO()):
+                bench(Path(source), destination, scale, tuple(offset), tuple(dimensions), timer, **kwargs)
+            for name, seconds in timer.phases.items():
+                best[name] = min(best.get(name, np.inf), seconds)
+            for name, peak in timer.peak_rss_mb.items():
+                phase_peak_rss_mb[name] = max(phase_peak_rss_mb.get(name, 0.), peak)
+    return {"phases": best, "phase_peak_rss_mb": phase_peak_rss_mb, "peak_rss_mb": peak_rss_mb()}
+
+
+# Results
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def print_results(results: List[dict], baseline: List[dict] | None = None):
+    """One line per phase, with the ratio to the baseline run when there is one"""
+    previous = {}
+    for result in baseline or []:
+        for name, seconds in result["phases"].items():
+            previous[(result["map"], result["size"], name)] = seconds
+        for name, peak in result.get("phase_peak_rss_mb", {}).items():
+            previous[(result["map"], result["size"], f"{name} rss")] = peak
+        previous[(result["map"], result["size"], "peak_rss_mb")] = result["peak_rss_mb"]
+
+    print(f"{'map':<10} {'size':<10} {'phase':<12} {'value':>10} {'baseline':>10} {'ratio':>7}")
+    for result in results:
+        rows = [(name, seconds, "s") for name, seconds in result["phases"].items()]
+        rows += [(f"{name} rss", peak, "MB") for name, peak in result["phase_peak_rss_mb"].items()]
+        rows.append(("peak_rss_mb", result["peak_rss_mb"], "MB"))
+        for name, value, unit in rows:
+            line = f"{result['map']:<10} {result['size']:<10} {name:<12} {value:>8.3f}{unit:>2}"
+            before = previous.get((result["map"], result["size"], name))
+            if before:
+                line += f" {before:>8.3f}{unit:>2} {value / before:>6.2f}x"
+            print(line)
+
+
+def main(argv: List[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="CK2 map sizes as WIDTHxHEIGHT")
+    parser.add_argument("--maps", nargs="+", default=MAPS, choices=MAPS)
+    parser.add_argument("--destination", default="8192x4096", help="CK3 map size as WIDTHxHEIGHT")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per case, the fastest is kept")
+    parser.add_argument("--min-fragment-size", type=int, default=0, help="Province fragment cleanup threshold")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", type=Path, default=Path(tempfile.gettempdir()) / "ck2_ck3_map_bench",
+                        help="Folder of the generated inputs, reused between runs")
+    parser.add_argument("--output", type=Path, help="Write the results to this JSON file")
+    parser.add_argument("--compare", type=Path, help="JSON results of a previous run to compare with")
+    args = parser.parse_args(argv)
+
+    destination = tuple(int(v) for v in args.destination.split("x"))
+    # A fresh process per case so that every peak RSS is its own
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for size in args.sizes:
+        width, height = (int(v) for v in size.split("x"))
+        print(f"Generating {size} inputs in {args.work_dir}")
+        paths = generate_inputs(args.work_dir, width, height, args.seed)
+        # Fit the whole CK2 map in the CK3 one
+        scale = min(destination[0] / width, destination[1] / height)
+        for map_name in args.maps:
+            print(f"Converting {size} {map_name}")
+            with context.Pool(1) as pool:
+                result = pool.apply(run_case, (
+                    map_name, str(paths[map_name]), scale, (0, 0), destination, args.repeat, args.min_fragment_size,
+                ))
+            results.append({"map": map_name, "size": size, "scale": scale, **result})
+
+    baseline = json.loads(args.compare.read_text())["results"] if args.compare else None
+    print_results(results, baseline)
+
+    if args.output:
+        args.output.write_text(json.dumps({
+            "commit": git_commit(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pillow": Image.__version__,
+            "destination": args.destination,
+            "repeat": args.repeat,
+            "results": results,
+        }, indent=2))
+        print(f"Saved results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
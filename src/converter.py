@@ -3,8 +3,11 @@ from src.titles.all_titles import convert_titles
 import git
 from pathlib import Path
 import shutil
+import tempfile
 
 mod_template = "https://github.com/bombusfrigidus/Atlantis"
+# Work folder for data reused between runs (traced rivers), kept out of the generated mod
+default_cache_folder = Path(tempfile.gettempdir()) / "ck2_to_ck3_cache"
 
 def initialize_mod(
         to_folder: str,
@@ -41,7 +44,7 @@ def convert_mod(
         destination_dimensions: tuple[int, int] = (8192, 4096),
         conversion_scale: float = 1.0,
         conversion_offset: tuple[int, int] = (0, 0),
-        
+        cache_folder: str | None = None,
 ):
     # # Initialize the mod
     # initialize_mod(to_folder, mod_name)
@@ -53,7 +56,8 @@ def convert_mod(
     #     mod_folder,
     #     destination_dimensions,
     #     conversion_scale,
-    #     conversion_offset
+    #     conversion_offset,
+    #     cache_folder=Path(cache_folder) if cache_folder else default_cache_folder,
     # )
 
     convert_titles(
@@ -0,0 +1,148 @@
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+import numpy as np
+from scipy import ndimage
+from scipy.spatial import cKDTree
+
+
+# Up to this many sites, a dense distance matrix is faster than building a k-d tree
+BRUTE_FORCE_SITES = 16
+
+
+@dataclass
+class BaronyPlacement:
+    """A barony province cut out of a county province."""
+    id: int             # Id of the barony in the new raster
+    province_id: int    # County province it was cut from
+    barony: str | None  # Barony title, None for provinces without baronies (sea, wasteland...)
+    size: int           # Number of pixels
+    x: int              # Pixel of the barony closest to its site
+    y: int
+
+
+def nearest_site(coords: np.ndarray, sites: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Index of the nearest site of every point and the squared distance to it"""
+    if len(sites) <= BRUTE_FORCE_SITES:
+        ys, xs = np.ascontiguousarray(coords[:, 0]), np.ascontiguousarray(coords[:, 1])
+        labels = np.zeros(len(coords), dtype=np.intp)
+        best = (ys - sites[0, 0]) ** 2 + (xs - sites[0, 1]) ** 2
+        for site in range(1, len(sites)):
+            distances = (ys - sites[site, 0]) ** 2 + (xs - sites[site, 1]) ** 2
+            closer = distances < best
+            best[closer] = distances[closer]
+            labels[closer] = site
+        return labels, best
+    distances, labels = cKDTree(sites).query(coords)
+    return labels, distances ** 2
+
+
+def closest_points(labels: np.ndarray, distances: np.ndarray, n_sites: int) -> np.ndarray:
+    """Index of the point of each site with the smallest distance, -1 for sites without points"""
+    closest = np.full(n_sites, -1, dtype=np.intp)
+    if n_sites <= BRUTE_FORCE_SITES:
+        for site in range(n_sites):
+            own = labels == site
+            if own.any():
+                closest[site] = np.argmin(np.where(own, distances, np.inf))
+        return closest
+    order = np.lexsort((distances, labels))
+    present, first = np.unique(labels[order], return_index=True)
+    closest[present] = order[first]
+    return closest
+
+
+def split_county(
+        coords: np.ndarray,
+        n_baronies: int,
+        rng: np.random.Generator,
+        lloyd_iterations: int = 0,
+        lloyd_samples: int = 4096,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Split county pixels (n, 2) between n_baronies random sites, each pixel going to its nearest site.
+    Lloyd iterations move every site to the centroid of its pixels and assign again,
+    on at most lloyd_samples random pixels of the county.
+    Returns the barony index of every pixel, the squared distance to its site and the (n_baronies, 2) sites.
+    """
+    if len(coords) <= n_baronies:
+        # Not enough room: one pixel per barony, the others stay empty
+        sites = np.zeros((n_baronies, 2), dtype=np.float32)
+        sites[:len(coords)] = coords
+        return np.arange(len(coords)), np.zeros(len(coords), dtype=np.float32), sites
+
+    coords = coords.astype(np.float32)
+    if n_baronies == 1:
+        sites = coords.mean(axis=0, keepdims=True)
+        return np.zeros(len(coords), dtype=np.intp), ((coords - sites) ** 2).sum(axis=1), sites
+
+    sites = coords[rng.choice(len(coords), n_baronies, replace=False)]
+    if lloyd_iterations > 0:
+        samples = coords
+        if len(coords) > lloyd_samples:
+            samples = coords[rng.choice(len(coords), lloyd_samples, replace=False)]
+        for _ in range(lloyd_iterations):
+            labels = nearest_site(samples, sites)[0]
+            counts = np.bincount(labels, minlength=n_baronies)
+            filled = counts > 0
+            for axis in range(2):
+                sums = np.bincount(labels, weights=samples[:, axis], minlength=n_baronies)
+                sites[filled, axis] = sums[filled] / counts[filled]
+    labels, distances = nearest_site(coords, sites)
+    return labels, distances, sites
+
+
+def place_baronies(
+        province_ids: np.ndarray,
+        county_baronies: Dict[int, List[str]],
+        lloyd_iterations: int = 2,
+        seed: int = 0,
+        first_id: int = 1,
+) -> Tuple[np.ndarray, List[BaronyPlacement]]:
+    """
+    Cut every county province of a province id raster into its baronies.
+
+    Sites are drawn among the county pixels and pixels go to the nearest site (Voronoi),
+    working on the county bounding box. Provinces without baronies in county_baronies
+    are kept whole with a new id. Id 0 stays 0.
+    Returns the int32 raster of new ids, numbered from first_id, and where each one went.
+    """
+    rng = np.random.default_rng(seed)
+    baronies = np.zeros(province_ids.shape, dtype=np.int32)
+    placements = []
+    next_id = first_id
+
+    for province_id, bbox in enumerate(ndimage.find_objects(province_ids), start=1):
+        if bbox is None:
+            continue
+        mask = province_ids[bbox] == province_id
+        coords = np.argwhere(mask)
+        names = county_baronies.get(province_id) or [None]
+
+        labels, distances, _ = split_county(coords, len(names), rng, lloyd_iterations)
+        crop = baronies[bbox]
+        crop[mask] = next_id + labels
+
+        # Barony pixel closest to its site
+        closest = closest_points(labels, distances, len(names))
+        closest = np.where(closest[:, None] >= 0, coords[np.maximum(closest, 0)], 0)
+        sizes = np.bincount(labels, minlength=len(names))
+        for index, name in enumerate(names):
+            placements.append(BaronyPlacement(
+                id=next_id + index,
+                province_id=province_id,
+                barony=name,
+                size=int(sizes[index]),
+                x=int(closest[index, 1] + bbox[1].start),
+                y=int(closest[index, 0] + bbox[0].start),
+            ))
+        next_id += len(names)
+
+    return baronies, placements
+
+
+def print_placement_report(placements: List[BaronyPlacement]):
+    """Print the baronies that got no pixel because their county is too small"""
+    empty = [placement for placement in placements if placement.size == 0]
+    print(f"Placed {len(placements)} baronies")
+    for placement in empty:
+        print(f"Warning: barony {placement.barony} of province {placement.province_id} has no pixel")
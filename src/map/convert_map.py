@@ -1,9 +1,17 @@
 from pathlib import Path
 from PIL import Image, ImageChops
 import numpy as np
-from .heightmap import convert_height_map
+from .heightmap import convert_height_map, fit_height_curve, default_curve_points
 from .province import convert_province_map
 from .rivers import convert_rivers_map
+from .normals import generate_normal_and_slope_maps
+from .terrain import generate_terrain_masks
+from .trees import convert_trees_map
+from .positions import convert_positions, convert_adjacencies
+from .default_map import convert_default_map_lists
+from src.titles.definitions import DefinitionTable
+from src.utils.directory_index import index_directory
+from src.utils.paradox_file_parser import regex_paradox_parser
 
 
 def convert_map(
@@ -12,18 +20,45 @@ def convert_map(
         destination_dimensions,
         conversion_scale,
         conversion_offset,
+        min_province_fragment_size: int = 0,
+        cache_folder: Path | None = None,
+        invalidate_cache: bool = False,
+        river_simplify_tolerance: float = 0.,
+        reference_heightmap_path: Path | None = None,
+        generate_normal_maps: bool = False,
+        jobs: int = 1,
+        convert_terrain: bool = False,
+        terrain_blur_sigma: float = 0.,
+        convert_trees: bool = False,
+        seed: int = 0,
+        convert_coordinates: bool = False,
+        generate_default_map_lists: bool = False,
 ):
     original_heightmap_path = Path(from_folder) / "map" / "topology.bpm"
     converted_heightmap_path = Path(mod_folder) / "map_data" / "heightmap.png"
 
+    # Match the height distribution of a CK3 heightmap instead of the hand-tuned curve
+    curve_points = default_curve_points
+    if reference_heightmap_path is not None:
+        curve_points = fit_height_curve(original_heightmap_path, reference_heightmap_path) or default_curve_points
+
     convert_height_map(
         original_heightmap_path,
         converted_heightmap_path,
         conversion_scale,
         conversion_offset,
         destination_dimensions,
+        curve_points,
     )
 
+    if generate_normal_maps:
+        generate_normal_and_slope_maps(
+            converted_heightmap_path,
+            Path(mod_folder) / "map_data" / "normalmap.png",
+            Path(mod_folder) / "map_data" / "slopemap.png",
+            jobs=jobs,
+        )
+
     original_province_map_path = Path(from_folder) / "map" / "provinces.bmp"
     converted_province_map_path = Path(mod_folder) / "map_data" / "provinces.png"
 
@@ -33,6 +68,7 @@ def convert_map(
         conversion_scale,
         conversion_offset,
         destination_dimensions,
+        min_fragment_size=min_province_fragment_size,
     )
 
     original_rivers_map_path = Path(from_folder) / "map" / "rivers.bmp"
@@ -44,5 +80,64 @@ def convert_map(
         conversion_scale,
         conversion_offset,
         destination_dimensions,
+        cache_folder=cache_folder,
+        invalidate_cache=invalidate_cache,
+        simplify_tolerance=river_simplify_tolerance,
     )
 
+    if convert_terrain:
+        generate_terrain_masks(
+            from_folder,
+            Path(mod_folder) / "gfx" / "map" / "terrain",
+            conversion_scale,
+            conversion_offset,
+            destination_dimensions,
+            blur_sigma=terrain_blur_sigma,
+        )
+
+    if convert_trees:
+        # Palette indices of trees.bmp holding trees are listed in default.map
+        tree_indices = regex_paradox_parser(Path(from_folder) / "map" / "default.map").get("tree")
+        if tree_indices is not None and not isinstance(tree_indices, list):
+            tree_indices = [tree_indices]
+        convert_trees_map(
+            Path(from_folder) / "map" / "trees.bmp",
+            Path(mod_folder) / "content_source" / "map_objects" / "masks" / "trees_density.png",
+            Path(mod_folder) / "gfx" / "map" / "map_object_data" / "trees_converted.txt",
+            Image.open(original_province_map_path).size,
+            conversion_scale,
+            conversion_offset,
+            destination_dimensions,
+            tree_indices=tree_indices,
+            seed=seed,
+        )
+
+    if convert_coordinates:
+        original_dimensions = Image.open(original_province_map_path).size
+        convert_positions(
+            Path(from_folder) / "map" / "positions.txt",
+            Path(mod_folder) / "gfx" / "map" / "map_object_data" / "building_locators.txt",
+            original_dimensions,
+            conversion_scale,
+            conversion_offset,
+            destination_dimensions,
+        )
+        convert_adjacencies(
+            Path(from_folder) / "map" / "adjacencies.csv",
+            Path(mod_folder) / "map_data" / "adjacencies.csv",
+            original_dimensions,
+            conversion_scale,
+            conversion_offset,
+            destination_dimensions,
+        )
+
+    if generate_default_map_lists:
+        # Needs the converted provinces, heightmap and rivers written above
+        convert_default_map_lists(
+            from_folder,
+            mod_folder,
+            DefinitionTable.load(Path(from_folder) / "map" / "definition.csv").color_to_id(),
+            conversion_scale,
+            conversion_offset,
+            ids_with_history=index_directory(Path(from_folder) / "history" / "provinces").files.keys(),
+        )
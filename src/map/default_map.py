@@ -0,0 +1,209 @@
+from pathlib import Path
+from PIL import Image
+from typing import Dict, Iterable, List, Tuple
+import re
+import numpy as np
+from scipy import ndimage
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from src.utils.paradox_file_parser import regex_paradox_parser, read_game_text
+from .province import open_province_image, province_id_raster
+from .rivers import classify_rivers, river_mask, open_rivers_array
+from .terrain import read_terrain_palette
+from .transform import nearest_source_indices
+
+DEFAULT_MAP_LISTS = ["sea_zones", "lakes", "river_provinces", "impassable_mountains"]
+
+
+def province_adjacency(province_ids: np.ndarray) -> np.ndarray:
+    """(n, 2) unique pairs of different province ids sharing a pixel border"""
+    pairs = np.concatenate([
+        np.stack([province_ids[:, :-1].ravel(), province_ids[:, 1:].ravel()], axis=1),
+        np.stack([province_ids[:-1, :].ravel(), province_ids[1:, :].ravel()], axis=1),
+    ])
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]].astype(np.int64)
+    pairs.sort(axis=1)
+    keys = np.unique(pairs[:, 0] << 32 | pairs[:, 1])
+    return np.stack([keys >> 32, keys & 0xFFFFFFFF], axis=1)
+
+
+def classify_provinces(
+        province_ids: np.ndarray,
+        heights: np.ndarray,
+        water_terrain: np.ndarray,
+        rivers: np.ndarray,
+        sea_level: int = 19,
+        water_share: float = 0.5,
+        river_share: float = 0.5,
+        river_reach: int = 1,
+        impassable_height: int = 160,
+        known_rivers: Iterable[int] = (),
+        ids_with_history: Iterable[int] | None = None,
+) -> Dict[str, List[int]]:
+    """
+    Sort provinces into the CK3 default.map lists from same-sized rasters.
+
+    - water: at least water_share of pixels below sea_level or on water terrain
+    - sea_zones: water provinces connected through water to the map edge or to pixels of
+      id 0, which are outside of the converted map; lakes: other water
+    - river_provinces: land with at least river_share of its pixels within river_reach pixels
+      of a river, or in known_rivers. Rivers are 1 pixel wide: the share of river pixels
+      themselves depends on the province size, the share of the band along them does not.
+      The narrow provinces drawn along major rivers are covered by that band, while a
+      river crossing an ordinary province only covers a strip of it
+    - impassable_mountains: other land with mean height >= impassable_height and,
+      if ids_with_history is given, no province history
+    Province id 0 (colors missing from the definitions) is ignored.
+    """
+    ids = province_ids.ravel()
+    n_ids = int(ids.max()) + 1
+    pixels = np.bincount(ids, minlength=n_ids)
+    present = pixels > 0
+    present[0] = False
+    pixels = np.maximum(pixels, 1)
+    below_sea = np.bincount(ids, weights=(heights.ravel() < sea_level), minlength=n_ids) / pixels
+    on_water_terrain = np.bincount(ids, weights=water_terrain.ravel(), minlength=n_ids) / pixels
+    near_river = ndimage.binary_dilation(rivers, iterations=river_reach) if river_reach > 0 else rivers
+    on_river = np.bincount(ids, weights=near_river.ravel(), minlength=n_ids) / pixels
+    mean_height = np.bincount(ids, weights=heights.ravel(), minlength=n_ids) / pixels
+
+    water = present & ((below_sea >= water_share) | (on_water_terrain >= water_share))
+
+    # Water provinces grouped through shared borders, groups touching the map edge are seas.
+    # Unmapped pixels (id 0) are where the converted map does not cover the canvas: the
+    # map edge, so water next to them is at the edge too.
+    adjacency = province_adjacency(province_ids)
+    next_to_unmapped = adjacency[adjacency[:, 0] == 0, 1]
+    adjacency = adjacency[water[adjacency[:, 0]] & water[adjacency[:, 1]]]
+    graph = coo_matrix((np.ones(len(adjacency)), (adjacency[:, 0], adjacency[:, 1])), shape=(n_ids, n_ids))
+    _, groups = connected_components(graph, directed=False)
+    edge = np.zeros(n_ids, dtype=bool)
+    edge[np.concatenate([province_ids[0], province_ids[-1], province_ids[:, 0], province_ids[:, -1]])] = True
+    edge[next_to_unmapped] = True
+    sea_groups = np.zeros(n_ids, dtype=bool)
+    sea_groups[groups[water & edge]] = True
+    sea = water & sea_groups[groups]
+    lake = water & ~sea
+
+    land = present & ~water
+    river = land & (on_river >= river_share)
+    known_rivers = np.fromiter(known_rivers, dtype=np.int64)
+    river[known_rivers[(known_rivers < n_ids)]] = True
+    river &= land
+
+    impassable = land & ~river & (mean_height >= impassable_height)
+    if ids_with_history is not None:
+        with_history = np.fromiter(ids_with_history, dtype=np.int64)
+        impassable[with_history[with_history < n_ids]] = False
+
+    return {
+        "sea_zones": np.flatnonzero(sea).tolist(),
+        "lakes": np.flatnonzero(lake).tolist(),
+        "river_provinces": np.flatnonzero(river).tolist(),
+        "impassable_mountains": np.flatnonzero(impassable).tolist(),
+    }
+
+
+def id_runs(ids: Iterable[int]) -> List[Tuple[int, int]]:
+    """(first, last) of every run of consecutive ids, in sorted order"""
+    runs = []
+    for i in sorted(set(ids)):
+        if runs and i == runs[-1][1] + 1:
+            runs[-1] = (runs[-1][0], i)
+        else:
+            runs.append((i, i))
+    return runs
+
+
+def format_id_list(key: str, ids: List[int]) -> List[str]:
+    """default.map lines for a list of ids: RANGE for runs of 3 or more, LIST for the rest"""
+    lines, singles = [], []
+    for first, last in id_runs(ids):
+        if last - first >= 2:
+            lines.append(f"{key} = RANGE {{ {first} {last} }}")
+        else:
+            singles.extend(range(first, last + 1))
+    if singles:
+        lines.append(f"{key} = LIST {{ {' '.join(str(i) for i in singles)} }}")
+    return lines
+
+
+def write_default_map_lists(default_map_path: Path, lists: Dict[str, List[int]]):
+    """
+    Replace the given lists in a CK3 default.map, keeping every other line and comment.
+    The file is created if it does not exist.
+    """
+    default_map_path = Path(default_map_path)
+    lines = read_game_text(default_map_path).splitlines() if default_map_path.exists() else []
+    list_line = re.compile(r'^\s*(' + '|'.join(re.escape(key) for key in lists) + r')\s*=\s*(LIST|RANGE)\b')
+    lines = [line for line in lines if not list_line.match(line)]
+    for key, ids in lists.items():
+        lines.extend(format_id_list(key, ids))
+    default_map_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(default_map_path, "w", encoding="utf-8-sig") as file:
+        file.write("\n".join(lines) + "\n")
+    print(f"Successfully saved {', '.join(f'{len(ids)} {key}' for key, ids in lists.items())} to {default_map_path}")
+
+
+def convert_default_map_lists(
+        original_mod_folder: Path,
+        mod_folder: Path,
+        color_to_id: Dict[tuple[int, int, int], int],
+        conversion_scale: float,
+        conversion_offset: tuple[int, int],
+        ids_with_history: Iterable[int] | None = None,
+) -> Dict[str, List[int]] | None:
+    """
+    take in the converted map_data/provinces.png, heightmap.png, rivers.png and the original
+    map/terrain.bmp, map/terrain.txt and map/default.map (major_rivers)
+    return the sea_zones, lakes, river_provinces and impassable_mountains of map_data/default.map
+    """
+    original_mod_folder, mod_folder = Path(original_mod_folder), Path(mod_folder)
+    province_image = open_province_image(mod_folder / "map_data" / "provinces.png")
+    if province_image is None:
+        return
+    province_ids = province_id_raster(np.array(province_image), color_to_id)
+    heights = np.array(Image.open(mod_folder / "map_data" / "heightmap.png").convert('L'))
+    rivers = river_mask(classify_rivers(open_rivers_array(mod_folder / "map_data" / "rivers.png")))
+
+    # Water terrain, brought to the destination map like the other bitmaps
+    height, width = province_ids.shape
+    terrain_files = [original_mod_folder / "map" / name for name in ("terrain.bmp", "terrain.txt")]
+    missing_terrain_files = [str(path) for path in terrain_files if not path.exists()]
+    if missing_terrain_files:
+        print(f"Skipping water terrain: {', '.join(missing_terrain_files)} not found")
+        water_terrain = np.zeros((height, width), dtype=bool)
+    else:
+        terrain_bitmap, terrain_definition = terrain_files
+        terrain_indices = np.array(Image.open(terrain_bitmap))
+        categories = regex_paradox_parser(terrain_definition).get('categories', {})
+        water_types = {name for name, category in categories.items()
+                       if isinstance(category, dict) and category.get('is_water') is True}
+        is_water_index = np.zeros(256, dtype=bool)
+        for index, terrain_type in read_terrain_palette(terrain_definition).items():
+            is_water_index[index] = terrain_type in water_types
+        source_x, valid_x = nearest_source_indices(np.arange(width), terrain_indices.shape[1], conversion_scale, conversion_offset[0])
+        source_y, valid_y = nearest_source_indices(np.arange(height), terrain_indices.shape[0], conversion_scale, conversion_offset[1])
+        water_terrain = is_water_index[terrain_indices[source_y[:, None], source_x[None, :]]]
+        water_terrain &= valid_y[:, None] & valid_x[None, :]
+
+    original_default_map = original_mod_folder / "map" / "default.map"
+    if original_default_map.exists():
+        major_rivers = regex_paradox_parser(original_default_map).get('major_rivers', [])
+    else:
+        print(f"Skipping major rivers: {original_default_map} not found")
+        major_rivers = []
+    if not isinstance(major_rivers, list):
+        major_rivers = [major_rivers]
+
+    print("Classifying provinces for default.map")
+    lists = classify_provinces(
+        province_ids,
+        heights,
+        water_terrain,
+        rivers,
+        known_rivers=[int(i) for i in major_rivers],
+        ids_with_history=ids_with_history,
+    )
+    write_default_map_lists(mod_folder / "map_data" / "default.map", lists)
+    return lists
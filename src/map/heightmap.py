@@ -1,6 +1,7 @@
 from pathlib import Path
 from PIL import Image
 import numpy as np
+from src.utils.timing import PhaseTimer, timed
 
 default_curve = "0 0 0.11609779916158537 0 0.16708812351795393 0 0.24117917936991867 0 0.32469172187931633 0.0047780102825537574 0.35372965142045404 0.048227133620360574 0.36996233015322161 0.056717994885567058 0.3800659077336252 0.088662127213393171 0.48523363988043861 0.18455742111106588 0.6546260264696997 0.32451771881620761 0.87591033429730669 0.46060741678210571 0.97367036352794567 0.62462249086090704 0.99824867145155827 1"
 
@@ -61,6 +62,56 @@ def generate_lut_from_curve(points: list[tuple[int, int]]) -> list[int]:
     return list(lut)
 
 default_curve_points = load_curve_scaled(default_curve) 
+
+def histogram_match_curve(
+        source_array: np.ndarray,
+        reference_array: np.ndarray | None = None,
+        target_histogram: np.ndarray | None = None,
+        sample_step: int = 4,
+) -> list[tuple[int, int]]:
+    """
+    Derive a 256-point curve mapping the source height distribution onto a reference one.
+    The reference is either a grayscale heightmap or a 256-entry histogram of target heights.
+    Only one pixel every sample_step in each direction is used.
+    The result can be passed as curve_points to convert_height_map.
+    """
+    source = np.asarray(source_array, dtype=np.uint8)[::sample_step, ::sample_step]
+    source_cdf = np.cumsum(np.bincount(source.ravel(), minlength=256)).astype(np.float64)
+    source_cdf /= source_cdf[-1]
+
+    if reference_array is not None:
+        reference = np.asarray(reference_array, dtype=np.uint8)[::sample_step, ::sample_step]
+        target_histogram = np.bincount(reference.ravel(), minlength=256)
+    elif target_histogram is None:
+        raise ValueError("Either reference_array or target_histogram is required")
+    target_histogram = np.asarray(target_histogram, dtype=np.float64)[:256]
+    if target_histogram.size == 0 or not np.isfinite(target_histogram).all() or (target_histogram < 0).any():
+        raise ValueError("target_histogram must hold finite, non-negative counts")
+    if target_histogram.sum() <= 0:
+        raise ValueError("target_histogram must have a positive sum")
+    target_cdf = np.cumsum(target_histogram)
+    target_cdf /= target_cdf[-1]
+
+    # Smallest target height whose cumulative share reaches the source one
+    lut = np.searchsorted(target_cdf, source_cdf - 1e-12, side='left')
+    lut = np.maximum.accumulate(np.clip(lut, 0, 255))
+    return [(x, int(y)) for x, y in enumerate(lut)]
+
+def fit_height_curve(
+        original_map_path: Path,
+        reference_heightmap_path: Path,
+        sample_step: int = 4,
+) -> list[tuple[int, int]] | None:
+    """Histogram-match a CK2 topology map against a reference CK3 heightmap, see histogram_match_curve"""
+    try:
+        source = Image.open(original_map_path).convert('L')
+        reference = Image.open(reference_heightmap_path).convert('L')
+    except Exception as e:
+        print(f"Error opening heightmaps to fit the curve: {e}")
+        return
+    points = histogram_match_curve(np.array(source), np.array(reference), sample_step=sample_step)
+    print(f"Fitted height curve on {original_map_path} against {reference_heightmap_path}")
+    return points
     
 
 def convert_height_map(
@@ -70,61 +121,68 @@ def convert_height_map(
         conversion_offset: tuple[int, int],
         destination_dimensions: tuple[int, int],
         curve_points: list[tuple[int, int]] | None = default_curve_points,
-        fill_color: float = 0. # Black
+        fill_color: int = 0, # Black
+        timer: PhaseTimer | None = None,
 ):
     """
     take in map/topology.bpm
     Apply map scaling, new size and color curve to match CK3 map.
     return map_data/heightmap.png
+    timer, if given, gets the time of the decode, resample, curve and encode phases.
     """
     # Open
-    try:
-        original_image = Image.open(original_map_path)
-    except FileNotFoundError:
-        print(f"Error: Original heightmap not found at {original_map_path}")
-        return
-    except Exception as e:
-        print(f"Error opening image {original_map_path}: {e}")
-        return
-
-    # Convert to grayscale
-    if original_image.mode != 'L':
-        print(f"Converting image {original_map_path} to grayscale ('L' mode)")
-        original_image = original_image.convert('L')
+    with timed(timer, "decode"):
+        try:
+            original_image = Image.open(original_map_path)
+            original_image.load()
+        except FileNotFoundError:
+            print(f"Error: Original heightmap not found at {original_map_path}")
+            return
+        except Exception as e:
+            print(f"Error opening image {original_map_path}: {e}")
+            return
+
+        # Convert to grayscale
+        if original_image.mode != 'L':
+            print(f"Converting image {original_map_path} to grayscale ('L' mode)")
+            original_image = original_image.convert('L')
 
     # Resize
-    original_dimensions = original_image.size
-    try:
-        resized_image = original_image.resize(
-            (
-                int(original_dimensions[0] * conversion_scale),
-                int(original_dimensions[1] * conversion_scale)
-            ),
-            Image.Resampling.LANCZOS
-        )
-    except ValueError as e:
-        print(f"Error resizing image: {e}. Check conversion_scale.")
-        return
-
-    # Offset
-    final_image = Image.new(resized_image.mode, destination_dimensions, fill_color)
-    paste_x, paste_y = conversion_offset
-    final_image.paste(resized_image, (paste_x, paste_y))
+    with timed(timer, "resample"):
+        original_dimensions = original_image.size
+        try:
+            resized_image = original_image.resize(
+                (
+                    int(original_dimensions[0] * conversion_scale),
+                    int(original_dimensions[1] * conversion_scale)
+                ),
+                Image.Resampling.LANCZOS
+            )
+        except ValueError as e:
+            print(f"Error resizing image: {e}. Check conversion_scale.")
+            return
+
+        # Offset
+        final_image = Image.new(resized_image.mode, destination_dimensions, fill_color)
+        paste_x, paste_y = conversion_offset
+        final_image.paste(resized_image, (paste_x, paste_y))
 
     # Color curve
-    if curve_points:
-        print(f"Applying color curve using provided points.")
-        lut = generate_lut_from_curve(curve_points)
-        if len(lut) == 256:
-            final_image = final_image.point(lut)
+    with timed(timer, "curve"):
+        if curve_points:
+            print(f"Applying color curve using provided points.")
+            lut = generate_lut_from_curve(curve_points)
+            if len(lut) == 256:
+                final_image = final_image.point(lut)
+            else:
+                 print("Warning: Failed to generate valid LUT from curve points. Skipping curve application.")
         else:
-             print("Warning: Failed to generate valid LUT from curve points. Skipping curve application.")
-    else:
-        print("No curve points provided, skipping curve application.")
+            print("No curve points provided, skipping curve application.")
 
     # Save as Grayscale 8bpc PNG
-    try:
-        final_image.save(converted_map_path, "PNG")
-        print(f"Successfully saved converted heightmap to {converted_map_path}")
-    except Exception as e:
-        print(f"Error saving image {converted_map_path}: {e}")
\ No newline at end of file
+    with timed(timer, "encode"):
+        try:
+            final_image.save(converted_map_path, "PNG")
+            print(f"Successfully saved converted heightmap to {converted_map_path}")
+        except Exception as e:
+            print(f"Error saving image {converted_map_path}: {e}")
\ No newline at end of file
@@ -0,0 +1,79 @@
+from pathlib import Path
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# A CK3 heightmap value of 255 is 51 world units high, and one pixel is one unit wide
+DEFAULT_HEIGHT_SCALE = 51. / 255.
+
+
+def normals_and_slope(heights: np.ndarray, height_scale: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Normal map (H, W, 3) and slope (H, W) of a height array, both as uint8.
+    Normals are (-dh/dx, -dh/dy, 1) normalized and stored as (n + 1) / 2 * 255, y pointing down the image.
+    Slope is the angle with the horizontal, 0-90 degrees stored as 0-255.
+    """
+    gradient_y, gradient_x = np.gradient(heights.astype(np.float32) * np.float32(height_scale))
+    norm = np.sqrt(gradient_x * gradient_x + gradient_y * gradient_y + 1)
+    normals = np.stack([-gradient_x / norm, -gradient_y / norm, 1 / norm], axis=-1)
+    normals = np.round((normals + 1) * 127.5).astype(np.uint8)
+    slope = np.arctan(np.hypot(gradient_x, gradient_y)) * (255 / (np.pi / 2))
+    return normals, np.round(slope).astype(np.uint8)
+
+
+def generate_normal_and_slope_maps(
+        heightmap_path: Path,
+        normal_map_path: Path,
+        slope_map_path: Path,
+        height_scale: float = DEFAULT_HEIGHT_SCALE,
+        tile_size: int = 1024,
+        jobs: int = 1,
+        compress_level: int = 1,
+):
+    """
+    take in map_data/heightmap.png
+    Compute the normal map (RGB) and slope map (grayscale) tile by tile.
+    Tiles overlap by one pixel so that gradients match a full-map computation,
+    only one tile of floats per job is held in memory.
+    compress_level is passed to the PNG encoder, which dominates the run time at higher levels.
+    """
+    try:
+        heights = np.array(Image.open(heightmap_path).convert('L'))
+    except FileNotFoundError:
+        print(f"Error: Heightmap not found at {heightmap_path}")
+        return
+    except Exception as e:
+        print(f"Error opening image {heightmap_path}: {e}")
+        return
+
+    height, width = heights.shape
+    normals = np.empty((height, width, 3), dtype=np.uint8)
+    slope = np.empty((height, width), dtype=np.uint8)
+
+    def process_tile(y: int, x: int):
+        # One pixel of halo on each side, clipped at the map border
+        y0, x0 = max(y - 1, 0), max(x - 1, 0)
+        y1, x1 = min(y + tile_size + 1, height), min(x + tile_size + 1, width)
+        tile_normals, tile_slope = normals_and_slope(heights[y0:y1, x0:x1], height_scale)
+        inner = (slice(y - y0, y - y0 + min(tile_size, height - y)), slice(x - x0, x - x0 + min(tile_size, width - x)))
+        normals[y:y + tile_size, x:x + tile_size] = tile_normals[inner]
+        slope[y:y + tile_size, x:x + tile_size] = tile_slope[inner]
+
+    tiles = [(y, x) for y in range(0, height, tile_size) for x in range(0, width, tile_size)]
+    print(f"Computing normals and slope on {len(tiles)} tiles with {jobs} jobs")
+    if jobs > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            list(executor.map(lambda tile: process_tile(*tile), tiles))
+    else:
+        for tile in tiles:
+            process_tile(*tile)
+
+    for image, path, name in [
+        (Image.fromarray(normals, 'RGB'), normal_map_path, "normal map"),
+        (Image.fromarray(slope, 'L'), slope_map_path, "slope map"),
+    ]:
+        try:
+            image.save(path, "PNG", compress_level=compress_level)
+            print(f"Successfully saved {name} to {path}")
+        except Exception as e:
+            print(f"Error saving image {path}: {e}")
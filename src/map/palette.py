@@ -0,0 +1,138 @@
+from pathlib import Path
+from PIL import Image
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+from .province import open_province_image, save_province_image, pack_colors, unpack_colors
+
+Color = Tuple[int, int, int]
+
+
+def build_color_lookup(mapping: Dict[Color, Color]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Build a 2^24 entry lookup table from packed 0xRRGGBB colors to their new value.
+    Colors not in the mapping map to themselves.
+    Returns the lookup table and the packed source colors of the mapping.
+    """
+    if not mapping:
+        return np.arange(1 << 24, dtype=np.uint32), np.zeros(0, dtype=np.uint32)
+    old_colors = pack_colors(np.array(list(mapping.keys()), dtype=np.uint8))
+    new_colors = pack_colors(np.array(list(mapping.values()), dtype=np.uint8))
+    lookup = np.arange(1 << 24, dtype=np.uint32)
+    lookup[old_colors] = new_colors
+    return lookup, old_colors
+
+
+def remap_colors(
+        image_array: np.ndarray,
+        mapping: Dict[Color, Color],
+        tile_height: int | None = None,
+) -> Tuple[np.ndarray, List[Color]]:
+    """
+    Replace every color of an (H, W, 3) RGB array following mapping, in one pass.
+    All replacements happen at once: {a: b, b: c} turns a into b and b into c.
+    With tile_height, the array is processed in horizontal bands of that many rows
+    to bound the temporary memory. The array is modified in place and returned.
+    Also returns the mapped colors that do not appear in the image.
+    """
+    lookup, old_colors = build_color_lookup(mapping)
+    present = np.zeros(1 << 24, dtype=bool)
+
+    height = image_array.shape[0]
+    tile_height = tile_height or height
+    for y in range(0, height, tile_height):
+        band = image_array[y:y + tile_height]
+        packed = pack_colors(band)
+        present[packed] = True
+        band[...] = unpack_colors(lookup[packed])
+
+    missing = [tuple(int(c) for c in color) for color in unpack_colors(old_colors[~present[old_colors]])]
+    return image_array, missing
+
+
+def remap_province_map(
+        original_province_map_path: Path,
+        destination_province_map_path: Path,
+        mapping: Dict[Color, Color],
+        tile_height: int | None = 1024,
+) -> List[Color] | None:
+    """
+    Apply a {old_rgb: new_rgb} mapping to a province map and save it as RGB PNG.
+    Used to merge provinces, renumber them or give new colors to baronies.
+    Returns the mapped colors that were not found in the map.
+    """
+    original_image = open_province_image(original_province_map_path)
+    if original_image is None:
+        return
+
+    print(f"Remapping {len(mapping)} province colors")
+    image_array, missing = remap_colors(np.array(original_image), mapping, tile_height)
+    if missing:
+        print(f"Warning: {len(missing)} mapped colors not found in {original_province_map_path}: {missing[:10]}")
+
+    save_province_image(Image.fromarray(image_array, 'RGB'), destination_province_map_path)
+    return missing
+
+
+class ColorAllocator:
+    """
+    Hands out province colors that are not used yet, in a reproducible order.
+
+    Used colors are flagged in a 2^24 entry table indexed by packed 0xRRGGBB color.
+    Every used or allocated color also blocks the colors closer than min_distance on
+    each channel, so that new colors can be told apart from their neighbours in an editor.
+    Candidates are tried in a shuffled order fixed by seed, one table lookup each.
+    """
+
+    def __init__(self, min_distance: int = 1, seed: int = 0, reserved: Sequence[Color] = ((0, 0, 0), (255, 255, 255))):
+        if min_distance < 1:
+            # An empty cube would block nothing, not even the used colors themselves
+            raise ValueError(f"min_distance must be at least 1, got {min_distance}")
+        self.blocked = np.zeros(1 << 24, dtype=bool)
+        radius = np.arange(-(min_distance - 1), min_distance)
+        self.cube = np.stack(np.meshgrid(radius, radius, radius, indexing='ij'), axis=-1).reshape(-1, 3)
+        self.packed_cube = (self.cube[:, 0] << 16) + (self.cube[:, 1] << 8) + self.cube[:, 2]
+        self.radius = min_distance - 1
+        self.order = np.random.default_rng(seed).permutation(1 << 24).astype(np.uint32)
+        self.cursor = 0
+        self.mark_used(np.array(reserved, dtype=np.uint8).reshape(-1, 3))
+
+    def mark_used(self, colors: np.ndarray):
+        """Block an (n, 3) array of colors and their neighbourhood"""
+        colors = np.asarray(colors, dtype=np.int32).reshape(-1, 3)
+        if len(colors) == 0:
+            return
+        # Blocking the unique colors is enough, a province map has few of them
+        colors = np.unique(colors, axis=0)
+        for start in range(0, len(colors), 4096):
+            neighbours = (colors[start:start + 4096, None, :] + self.cube[None, :, :]).reshape(-1, 3)
+            neighbours = neighbours[((neighbours >= 0) & (neighbours <= 255)).all(axis=1)]
+            self.blocked[pack_colors(neighbours.astype(np.uint8))] = True
+
+    def mark_image(self, image_array: np.ndarray, tile_height: int = 1024):
+        """Block every color of an (H, W, 3) province map"""
+        present = np.zeros(1 << 24, dtype=bool)
+        for y in range(0, image_array.shape[0], tile_height):
+            present[pack_colors(image_array[y:y + tile_height])] = True
+        self.mark_used(unpack_colors(np.flatnonzero(present).astype(np.uint32)))
+
+    def allocate(self, n: int = 1) -> np.ndarray:
+        """Return n new colors as an (n, 3) uint8 array. Raises ValueError when the color space is full."""
+        allocated = np.empty(n, dtype=np.uint32)
+        blocked, order = self.blocked, self.order
+        found = 0
+        while found < n:
+            if self.cursor >= len(order):
+                raise ValueError(f"No free color left after allocating {found} of {n}")
+            packed = int(order[self.cursor])
+            self.cursor += 1
+            if blocked[packed]:
+                continue
+            allocated[found] = packed
+            found += 1
+            channels = (packed >> 16, (packed >> 8) & 255, packed & 255)
+            if all(self.radius <= c <= 255 - self.radius for c in channels):
+                # The cube stays inside the color space: offsets can be added to the packed color
+                blocked[packed + self.packed_cube] = True
+            else:
+                self.mark_used(np.array([channels]))
+        return unpack_colors(allocated)
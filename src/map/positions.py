@@ -0,0 +1,205 @@
+from pathlib import Path
+from typing import Dict, List, Tuple
+import re
+import numpy as np
+from src.utils.paradox_file_parser import read_game_text
+
+POSITIONS_BLOCK = re.compile(
+    r'(?P<id>\d+)\s*=\s*\{\s*position\s*=\s*\{(?P<position>[^}]*)\}'
+    r'(?:\s*rotation\s*=\s*\{(?P<rotation>[^}]*)\})?'
+)
+
+
+def transform_coordinates(
+        xs: np.ndarray,
+        ys: np.ndarray,
+        original_dimensions: tuple[int, int],
+        conversion_scale: float,
+        conversion_offset: tuple[int, int],
+        destination_dimensions: tuple[int, int],
+        flip_y: bool = True,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Apply the bitmap scale and offset to map coordinates.
+    With flip_y, y counts from the bottom of the map like in positions.txt: it is
+    turned into an image row, transformed, and turned back for the destination map.
+    Coordinates outside the destination map are clamped and flagged.
+    Returns new xs, ys and the boolean mask of clamped coordinates.
+    """
+    xs = np.asarray(xs, dtype=np.float64) * conversion_scale + conversion_offset[0]
+    ys = np.asarray(ys, dtype=np.float64)
+    if flip_y:
+        ys = original_dimensions[1] - ys
+    ys = ys * conversion_scale + conversion_offset[1]
+    if flip_y:
+        ys = destination_dimensions[1] - ys
+
+    width, height = destination_dimensions
+    outside = (xs < 0) | (xs > width - 1) | (ys < 0) | (ys > height - 1)
+    return np.clip(xs, 0, width - 1), np.clip(ys, 0, height - 1), outside
+
+
+def read_positions(positions_path: Path) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Read every province position of a CK2 map/positions.txt.
+    Returns province ids (n,), positions (n, k, 2) and rotations (n, k), padded with nan
+    when provinces have fewer than k positions.
+    """
+    matches = list(POSITIONS_BLOCK.finditer(read_game_text(positions_path)))
+    ids = np.array([int(match['id']) for match in matches], dtype=np.int64)
+    values = [np.array(match['position'].split(), dtype=np.float64) for match in matches]
+    rotations = [np.array((match['rotation'] or '').split(), dtype=np.float64) for match in matches]
+
+    n_positions = max((len(value) // 2 for value in values), default=0)
+    positions = np.full((len(ids), n_positions, 2), np.nan)
+    all_rotations = np.full((len(ids), n_positions), np.nan)
+    for i, (value, rotation) in enumerate(zip(values, rotations)):
+        positions[i, :len(value) // 2] = value[:len(value) // 2 * 2].reshape(-1, 2)
+        all_rotations[i, :min(len(rotation), n_positions)] = rotation[:n_positions]
+    return ids, positions, all_rotations
+
+
+def write_building_locators(
+        locators_path: Path,
+        ids: np.ndarray,
+        positions: np.ndarray,
+        rotations: np.ndarray,
+):
+    """Write a CK3 gfx/map/map_object_data/building_locators.txt, positions are (x, z) map coordinates"""
+    half_angles = np.nan_to_num(rotations) / 2
+    locators_path = Path(locators_path)
+    locators_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(locators_path, "w", encoding="utf-8-sig") as file:
+        file.write("game_object_locator={\n")
+        file.write('\tname="buildings"\n')
+        file.write("\tclamp_to_water_level=yes\n")
+        file.write("\trender_under_water=no\n")
+        file.write("\tgenerated_content=no\n")
+        file.write('\tlayer="building_layer"\n')
+        file.write("\tinstances={\n")
+        for province_id, (x, z), half_angle in zip(ids.tolist(), positions.tolist(), half_angles.tolist()):
+            file.write("\t\t{\n")
+            file.write(f"\t\t\tid={province_id}\n")
+            file.write(f"\t\t\tposition={{ {x:.6f} 0.000000 {z:.6f} }}\n")
+            file.write(f"\t\t\trotation={{ 0.000000 {np.sin(half_angle):.6f} 0.000000 {np.cos(half_angle):.6f} }}\n")
+            file.write("\t\t\tscale={ 1.000000 1.000000 1.000000 }\n")
+            file.write("\t\t}\n")
+        file.write("\t}\n}\n")
+
+
+def convert_positions(
+        original_positions_path: Path,
+        locators_path: Path,
+        original_dimensions: tuple[int, int],
+        conversion_scale: float,
+        conversion_offset: tuple[int, int],
+        destination_dimensions: tuple[int, int],
+) -> List[int] | None:
+    """
+    take in map/positions.txt
+    Transform every position at once and keep the first one of each province as its building locator.
+    return gfx/map/map_object_data/building_locators.txt and the ids of provinces clamped into the map
+    """
+    try:
+        ids, positions, rotations = read_positions(original_positions_path)
+    except FileNotFoundError:
+        print(f"Error: Positions not found at {original_positions_path}")
+        return
+    if len(ids) == 0:
+        print(f"Warning: No positions found in {original_positions_path}")
+        return []
+
+    xs, ys, outside = transform_coordinates(
+        positions[..., 0], positions[..., 1],
+        original_dimensions, conversion_scale, conversion_offset, destination_dimensions,
+    )
+    # Missing positions are nan, they are not outside the map
+    outside &= ~np.isnan(positions[..., 0])
+    clamped_ids = ids[outside.any(axis=1)].tolist()
+    if clamped_ids:
+        print(f"Warning: {len(clamped_ids)} provinces have positions outside the map, clamped: {clamped_ids[:10]}")
+
+    write_building_locators(locators_path, ids, np.stack([xs[:, 0], ys[:, 0]], axis=1), rotations[:, 0])
+    print(f"Successfully saved {len(ids)} building locators to {locators_path}")
+    return clamped_ids
+
+
+CK3_ADJACENCIES_HEADER = ["From", "To", "Type", "Through", "start_x", "start_y", "stop_x", "stop_y", "Comment"]
+
+
+def convert_adjacencies(
+        original_adjacencies_path: Path,
+        converted_adjacencies_path: Path,
+        original_dimensions: tuple[int, int],
+        conversion_scale: float,
+        conversion_offset: tuple[int, int],
+        destination_dimensions: tuple[int, int],
+        flip_y: bool = True,
+) -> List[int] | None:
+    """
+    take in map/adjacencies.csv
+    Rewrite it with the CK3 columns. Coordinates, when the original has them, are
+    transformed all at once; -1 (unset) stays -1. Comment lines are kept.
+    return map_data/adjacencies.csv and the line numbers of clamped coordinates
+    """
+    try:
+        lines = read_game_text(original_adjacencies_path).splitlines()
+    except FileNotFoundError:
+        print(f"Error: Adjacencies not found at {original_adjacencies_path}")
+        return
+    if not lines:
+        return []
+
+    header = [column.strip() for column in lines[0].split(";")]
+    columns = {name.lower(): i for i, name in enumerate(header)}
+    coordinate_columns = [columns.get(name) for name in ("start_x", "start_y", "stop_x", "stop_y")]
+    has_coordinates = all(column is not None for column in coordinate_columns)
+    comment_column = columns.get("comment", len(header) - 1)
+
+    rows = []
+    for line in lines[1:]:
+        if not line.strip() or line.lstrip().startswith("#"):
+            rows.append(line)
+        else:
+            rows.append(line.split(";"))
+    data_rows = [i for i, row in enumerate(rows) if isinstance(row, list)]
+
+    coordinates = np.full((len(data_rows), 4), -1., dtype=np.float64)
+    if has_coordinates:
+        for n, i in enumerate(data_rows):
+            row = rows[i]
+            for k, column in enumerate(coordinate_columns):
+                if column < len(row) and row[column].strip():
+                    coordinates[n, k] = float(row[column])
+
+    clamped_lines = []
+    for start in (0, 2):
+        unset = (coordinates[:, start] == -1) & (coordinates[:, start + 1] == -1)
+        xs, ys, outside = transform_coordinates(
+            coordinates[:, start], coordinates[:, start + 1],
+            original_dimensions, conversion_scale, conversion_offset, destination_dimensions, flip_y,
+        )
+        coordinates[:, start] = np.where(unset, -1, np.round(xs))
+        coordinates[:, start + 1] = np.where(unset, -1, np.round(ys))
+        clamped_lines += [data_rows[n] + 2 for n in np.flatnonzero(outside & ~unset)]
+    coordinates = coordinates.astype(np.int64).tolist()
+
+    converted_adjacencies_path = Path(converted_adjacencies_path)
+    converted_adjacencies_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(converted_adjacencies_path, "w", encoding="utf-8") as file:
+        file.write(";".join(CK3_ADJACENCIES_HEADER) + "\n")
+        n = 0
+        for row in rows:
+            if not isinstance(row, list):
+                file.write(row + "\n")
+                continue
+            values = [row[columns[name]] if columns.get(name) is not None and columns[name] < len(row) else ""
+                      for name in ("from", "to", "type", "through")]
+            comment = row[comment_column] if comment_column < len(row) and comment_column >= 4 else ""
+            file.write(";".join(values + [str(value) for value in coordinates[n]] + [comment]) + "\n")
+            n += 1
+
+    if clamped_lines:
+        print(f"Warning: {len(clamped_lines)} adjacency coordinates outside the map, clamped on lines {sorted(set(clamped_lines))[:10]}")
+    print(f"Successfully saved adjacencies to {converted_adjacencies_path}")
+    return sorted(set(clamped_lines))
@@ -1,48 +1,245 @@
 from pathlib import Path
 from PIL import Image
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from src.utils.timing import PhaseTimer, timed
 
 
-def convert_province_map(
-        original_province_map_path: Path,
-        destination_province_map_path: Path,
-        conversion_scale: float,
-        conversion_offset: tuple[int, int],
-        destination_dimensions: tuple[int, int],
-):
-    """Convert the province map using nearest-neighbor scaling and converting to RGB 8bpc."""
+@dataclass
+class ProvinceFragment:
+    """A disconnected piece of a province that was given to a neighbouring province."""
+    color: Tuple[int, int, int]       # Province the fragment was cut from
+    new_color: Tuple[int, int, int]   # Province the fragment was merged into
+    size: int                         # Number of pixels
+    x: int                            # One pixel of the fragment, for locating it in an editor
+    y: int
+
+
+def pack_colors(image_array: np.ndarray) -> np.ndarray:
+    """Pack an (H, W, 3) RGB array into an (H, W) uint32 array of 0xRRGGBB values."""
+    image_array = image_array.astype(np.uint32)
+    return (image_array[..., 0] << 16) | (image_array[..., 1] << 8) | image_array[..., 2]
+
+
+def unpack_colors(packed: np.ndarray) -> np.ndarray:
+    """Inverse of pack_colors: return an (..., 3) uint8 RGB array."""
+    packed = np.asarray(packed, dtype=np.uint32)
+    return np.stack(
+        [(packed >> 16) & 0xFF, (packed >> 8) & 0xFF, packed & 0xFF],
+        axis=-1
+    ).astype(np.uint8)
+
+
+def index_colors(packed: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Turn packed colors into a dense index raster.
+    Returns the sorted distinct colors and an int32 raster of indices into them.
+    Uses a 2^24 lookup table instead of sorting the whole map.
+    """
+    present = np.zeros(1 << 24, dtype=bool)
+    present[packed] = True
+    colors = np.flatnonzero(present).astype(np.uint32)
+    lookup = np.zeros(1 << 24, dtype=np.int32)
+    lookup[colors] = np.arange(len(colors), dtype=np.int32)
+    return colors, lookup[packed]
+
+
+def province_id_raster(image_array: np.ndarray, color_to_id: Dict[Tuple[int, int, int], int]) -> np.ndarray:
+    """int32 raster of province ids from an RGB province map, 0 for colors not in color_to_id"""
+    lookup = np.zeros(1 << 24, dtype=np.int32)
+    colors = np.array(list(color_to_id.keys()), dtype=np.uint32).reshape(-1, 3)
+    lookup[(colors[:, 0] << 16) | (colors[:, 1] << 8) | colors[:, 2]] = list(color_to_id.values())
+    return lookup[pack_colors(image_array)]
+
+
+def label_regions(index: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Connected regions of equal values (4-connectivity) of a whole raster in one pass.
+
+    Rows are cut into runs of equal values, runs of the same value that touch between
+    two rows are joined, and the connected components of that run graph are the regions.
+    Returns the int32 region raster, the value of each region and its size in pixels.
+    """
+    height, width = index.shape
+    changes = np.ones(index.shape, dtype=bool)
+    changes[:, 1:] = index[:, 1:] != index[:, :-1]
+    run_starts = np.flatnonzero(changes)
+    runs = (np.cumsum(changes, dtype=np.int32) - 1).reshape(index.shape)
+
+    # Two runs overlapping across rows overlap from a pixel where one of them starts
+    touching = (index[1:] == index[:-1]) & (changes[1:] | changes[:-1])
+    upper, lower = runs[:-1][touching], runs[1:][touching]
+    graph = coo_matrix((np.ones(len(upper), dtype=np.int8), (upper, lower)), shape=(len(run_starts),) * 2)
+    n_regions, run_regions = connected_components(graph, directed=False)
+
+    run_lengths = np.diff(np.append(run_starts, index.size))
+    region_sizes = np.bincount(run_regions, weights=run_lengths, minlength=n_regions).astype(np.int64)
+    region_values = np.empty(n_regions, dtype=index.dtype)
+    region_values[run_regions] = index.ravel()[run_starts]
+    return run_regions.astype(np.int32)[runs], region_values, region_sizes
+
+
+def cleanup_province_fragments(
+        image_array: np.ndarray,
+        min_fragment_size: int,
+) -> Tuple[np.ndarray, List[ProvinceFragment]]:
+    """
+    Reassign small disconnected pieces of provinces to their neighbours.
+
+    Nearest-neighbour rescaling at a fractional scale leaves one pixel slivers and
+    split provinces. Connected regions of every province are labelled at once over the
+    whole map. The largest region of a province is always kept, other regions smaller
+    than min_fragment_size go to the province they share the longest border with.
+    """
+    colors, index = index_colors(pack_colors(image_array))
+    regions, region_provinces, region_sizes = label_regions(index)
+
+    # Largest region of each province: sort by size and keep the last per province
+    order = np.lexsort((region_sizes, region_provinces))
+    is_largest = np.zeros(len(region_sizes), dtype=bool)
+    is_largest[order[np.r_[region_provinces[order][1:] != region_provinces[order][:-1], True]]] = True
+    is_fragment = ~is_largest & (region_sizes < min_fragment_size)
+    if not is_fragment.any():
+        return unpack_colors(colors[index]), []
+
+    # Collect (fragment, neighbour province) pairs across the 4 borders
+    in_fragment = is_fragment[regions]
+    pairs = []
+    for a_in_fragment, a_regions, a_index, b_index in (
+        (in_fragment[:, :-1], regions[:, :-1], index[:, :-1], index[:, 1:]),
+        (in_fragment[:, 1:], regions[:, 1:], index[:, 1:], index[:, :-1]),
+        (in_fragment[:-1, :], regions[:-1, :], index[:-1, :], index[1:, :]),
+        (in_fragment[1:, :], regions[1:, :], index[1:, :], index[:-1, :]),
+    ):
+        border = a_in_fragment & (a_index != b_index)
+        pairs.append(a_regions[border].astype(np.int64) * len(colors) + b_index[border])
+    pairs, counts = np.unique(np.concatenate(pairs), return_counts=True)
+    fragments, neighbours = pairs // len(colors), pairs % len(colors)
+
+    # Most shared border per fragment: sort by count and keep the last per fragment
+    order = np.lexsort((counts, fragments))
+    fragments, neighbours = fragments[order], neighbours[order]
+    last = np.r_[fragments[1:] != fragments[:-1], True]
+    fragments, neighbours = fragments[last], neighbours[last]
+
+    targets = region_provinces.copy()
+    targets[fragments] = neighbours
+    fragment_pixels = np.flatnonzero(in_fragment)
+    fragment_regions = regions.ravel()[fragment_pixels]
+    cleaned = index.copy()
+    cleaned.ravel()[fragment_pixels] = targets[fragment_regions]
+
+    # First pixel of each fragment in raster order, for the report
+    first_pixels = np.full(len(region_sizes), index.size, dtype=np.int64)
+    np.minimum.at(first_pixels, fragment_regions, fragment_pixels)
+    rgb = unpack_colors(colors).tolist()
+    report = [
+        ProvinceFragment(
+            color=tuple(rgb[province]),
+            new_color=tuple(rgb[neighbour]),
+            size=int(region_sizes[fragment]),
+            x=int(first_pixels[fragment] % index.shape[1]),
+            y=int(first_pixels[fragment] // index.shape[1]),
+        )
+        for fragment, province, neighbour in zip(
+            fragments.tolist(), region_provinces[fragments].tolist(), neighbours.tolist()
+        )
+    ]
+    return unpack_colors(colors[cleaned]), report
+
+
+def print_fragment_report(report: List[ProvinceFragment]):
+    """Print one line per changed province"""
+    if not report:
+        print("No province fragments reassigned.")
+        return
+    changed = {}
+    for fragment in report:
+        lost, pieces = changed.get(fragment.color, (0, 0))
+        changed[fragment.color] = (lost + fragment.size, pieces + 1)
+    print(f"Reassigned {len(report)} fragments from {len(changed)} provinces:")
+    for color, (lost, pieces) in sorted(changed.items()):
+        print(f"  {color}: {pieces} fragments, {lost} pixels")
+
+
+def open_province_image(province_map_path: Path) -> Image.Image | None:
+    """Open a province map as 8bpc RGB, None if it cannot be read."""
     try:
-        original_image = Image.open(original_province_map_path)
+        image = Image.open(province_map_path)
     except FileNotFoundError:
-        print(f"Error: Original heightmap not found at {original_province_map_path}")
+        print(f"Error: Province map not found at {province_map_path}")
         return
     except Exception as e:
-        print(f"Error opening image {original_province_map_path}: {e}")
+        print(f"Error opening image {province_map_path}: {e}")
         return
-    
-    # Convert to 8bpc RGB
-    if original_image.mode != 'RGB':
-        print(f"Converting image {original_province_map_path} to 8bpc RGB ('RGB' mode)")
-        original_image = original_image.convert('RGB')
 
-    original_dimensions = original_image.size
-    try:
-        resized_image = original_image.resize(
-            (
-                int(original_dimensions[0] * conversion_scale),
-                int(original_dimensions[1] * conversion_scale)
-            ),
-            Image.Resampling.NEAREST
-        )
-    except ValueError as e:
-        print(f"Error resizing image: {e}. Check conversion_scale.")
-        return
+    # Convert to 8bpc RGB
+    if image.mode != 'RGB':
+        print(f"Converting image {province_map_path} to 8bpc RGB ('RGB' mode)")
+        image = image.convert('RGB')
+    return image
 
-    final_image = Image.new(resized_image.mode, destination_dimensions, 0)
-    paste_x, paste_y = conversion_offset
-    final_image.paste(resized_image, (paste_x, paste_y))
 
+def save_province_image(image: Image.Image, province_map_path: Path):
+    """Save a province map as RGB PNG"""
     try:
-        final_image.save(destination_province_map_path, "PNG")
-        print(f"Successfully saved converted province map to {destination_province_map_path}")
+        image.save(province_map_path, "PNG")
+        print(f"Successfully saved converted province map to {province_map_path}")
     except Exception as e:
-        print(f"Error saving image {destination_province_map_path}: {e}")
+        print(f"Error saving image {province_map_path}: {e}")
+
+
+def convert_province_map(
+        original_province_map_path: Path,
+        destination_province_map_path: Path,
+        conversion_scale: float,
+        conversion_offset: tuple[int, int],
+        destination_dimensions: tuple[int, int],
+        min_fragment_size: int = 0,
+        timer: PhaseTimer | None = None,
+) -> List[ProvinceFragment] | None:
+    """
+    Convert the province map using nearest-neighbor scaling and converting to RGB 8bpc.
+    If min_fragment_size > 0, disconnected province pieces smaller than that are merged
+    into their neighbours and the list of changes is returned.
+    timer, if given, gets the time of the decode, resample, cleanup and encode phases.
+    """
+    with timed(timer, "decode"):
+        original_image = open_province_image(original_province_map_path)
+        if original_image is None:
+            return
+        original_image.load()
+
+    with timed(timer, "resample"):
+        original_dimensions = original_image.size
+        try:
+            resized_image = original_image.resize(
+                (
+                    int(original_dimensions[0] * conversion_scale),
+                    int(original_dimensions[1] * conversion_scale)
+                ),
+                Image.Resampling.NEAREST
+            )
+        except ValueError as e:
+            print(f"Error resizing image: {e}. Check conversion_scale.")
+            return
+
+        final_image = Image.new(resized_image.mode, destination_dimensions, 0)
+        paste_x, paste_y = conversion_offset
+        final_image.paste(resized_image, (paste_x, paste_y))
+
+    report = []
+    if min_fragment_size > 0:
+        with timed(timer, "cleanup"):
+            print(f"Merging province fragments smaller than {min_fragment_size} pixels")
+            cleaned_array, report = cleanup_province_fragments(np.array(final_image), min_fragment_size)
+            final_image = Image.fromarray(cleaned_array)
+        print_fragment_report(report)
+
+    with timed(timer, "encode"):
+        save_province_image(final_image, destination_province_map_path)
+
+    return report
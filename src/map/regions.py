@@ -0,0 +1,232 @@
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+import numpy as np
+from src.utils.paradox_file_parser import regex_paradox_parser
+
+# Members a region block can list, in the order CK3 writes them
+REGION_MEMBERS = ["duchies", "counties", "provinces", "regions"]
+
+
+def read_regions(region_path: Path) -> Dict[str, Dict[str, list]]:
+    """
+    Read a geographical_region.txt or island_region.txt file.
+    Returns {region: {"provinces": [...], "regions": [...], "duchies": [...], "counties": [...]}},
+    with only the members the region lists.
+    """
+    regions = {}
+    for name, block in regex_paradox_parser(region_path).items():
+        if not isinstance(block, dict):
+            continue
+        members = {}
+        for key in REGION_MEMBERS:
+            value = block.get(key)
+            if value is None:
+                continue
+            members[key] = value if isinstance(value, list) else [value]
+        members["provinces"] = [int(province) for province in members.get("provinces", [])]
+        regions[name] = members
+    return regions
+
+
+class RegionIndex:
+    """
+    Province membership of every region as rows of a bit matrix.
+
+    Bit p of row r is set when province id p is in region r, nested regions included.
+    Rows are packed 8 provinces per byte (little bit order), so unions, intersections
+    and lookups are a few NumPy operations whatever the number of regions.
+    """
+
+    def __init__(self, regions: Dict[str, Dict[str, list]], n_provinces: int | None = None,
+                 title_provinces: Dict[str, Iterable[int]] | None = None):
+        """
+        regions is read_regions output, possibly merged from several files.
+        title_provinces maps duchy and county titles to their provinces, without it
+        duchies and counties members are kept for export but not indexed.
+        """
+        self.regions = regions
+        self.names = list(regions)
+        self.name_to_index = {name: index for index, name in enumerate(self.names)}
+        title_provinces = title_provinces or {}
+
+        direct = {
+            name: list(members.get("provinces", [])) + [
+                province
+                for key in ("duchies", "counties")
+                for title in members.get(key, [])
+                for province in title_provinces.get(title, [])
+            ]
+            for name, members in regions.items()
+        }
+        if n_provinces is None:
+            n_provinces = max((max(provinces) for provinces in direct.values() if provinces), default=0) + 1
+        self.n_provinces = n_provinces
+        self.bits = np.zeros((len(self.names), -(-n_provinces // 8)), dtype=np.uint8)
+
+        # Direct provinces first, then nested regions once their own rows are complete
+        for name, provinces in direct.items():
+            self.bits[self.name_to_index[name]] = self.pack(provinces)
+        for name in self.resolution_order():
+            row = self.name_to_index[name]
+            for child in regions[name].get("regions", []):
+                if child in self.name_to_index:
+                    self.bits[row] |= self.bits[self.name_to_index[child]]
+
+    def resolution_order(self) -> List[str]:
+        """Regions ordered so that nested regions come before the regions listing them"""
+        order, state = [], {}
+        for root in self.names:
+            if root in state:
+                continue
+            stack = [(root, iter(self.regions[root].get("regions", [])))]
+            state[root] = "visiting"
+            while stack:
+                name, children = stack[-1]
+                child = next(children, None)
+                if child is None:
+                    stack.pop()
+                    state[name] = "done"
+                    order.append(name)
+                elif child not in self.regions:
+                    print(f"Warning: region {name} lists unknown region {child}")
+                elif state.get(child) == "visiting":
+                    print(f"Warning: region {child} contains itself through {name}, ignoring the loop")
+                elif child not in state:
+                    state[child] = "visiting"
+                    stack.append((child, iter(self.regions[child].get("regions", []))))
+        return order
+
+    def pack(self, provinces: Iterable[int]) -> np.ndarray:
+        """Packed bit row of a list of province ids"""
+        mask = np.zeros(self.bits.shape[1] * 8, dtype=bool)
+        provinces = np.fromiter(provinces, dtype=np.int64)
+        mask[provinces[(provinces >= 0) & (provinces < self.n_provinces)]] = True
+        return np.packbits(mask, bitorder='little')
+
+    def rows(self, names: Iterable[str] | str) -> np.ndarray:
+        """Bit rows of one or several regions"""
+        if isinstance(names, str):
+            return self.bits[self.name_to_index[names]]
+        return self.bits[[self.name_to_index[name] for name in names]]
+
+    def mask(self, row: np.ndarray) -> np.ndarray:
+        """Boolean array over province ids of a bit row"""
+        return np.unpackbits(row, bitorder='little', count=self.n_provinces).astype(bool)
+
+    def provinces(self, name: str) -> np.ndarray:
+        """Sorted province ids of a region"""
+        return np.flatnonzero(self.mask(self.rows(name)))
+
+    def union(self, names: Iterable[str]) -> np.ndarray:
+        return np.bitwise_or.reduce(self.rows(list(names)), axis=0)
+
+    def intersection(self, names: Iterable[str]) -> np.ndarray:
+        return np.bitwise_and.reduce(self.rows(list(names)), axis=0)
+
+    def lookup(self, row: np.ndarray, province_ids) -> np.ndarray:
+        """Whether each province id is set in a bit row"""
+        province_ids = np.asarray(province_ids, dtype=np.int64)
+        inside = (province_ids >= 0) & (province_ids < self.n_provinces)
+        clipped = np.where(inside, province_ids, 0)
+        return inside & ((row[clipped >> 3] >> (clipped & 7)) & 1).astype(bool)
+
+    def contains(self, name: str, province_ids) -> np.ndarray:
+        """Whether each province id is in the region"""
+        return self.lookup(self.rows(name), province_ids)
+
+    def membership(self, province_ids) -> np.ndarray:
+        """(len(province_ids), n_regions) boolean matrix of which regions hold each province"""
+        province_ids = np.asarray(province_ids, dtype=np.int64)
+        inside = (province_ids >= 0) & (province_ids < self.n_provinces)
+        clipped = np.where(inside, province_ids, 0)
+        return inside[:, None] & ((self.bits[:, clipped >> 3] >> (clipped & 7)) & 1).astype(bool).T
+
+    def regions_of(self, province_id: int) -> List[str]:
+        return [self.names[i] for i in np.flatnonzero(self.membership([province_id])[0])]
+
+    def overlaps(self, names: List[str] | None = None) -> List[Tuple[str, str, int]]:
+        """
+        Pairs of regions sharing provinces, with the number of shared provinces.
+        A region and a region it contains (directly or not) are not reported.
+        """
+        names = self.names if names is None else names
+        rows = self.rows(names)
+        sizes = np.bitwise_count(rows).sum(axis=1)
+        overlaps = []
+        for i in range(len(names)):
+            shared = np.bitwise_count(rows[i + 1:] & rows[i]).sum(axis=1)
+            for j in np.flatnonzero(shared) + i + 1:
+                count = int(shared[j - i - 1])
+                if count != sizes[i] and count != sizes[j]:
+                    overlaps.append((names[i], names[j], count))
+        return overlaps
+
+    def unassigned(self, province_ids) -> np.ndarray:
+        """Province ids that are in no region"""
+        province_ids = np.asarray(province_ids, dtype=np.int64)
+        assigned = np.bitwise_or.reduce(self.bits, axis=0) if len(self.names) else np.zeros(self.bits.shape[1], np.uint8)
+        return province_ids[~self.lookup(assigned, province_ids)]
+
+    def write_ck3_regions(self, destination_path: Path, flatten: bool = False, province_ids: Dict[int, int] | None = None):
+        """
+        Write the regions in CK3 geographical_region syntax.
+        By default the regions keep their own members and nested regions.
+        flatten writes every region as the plain list of its indexed provinces.
+        province_ids renumbers the provinces, ids missing from it are dropped.
+        """
+        def province_list(provinces) -> List[int]:
+            provinces = [int(p) for p in provinces]
+            if province_ids is not None:
+                provinces = [province_ids[p] for p in provinces if p in province_ids]
+            return provinces
+
+        lines = []
+        for name in self.names:
+            lines.append(f"{name} = {{")
+            if flatten:
+                members = {"provinces": province_list(self.provinces(name))}
+            else:
+                members = dict(self.regions[name])
+                members["provinces"] = province_list(members.get("provinces", []))
+            for key in REGION_MEMBERS:
+                values = members.get(key)
+                if not values:
+                    continue
+                lines.append(f"\t{key} = {{")
+                for start in range(0, len(values), 20):
+                    lines.append("\t\t" + " ".join(str(value) for value in values[start:start + 20]))
+                lines.append("\t}")
+            lines.append("}")
+            lines.append("")
+
+        destination_path = Path(destination_path)
+        destination_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(destination_path, "w", encoding="utf-8-sig") as file:
+            file.write("\n".join(lines))
+        print(f"Successfully saved {len(self.names)} regions to {destination_path}")
+
+
+def convert_regions(
+        original_mod_folder: Path,
+        new_mod_folder: Path,
+        title_provinces: Dict[str, Iterable[int]] | None = None,
+) -> Tuple[RegionIndex, RegionIndex]:
+    """
+    take in map/geographical_region.txt and map/island_region.txt (names from map/default.map)
+    return map_data/geographical_regions/00_geographical_region.txt and map_data/island_region.txt
+    """
+    original_mod_folder, new_mod_folder = Path(original_mod_folder), Path(new_mod_folder)
+    default_map = regex_paradox_parser(original_mod_folder / "map" / "default.map")
+    max_provinces = int(default_map.get("max_provinces", 0)) or None
+
+    indices = []
+    for key, default_name, destination in (
+        ("geographical_region", "geographical_region.txt", Path("geographical_regions", "00_geographical_region.txt")),
+        ("region", "island_region.txt", Path("island_region.txt")),
+    ):
+        region_path = original_mod_folder / "map" / default_map.get(key, default_name)
+        regions = read_regions(region_path) if region_path.exists() else {}
+        index = RegionIndex(regions, max_provinces, title_provinces)
+        index.write_ck3_regions(new_mod_folder / "map_data" / destination)
+        indices.append(index)
+    return tuple(indices)
@@ -1,10 +1,14 @@
 from pathlib import Path
+import hashlib
 from PIL import Image, ImageChops
 import numpy as np
 from dataclasses import dataclass
 from typing import Optional, List, Tuple
 from scipy.interpolate import interp1d
 import random
+from array import array
+from .province import pack_colors, unpack_colors
+from src.utils.timing import PhaseTimer, timed
 
 # River map color constants
 RIVER_COLORS = {
@@ -14,6 +18,62 @@ RIVER_COLORS = {
     'WATER': (255, 0, 128),     # Magenta: sea/lakes/navigable rivers
     'LAND': (255, 255, 255),    # White: land
 }
+MARKER_COLORS = (RIVER_COLORS['SOURCE'], RIVER_COLORS['TRIBUTARY'], RIVER_COLORS['SPLIT'])
+
+# Format of the traced river cache files, to bump whenever the saved RiverNetwork changes.
+# 2: untraced pixels are saved
+RIVER_CACHE_VERSION = 2
+
+# River widths, from narrowest to widest
+RIVER_WIDTH_COLORS = [
+    (0, 225, 255),
+    (0, 200, 255),
+    (0, 150, 255),
+    (0, 100, 255),
+    (0, 0, 255),
+    (0, 0, 225),
+    (0, 0, 200),
+    (0, 0, 150),
+    (0, 0, 100),
+    (0, 85, 0),
+    (0, 125, 0),
+    (0, 158, 0),
+    (24, 206, 0),
+]
+
+# Classes of the uint8 river class raster
+RIVER_CLASSES = {
+    'LAND': 0,
+    'WATER': 1,
+    'SOURCE': 2,
+    'TRIBUTARY': 3,
+    'SPLIT': 4,
+    'OTHER': 255,               # Any color not listed: still a river pixel for the tracer
+}
+FIRST_WIDTH_CLASS = 5           # RIVER_WIDTH_COLORS[i] has class FIRST_WIDTH_CLASS + i
+
+# Class -> color, None for OTHER whose color has to be read from the image
+RIVER_CLASS_COLORS: List[Optional[Tuple[int, int, int]]] = [None] * 256
+for _name, _river_class in RIVER_CLASSES.items():
+    if _name != 'OTHER':
+        RIVER_CLASS_COLORS[_river_class] = RIVER_COLORS[_name]
+for _width, _color in enumerate(RIVER_WIDTH_COLORS):
+    RIVER_CLASS_COLORS[FIRST_WIDTH_CLASS + _width] = _color
+
+
+def classify_rivers(image_array: np.ndarray) -> np.ndarray:
+    """Turn an (H, W, 3) rivers map into a uint8 raster of RIVER_CLASSES"""
+    lookup = np.full(1 << 24, RIVER_CLASSES['OTHER'], dtype=np.uint8)
+    for river_class, color in enumerate(RIVER_CLASS_COLORS):
+        if color is not None:
+            lookup[(color[0] << 16) | (color[1] << 8) | color[2]] = river_class
+    return lookup[pack_colors(image_array)]
+
+
+def find_river_sources(river_classes: np.ndarray) -> np.ndarray:
+    """(y, x) of every SOURCE pixel in row-major order"""
+    return np.argwhere(river_classes == RIVER_CLASSES['SOURCE'])
+
 
 @dataclass
 class RiverPoint:
@@ -29,7 +89,12 @@ class River:
         self.end_pixel_color_type: str = ''
     
     def scale(self, factor: float, offset: tuple[int, int], deletion_rate: float = 0) -> 'River':
-        """Scale the river curve by a factor and ensure tributaries stay connected"""
+        """
+        Scale the river curve by a factor and ensure tributaries stay connected.
+        deletion_rate is the Douglas-Peucker tolerance in destination pixels: points closer
+        than that to the simplified line are dropped. 0 keeps every point.
+        Tributary attachment points, markers and width changes are always kept.
+        """
         # Scale main river points
         scaled_points = []
         for point in self.points:
@@ -40,6 +105,9 @@ class River:
             ))
         self.points = scaled_points
 
+        if deletion_rate > 0 and len(self.points) > 2:
+            self.simplify(deletion_rate)
+
         # Scale tributaries and ensure they stay connected
         for tributary, parent_idx in self.tributaries:
             # Get the parent point where this tributary connects
@@ -58,44 +126,312 @@ class River:
         
         return self
 
-    def follow(self, start_pixel: RiverPoint, image_array: np.ndarray, visited: set):
-        """Follow the river from the start pixel, building the river structure"""
-        current = start_pixel
-        self.points.append(current)
-        visited.add((int(current.x), int(current.y)))
+    def simplify(self, tolerance: float):
+        """Drop points with Douglas-Peucker and update the tributary attachment indices"""
+        colors = [point.color for point in self.points]
+        keep = np.zeros(len(self.points), dtype=bool)
+        # Around junctions: the points next to every attachment and the first step of a tributary,
+        # otherwise simplified segments of the two rivers cross or touch each other
+        attachments = np.array([parent_idx for _, parent_idx in self.tributaries], dtype=np.int64)
+        for shift in (-1, 0, 1):
+            keep[np.clip(attachments + shift, 0, len(keep) - 1)] = True
+        if self.start_pixel_color_type == 'TRIBUTARY':
+            keep[:2] = True
+        keep[[i for i, color in enumerate(colors) if color in MARKER_COLORS]] = True
+        # Width changes: keep both ends of the segment where the color changes
+        color_changes = np.array([colors[i] != colors[i - 1] for i in range(1, len(colors))])
+        keep[1:] |= color_changes
+        keep[:-1] |= color_changes
+
+        keep = simplify_polyline(
+            np.array([point.x for point in self.points]),
+            np.array([point.y for point in self.points]),
+            tolerance,
+            keep,
+        )
+        new_indices = np.cumsum(keep) - 1
+        self.points = [point for point, kept in zip(self.points, keep) if kept]
+        self.tributaries = [
+            (tributary, int(new_indices[parent_idx])) for tributary, parent_idx in self.tributaries
+        ]
+
+
+def simplify_polyline(
+        xs: np.ndarray,
+        ys: np.ndarray,
+        tolerance: float,
+        keep: np.ndarray | None = None,
+) -> np.ndarray:
+    """
+    Douglas-Peucker simplification without recursion.
+    keep marks points that must stay, the line is simplified between them.
+    Distances of a whole span to its chord are computed at once.
+    Returns the boolean mask of kept points.
+    """
+    mask = np.zeros(len(xs), dtype=bool) if keep is None else keep.copy()
+    mask[0] = mask[-1] = True
+    anchors = np.flatnonzero(mask)
+    stack = list(zip(anchors[:-1].tolist(), anchors[1:].tolist()))
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        chord_x, chord_y = xs[end] - xs[start], ys[end] - ys[start]
+        offset_x, offset_y = xs[start + 1:end] - xs[start], ys[start + 1:end] - ys[start]
+        length = np.hypot(chord_x, chord_y)
+        if length == 0:
+            distances = np.hypot(offset_x, offset_y)
+        else:
+            distances = np.abs(chord_y * offset_x - chord_x * offset_y) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            middle = start + 1 + farthest
+            mask[middle] = True
+            stack.append((start, middle))
+            stack.append((middle, end))
+    return mask
+
 
+@dataclass
+class RiverNetwork:
+    """
+    All traced rivers stored as flat arrays.
+    Points of river i are xs[offsets[i]:offsets[i + 1]] (same for ys, colors).
+    Rivers are numbered in discovery order, a tributary always comes after its parent.
+    """
+    xs: np.ndarray              # int32 pixel x of every point
+    ys: np.ndarray              # int32 pixel y of every point
+    colors: np.ndarray          # uint32 packed 0xRRGGBB color of every point
+    offsets: np.ndarray         # int64, n_rivers + 1
+    parents: np.ndarray         # int32 parent river, -1 for a river system starting at a SOURCE
+    parent_points: np.ndarray   # int32 index of the attachment point within the parent river, -1 for systems
+    untraced: np.ndarray        # int32 (n, 2) x, y of the river pixels of the map the tracer never reached
+
+    @property
+    def n_rivers(self) -> int:
+        return len(self.offsets) - 1
+
+    def traced_mask(self, shape: tuple[int, int]) -> np.ndarray:
+        """Boolean raster of every pixel reached by the tracer"""
+        mask = np.zeros(shape, dtype=bool)
+        mask[self.ys, self.xs] = True
+        return mask
+
+    def to_rivers(self) -> List[River]:
+        """Build the River / tributaries view, one River per system"""
+        colors = unpack_colors(self.colors).tolist()
+        xs, ys = self.xs.tolist(), self.ys.tolist()
+        rivers = []
+        systems = []
+        for i in range(self.n_rivers):
+            river = River()
+            river.points = [
+                RiverPoint(xs[p], ys[p], tuple(colors[p]))
+                for p in range(self.offsets[i], self.offsets[i + 1])
+            ]
+            rivers.append(river)
+            if self.parents[i] < 0:
+                river.start_pixel_color_type = 'SOURCE'
+                systems.append(river)
+            else:
+                river.start_pixel_color_type = 'TRIBUTARY'
+                rivers[self.parents[i]].tributaries.append((river, int(self.parent_points[i])))
+        return systems
+
+
+def trace_river_network(river_classes: np.ndarray, image_array: np.ndarray) -> RiverNetwork:
+    """
+    Follow every river from its SOURCE pixel, without recursion.
+
+    Walks 4-neighbours in the order right, left, down, up and takes the first
+    unvisited non-LAND pixel. A TRIBUTARY neighbour starts a tributary that is
+    followed to its end before the parent river goes on, using an explicit stack.
+    """
+    height, width = river_classes.shape
+    classes = river_classes.tobytes()
+    visited = bytearray(height * width)
+    tributary_class = RIVER_CLASSES['TRIBUTARY']
+    land_class = RIVER_CLASSES['LAND']
+    other_class = RIVER_CLASSES['OTHER']
+    class_colors = [
+        0 if color is None else (color[0] << 16) | (color[1] << 8) | color[2]
+        for color in RIVER_CLASS_COLORS
+    ]
+
+    point_xs, point_ys = array('i'), array('i')
+    point_colors, point_rivers = array('I'), array('i')
+    river_lengths, parents, parent_points = [], [], []
+
+    def start_river(x: int, y: int, parent: int, parent_point: int) -> int:
+        river = len(river_lengths)
+        river_lengths.append(0)
+        parents.append(parent)
+        parent_points.append(parent_point)
+        add_point(river, x, y)
+        return river
+
+    def add_point(river: int, x: int, y: int):
+        river_class = classes[y * width + x]
+        if river_class == other_class:
+            color = image_array[y, x]
+            packed = (int(color[0]) << 16) | (int(color[1]) << 8) | int(color[2])
+        else:
+            packed = class_colors[river_class]
+        point_xs.append(x)
+        point_ys.append(y)
+        point_colors.append(packed)
+        point_rivers.append(river)
+        river_lengths[river] += 1
+        visited[y * width + x] = 1
+
+    for source_y, source_x in find_river_sources(river_classes).tolist():
+        if visited[source_y * width + source_x]:
+            continue
+        # Frames of rivers waiting for a tributary to end: (river, x, y, next neighbour to check)
+        stack = []
+        river = start_river(source_x, source_y, -1, -1)
+        x, y, k = source_x, source_y, 0
         while True:
-            x, y = int(current.x), int(current.y)
-            neighbors = [(x+1, y), (x-1, y), (x, y+1), (x, y-1)]
-            
-            next_point = None
-            for nx, ny in neighbors:
-                if (nx, ny) in visited:
+            next_pixel = None
+            while k < 4:
+                if k == 0:
+                    nx, ny = x + 1, y
+                elif k == 1:
+                    nx, ny = x - 1, y
+                elif k == 2:
+                    nx, ny = x, y + 1
+                else:
+                    nx, ny = x, y - 1
+                k += 1
+                if not (0 <= nx < width and 0 <= ny < height):
                     continue
-                    
-                if 0 <= nx < image_array.shape[1] and 0 <= ny < image_array.shape[0]:
-                    color = tuple(image_array[ny, nx])
-                    
-                    if color == RIVER_COLORS['TRIBUTARY']:
-                        # Store the tributary with the index of its parent point
-                        tributary = River()
-                        tributary.start_pixel_color_type = 'TRIBUTARY'
-                        tributary.follow_tributary(RiverPoint(nx, ny, color), image_array, visited)
-                        self.tributaries.append((tributary, len(self.points) - 1))
-                    elif color != RIVER_COLORS['LAND']:
-                        next_point = RiverPoint(nx, ny, color)
-                        break
-            
-            if next_point is None:
-                break
-                
-            current = next_point
-            self.points.append(current)
-            visited.add((int(current.x), int(current.y)))
+                q = ny * width + nx
+                if visited[q]:
+                    continue
+                river_class = classes[q]
+                if river_class == tributary_class:
+                    stack.append((river, x, y, k))
+                    river = start_river(nx, ny, river, river_lengths[river] - 1)
+                    x, y, k = nx, ny, 0
+                elif river_class != land_class:
+                    next_pixel = (nx, ny)
+                    break
+
+            if next_pixel is None:
+                if not stack:
+                    break
+                river, x, y, k = stack.pop()
+                continue
+
+            x, y = next_pixel
+            k = 0
+            add_point(river, x, y)
+
+    # Group points river by river, keeping their order
+    point_rivers = np.frombuffer(point_rivers, dtype=np.int32)
+    order = np.argsort(point_rivers, kind='stable')
+    offsets = np.zeros(len(river_lengths) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(river_lengths)
+    untraced = river_mask(river_classes) & ~np.frombuffer(visited, dtype=np.uint8).reshape(river_classes.shape).astype(bool)
+    return RiverNetwork(
+        xs=np.frombuffer(point_xs, dtype=np.int32)[order],
+        ys=np.frombuffer(point_ys, dtype=np.int32)[order],
+        colors=np.frombuffer(point_colors, dtype=np.uint32)[order],
+        offsets=offsets,
+        parents=np.array(parents, dtype=np.int32),
+        parent_points=np.array(parent_points, dtype=np.int32),
+        untraced=np.argwhere(untraced)[:, ::-1].astype(np.int32),
+    )
+
+def open_rivers_array(rivers_map_path: Path) -> np.ndarray:
+    """Load a rivers map as an (H, W, 3) RGB array"""
+    original_image = Image.open(rivers_map_path)
+    if original_image.mode != 'RGB':
+        original_image = original_image.convert('RGB')
+    return np.array(original_image)
+
+
+def file_hash(path: Path) -> str:
+    """sha256 of a file content"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def river_cache_path(cache_folder: Path, original_rivers_map_path: Path) -> Path:
+    """Cache file of a rivers map, named after the cache format and the map content hash"""
+    return Path(cache_folder) / f"rivers_v{RIVER_CACHE_VERSION}_{file_hash(original_rivers_map_path)}.npz"
+
+
+def save_river_network(network: RiverNetwork, path: Path):
+    """Save the traced network as a compressed npz file"""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    np.savez_compressed(
+        path,
+        xs=network.xs,
+        ys=network.ys,
+        colors=network.colors,
+        offsets=network.offsets,
+        parents=network.parents,
+        parent_points=network.parent_points,
+        untraced=network.untraced,
+    )
+
+
+def load_river_network(path: Path) -> RiverNetwork:
+    """Load a network saved by save_river_network"""
+    with np.load(path) as data:
+        return RiverNetwork(**{name: data[name] for name in RiverNetwork.__dataclass_fields__})
+
+
+def load_or_trace_river_network(
+        original_rivers_map_path: Path,
+        cache_folder: Path | None = None,
+        invalidate_cache: bool = False,
+) -> RiverNetwork:
+    """
+    Trace the rivers of a CK2 rivers map, or load them from cache_folder.
+    Tracing does not depend on scale or offset, so the cache is keyed only by the
+    rivers map content. invalidate_cache forces tracing and rewrites the cache.
+    """
+    cache_path = None
+    if cache_folder is not None:
+        cache_path = river_cache_path(cache_folder, original_rivers_map_path)
+        if cache_path.exists() and not invalidate_cache:
+            try:
+                network = load_river_network(cache_path)
+                print(f"Loaded traced rivers from {cache_path}")
+                return network
+            except Exception as e:
+                print(f"Error reading river cache {cache_path}: {e}. Tracing again.")
+
+    image_array = open_rivers_array(original_rivers_map_path)
+    river_classes = classify_rivers(image_array)
+    
+    # Find all river systems (starting from green source pixels)
+    print("Following rivers...")
+    network = trace_river_network(river_classes, image_array)
+
+    if cache_path is not None:
+        save_river_network(network, cache_path)
+        print(f"Saved traced rivers to {cache_path}")
+    return network
+
+
+def scale_river_systems(
+        network: RiverNetwork,
+        factor: float,
+        offset: tuple[int, int],
+        simplify_tolerance: float = 0.,
+) -> List[River]:
+    """River systems of the network scaled to the destination map, see River.scale"""
+    river_systems = network.to_rivers()
+    for system in river_systems:
+        system.scale(factor, offset, deletion_rate=simplify_tolerance)
+    return river_systems
 
-    def follow_tributary(self, start_pixel: RiverPoint, image_array: np.ndarray, visited: set):
-        """Follow tributary from its joining point"""
-        self.follow(start_pixel, image_array, visited)
 
 # Start with the main river and build tributaries on the way
  
@@ -105,145 +441,379 @@ def convert_rivers_map(
         conversion_scale: float,
         conversion_offset: tuple[int, int],
         destination_dimensions: tuple[int, int],
-):
-    """Convert rivers using vector-based scaling"""
-    # Load original image
-    original_image = Image.open(original_rivers_map_path)
-    if original_image.mode != 'RGB':
-        original_image = original_image.convert('RGB')
-    
-    # Convert to numpy array for easier pixel access
-    image_array = np.array(original_image)
-    
-    # Find all river systems (starting from green source pixels)
-    river_systems = []
-    visited = set()
-    print("Following rivers...")
-    for y in range(image_array.shape[0]):
-        for x in range(image_array.shape[1]):
-            if tuple(image_array[y, x]) == RIVER_COLORS['SOURCE'] and (x, y) not in visited:
-                river = River()
-                start_pixel = RiverPoint(x, y, RIVER_COLORS['SOURCE'])
-                river.start_pixel_color_type = 'SOURCE'
-                river.follow(start_pixel, image_array, visited)
-                river_systems.append(river)
+        cache_folder: Path | None = None,
+        invalidate_cache: bool = False,
+        simplify_tolerance: float = 0.,
+        timer: PhaseTimer | None = None,
+) -> 'RiverValidationReport':
+    """
+    Convert rivers using vector-based scaling.
+    With cache_folder, traced rivers are reused between runs on the same rivers map.
+    simplify_tolerance > 0 drops river points closer than that many pixels to the simplified line.
+    timer, if given, gets the time of the trace (or cache load), scale, draw, encode and validate phases.
+    Returns the validation of the converted map.
+    """
+    with timed(timer, "trace"):
+        network = load_or_trace_river_network(original_rivers_map_path, cache_folder, invalidate_cache)
     
     # Scale river systems
-    for system in river_systems:
-        system.scale(conversion_scale, conversion_offset, deletion_rate=0.)
-    
-    # Create new image
-    final_image = Image.new('RGB', destination_dimensions, RIVER_COLORS['LAND'])
+    with timed(timer, "scale"):
+        river_systems = scale_river_systems(network, conversion_scale, conversion_offset, simplify_tolerance)
     
     print("Drawing rivers...")
-    # Draw scaled rivers
-    for system in river_systems:
-        draw_river_system(final_image, system)
+    with timed(timer, "draw"):
+        # Create new image
+        canvas = np.empty((destination_dimensions[1], destination_dimensions[0], 3), dtype=np.uint8)
+        canvas[...] = RIVER_COLORS['LAND']
+        # Draw scaled rivers
+        if simplify_tolerance > 0:
+            draw_simplified_river_systems(canvas, river_systems, network, conversion_scale, conversion_offset)
+        else:
+            draw_river_systems(canvas, river_systems)
     
     # Save result
-    final_image.save(destination_rivers_map_path, "PNG")
+    with timed(timer, "encode"):
+        final_image = Image.fromarray(canvas)
+        final_image.save(destination_rivers_map_path, "PNG")
 
-def draw_river_system(image: Image.Image, river: River):    
-    """Draw a river system onto the image using exact pixel placement"""
-    pixels = image.load()
-    drawn_pixels = set()  # Keep track of all pixels drawn by main rivers
-    special_points = []  # Store (x, y, color) tuples for special points
-    
-    def get_line_pixels(p1: RiverPoint, p2: RiverPoint) -> List[Tuple[int, int]]:
-        """Get all pixels for a line segment using Bresenham's algorithm"""
-        x1, y1 = int(round(p1.x)), int(round(p1.y))
-        x2, y2 = int(round(p2.x)), int(round(p2.y))
-        line_pixels = []
-        
-        dx = abs(x2 - x1)
-        dy = abs(y2 - y1)
-        
-        x, y = x1, y1
-        step_x = 1 if x1 < x2 else -1
-        step_y = 1 if y1 < y2 else -1
-        
-        if dx > dy:
-            err = dx / 2
-            while x != x2:
-                x += step_x
-                err -= dy
-                if err < 0:
-                    y += step_y
-                    err += dx
-                if 0 <= x < image.width and 0 <= y < image.height:
-                    line_pixels.append((x, y))
-        else:
-            err = dy / 2
-            while y != y2:
-                y += step_y
-                err -= dx
-                if err < 0:
-                    x += step_x
-                    err += dy
-                if 0 <= x < image.width and 0 <= y < image.height:
-                    line_pixels.append((x, y))
-        
-        return line_pixels
-
-    # Draw main river first - collect all pixels
-    main_river_pixels = []
-    if len(river.points) > 1:
-        # Get all segments
-        for i in range(len(river.points) - 1):
-            p1, p2 = river.points[i], river.points[i + 1]
-            # Use regular blue color for the line
-            color = p2.color
-            if color in [RIVER_COLORS['SOURCE'], RIVER_COLORS['TRIBUTARY'], RIVER_COLORS['SPLIT']]:
-                color = p1.color  # Use previous point's color
-            pixels_in_segment = get_line_pixels(p1, p2)
-            main_river_pixels.extend((x, y, color) for x, y in pixels_in_segment)
-        
-        # Store source point if it exists
-        if river.start_pixel_color_type == 'SOURCE':
-            start_x, start_y = int(round(river.points[0].x)), int(round(river.points[0].y))
-            special_points.append((start_x, start_y, RIVER_COLORS['SOURCE']))
-        
-        # Draw main river and track pixels
-        for x, y, color in main_river_pixels:
-            pixels[x, y] = color
-            drawn_pixels.add((x, y))
-
-    # Draw tributaries
-    for tributary, parent_idx in river.tributaries:
-        if len(tributary.points) > 1:
-            # Collect all tributary pixels first
-            tributary_pixels = []
-            for i in range(len(tributary.points) - 1):
-                p1, p2 = tributary.points[i], tributary.points[i + 1]
-                # Use regular blue color
-                color = p2.color
-                if color in [RIVER_COLORS['SOURCE'], RIVER_COLORS['TRIBUTARY'], RIVER_COLORS['SPLIT']]:
-                    color = p1.color
-                pixels_in_segment = get_line_pixels(p1, p2)
-                tributary_pixels.extend((x, y, color) for x, y in pixels_in_segment)
-            
-            # Find first intersection with main river
-            first_intersection = None
-            for i, (x, y, _) in enumerate(tributary_pixels):
-                if (x, y) in drawn_pixels:
-                    first_intersection = i
-                    break
-            
-            if first_intersection is not None:
-                # Remove all pixels up to and including intersection
-                tributary_pixels = tributary_pixels[first_intersection + 1:]
-            
-            if tributary_pixels:
-                # Add tributary marker at first remaining point
-                first_x, first_y, _ = tributary_pixels[0]
-                special_points.append((first_x, first_y, RIVER_COLORS['TRIBUTARY']))
-                
-                # Draw remaining tributary pixels
-                for x, y, color in tributary_pixels[1:]:
-                    if (x, y) not in drawn_pixels:  # Extra safety check
-                        pixels[x, y] = color
-
-    # Draw all special points last
-    for x, y, color in special_points:
-        if 0 <= x < image.width and 0 <= y < image.height:
-            pixels[x, y] = color
+    print("Validating rivers...")
+    with timed(timer, "validate"):
+        # Untraced pixels come from the tracing step, the original map is not read again
+        report = validate_rivers_map(classify_rivers(canvas))
+        report.untraced = network.untraced
+    report.print_summary()
+    return report
+
+def line_pixels(
+        x1: np.ndarray, y1: np.ndarray,
+        x2: np.ndarray, y2: np.ndarray,
+        four_connected: bool = False,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Bresenham's algorithm for many segments at once.
+    Returns x, y and segment index of every pixel, excluding each segment's first point.
+    The error term of the classic loop is replaced by its closed form:
+    after k steps along the major axis, the minor axis moved ceil((2k*minor - major) / (2*major)) times.
+    With four_connected, every diagonal step is preceded by its corner pixel along the major axis,
+    so that consecutive pixels always share an edge.
+    """
+    dx, dy = np.abs(x2 - x1), np.abs(y2 - y1)
+    step_x = np.where(x1 < x2, 1, -1)
+    step_y = np.where(y1 < y2, 1, -1)
+    x_major = dx > dy
+    major = np.where(x_major, dx, dy)
+    minor = np.where(x_major, dy, dx)
+
+    segments = np.repeat(np.arange(len(x1)), major)
+    first = np.cumsum(major) - major
+    k = np.arange(len(segments)) - first[segments] + 1
+
+    major, minor, x_major = major[segments], minor[segments], x_major[segments]
+    minor_steps = np.maximum(-((major - 2 * k * minor) // (2 * major)), 0)
+    if four_connected:
+        previous_steps = np.maximum(-((major - 2 * (k - 1) * minor) // (2 * major)), 0)
+        corners = np.flatnonzero(minor_steps != previous_steps)
+        # Corner i goes right before pixel corners[i]
+        order = np.argsort(np.r_[2 * np.arange(len(k)) + 1, 2 * corners], kind='stable')
+        k = np.r_[k, k[corners]][order]
+        minor_steps = np.r_[minor_steps, previous_steps[corners]][order]
+        segments = np.r_[segments, segments[corners]][order]
+        x_major = np.r_[x_major, x_major[corners]][order]
+    along_x = np.where(x_major, k, minor_steps)
+    along_y = np.where(x_major, minor_steps, k)
+    return (
+        x1[segments] + step_x[segments] * along_x,
+        y1[segments] + step_y[segments] * along_y,
+        segments,
+    )
+
+
+def without_square_turns(xs: np.ndarray, ys: np.ndarray, rivers: np.ndarray) -> np.ndarray:
+    """
+    Mask of the pixels of 4-connected river paths to keep so that no path turns around a 2x2 square.
+    Where pixels i and i + 3 of a river are neighbours, pixels i + 1 and i + 2 are dropped.
+    Only non-overlapping turns are cut in each pass, passes go on until none is left.
+    """
+    kept = np.ones(len(xs), dtype=bool)
+    while True:
+        index = np.flatnonzero(kept)
+        x, y, river = xs[index], ys[index], rivers[index]
+        turns = np.zeros(len(index), dtype=bool)
+        turns[:-3] = (river[:-3] == river[3:]) & (np.abs(x[:-3] - x[3:]) + np.abs(y[:-3] - y[3:]) == 1)
+        overlapping = np.zeros(len(index), dtype=bool)
+        overlapping[1:] |= turns[:-1]
+        overlapping[2:] |= turns[:-2]
+        turns &= ~overlapping
+        if not turns.any():
+            return kept
+        turns = np.flatnonzero(turns)
+        kept[index[turns + 1]] = kept[index[turns + 2]] = False
+
+
+def draw_river_systems(canvas: np.ndarray, river_systems: List[River], four_connected: bool = False):
+    """
+    Draw river systems onto an (H, W, 3) canvas using exact pixel placement.
+    four_connected draws segments without diagonal steps, see line_pixels.
+
+    For every system: the main river is drawn, then its tributaries, cut after
+    their first pixel on the main river and never drawn over it, then the SOURCE
+    and TRIBUTARY markers. Later systems are drawn over earlier ones.
+    All pixels are computed at once and written with a single assignment.
+    """
+    height, width = canvas.shape[:2]
+    special_colors = [(color[0] << 16) | (color[1] << 8) | color[2] for color in MARKER_COLORS]
+
+    # Flatten the points of every drawn river: main rivers and their direct tributaries
+    xs, ys, colors, point_rivers = [], [], [], []
+    river_systems_ids, is_tributary, sources = [], [], []
+    for system_id, system in enumerate(river_systems):
+        for river, tributary in [(system, False)] + [(t, True) for t, _ in system.tributaries]:
+            if len(river.points) <= 1:
+                continue
+            if not tributary and river.start_pixel_color_type == 'SOURCE':
+                sources.append((system_id, river.points[0]))
+            river_id = len(river_systems_ids)
+            river_systems_ids.append(system_id)
+            is_tributary.append(tributary)
+            for point in river.points:
+                xs.append(point.x)
+                ys.append(point.y)
+                colors.append((point.color[0] << 16) | (point.color[1] << 8) | point.color[2])
+                point_rivers.append(river_id)
+    if not xs:
+        return
+
+    xs = np.round(np.array(xs, dtype=np.float64)).astype(np.int64)
+    ys = np.round(np.array(ys, dtype=np.float64)).astype(np.int64)
+    colors = np.array(colors, dtype=np.uint32)
+    point_rivers = np.array(point_rivers, dtype=np.int64)
+    river_systems_ids = np.array(river_systems_ids, dtype=np.int64)
+    is_tributary = np.array(is_tributary, dtype=bool)
+
+    # Segments between consecutive points of the same river, colored by their end point
+    # unless it is a marker
+    starts = np.flatnonzero(point_rivers[:-1] == point_rivers[1:])
+    segment_colors = colors[starts + 1]
+    is_marker = np.isin(segment_colors, special_colors)
+    segment_colors[is_marker] = colors[starts][is_marker]
+
+    pixel_xs, pixel_ys, segments = line_pixels(
+        xs[starts], ys[starts], xs[starts + 1], ys[starts + 1], four_connected
+    )
+    if four_connected:
+        # The first point of every river starts its path, it is checked but never dropped nor drawn here
+        first_points = np.unique(point_rivers, return_index=True)[1]
+        pixel_rivers = point_rivers[starts][segments]
+        at = np.searchsorted(pixel_rivers, point_rivers[first_points])
+        kept = without_square_turns(
+            np.insert(pixel_xs, at, xs[first_points]),
+            np.insert(pixel_ys, at, ys[first_points]),
+            np.insert(pixel_rivers, at, point_rivers[first_points]),
+        )
+        kept = np.delete(kept, at + np.arange(len(at)))
+        pixel_xs, pixel_ys, segments = pixel_xs[kept], pixel_ys[kept], segments[kept]
+    inside = (pixel_xs >= 0) & (pixel_xs < width) & (pixel_ys >= 0) & (pixel_ys < height)
+    pixel_xs, pixel_ys, segments = pixel_xs[inside], pixel_ys[inside], segments[inside]
+    pixel_colors = segment_colors[segments]
+    pixel_rivers = point_rivers[starts][segments]
+    pixel_systems = river_systems_ids[pixel_rivers]
+    # Pixels keyed by system, so that main rivers only block their own tributaries
+    keys = pixel_systems * (width * height) + pixel_ys * width + pixel_xs
+
+    on_tributary = is_tributary[pixel_rivers]
+    main_keys = keys[~on_tributary]
+
+    # Tributaries: drop pixels up to and including the first one on the main river
+    order = np.arange(len(keys))
+    on_main = on_tributary & np.isin(keys, main_keys)
+    cut = np.full(len(river_systems_ids), -1, dtype=np.int64)
+    first_on_main = np.full(len(river_systems_ids), len(keys), dtype=np.int64)
+    np.minimum.at(first_on_main, pixel_rivers[on_main], order[on_main])
+    cut[first_on_main < len(keys)] = first_on_main[first_on_main < len(keys)]
+    kept = on_tributary & (order > cut[pixel_rivers])
+
+    # The first kept pixel of each tributary becomes its marker
+    kept_order = order[kept]
+    kept_rivers = pixel_rivers[kept]
+    is_first = np.r_[True, kept_rivers[1:] != kept_rivers[:-1]] if len(kept_rivers) else np.zeros(0, dtype=bool)
+    markers = kept_order[is_first]
+    drawn_tributary = kept_order[~is_first & ~on_main[kept_order]]
+
+    # Writes in drawing order: per system, main river (0), tributaries (1), markers (2)
+    write_x = [pixel_xs[~on_tributary], pixel_xs[drawn_tributary]]
+    write_y = [pixel_ys[~on_tributary], pixel_ys[drawn_tributary]]
+    write_colors = [pixel_colors[~on_tributary], pixel_colors[drawn_tributary]]
+    write_systems = [pixel_systems[~on_tributary], pixel_systems[drawn_tributary]]
+    write_phases = [np.zeros((~on_tributary).sum(), dtype=np.int64), np.ones(len(drawn_tributary), dtype=np.int64)]
+
+    source_systems = np.array([system_id for system_id, _ in sources], dtype=np.int64)
+    source_xs = np.round(np.array([point.x for _, point in sources], dtype=np.float64)).astype(np.int64)
+    source_ys = np.round(np.array([point.y for _, point in sources], dtype=np.float64)).astype(np.int64)
+    write_x += [source_xs, pixel_xs[markers]]
+    write_y += [source_ys, pixel_ys[markers]]
+    write_colors += [np.full(len(sources), special_colors[0], dtype=np.uint32),
+                     np.full(len(markers), special_colors[1], dtype=np.uint32)]
+    write_systems += [source_systems, pixel_systems[markers]]
+    write_phases += [np.full(len(sources) + len(markers), 2, dtype=np.int64)]
+
+    write_x, write_y = np.concatenate(write_x), np.concatenate(write_y)
+    write_colors, write_systems = np.concatenate(write_colors), np.concatenate(write_systems)
+    write_phases = np.concatenate(write_phases)
+    inside = (write_x >= 0) & (write_x < width) & (write_y >= 0) & (write_y < height)
+
+    # Sort by system then phase (stable, so each phase keeps its pixel order), keep the last write per pixel
+    order = np.lexsort((write_phases, write_systems))
+    order = order[inside[order]]
+    pixels = write_y[order] * width + write_x[order]
+    _, last = np.unique(pixels[::-1], return_index=True)
+    last = order[len(order) - 1 - last]
+    canvas[write_y[last], write_x[last]] = unpack_colors(write_colors[last])
+
+
+def river_system_boxes(river_systems: List[River]) -> np.ndarray:
+    """(n, 4) int64 min x, min y, max x, max y of the rounded points of every system and its tributaries"""
+    boxes = np.zeros((len(river_systems), 4), dtype=np.int64)
+    for i, system in enumerate(river_systems):
+        rivers, points = [system], []
+        while rivers:
+            river = rivers.pop()
+            points.extend((point.x, point.y) for point in river.points)
+            rivers.extend(tributary for tributary, _ in river.tributaries)
+        points = np.round(np.array(points, dtype=np.float64).reshape(-1, 2)).astype(np.int64)
+        if len(points):
+            boxes[i] = (*points.min(axis=0), *points.max(axis=0))
+    return boxes
+
+
+def draw_simplified_river_systems(
+        canvas: np.ndarray,
+        river_systems: List[River],
+        network: RiverNetwork,
+        factor: float,
+        offset: tuple[int, int],
+):
+    """
+    Draw simplified river systems, see draw_river_systems, 4-connected since simplified segments are diagonal.
+    Simplified lines may still come too close to another river: systems around a place breaking the
+    CK3 rules are replaced by their unsimplified version and the map is drawn again, until no simplified
+    system is left around a problem. The result is valid whenever the unsimplified map is.
+    river_systems is updated in place.
+    """
+    land = canvas.copy()
+    exact_systems = None
+    simplified = np.ones(len(river_systems), dtype=bool)
+    while True:
+        canvas[...] = land
+        draw_river_systems(canvas, river_systems, four_connected=True)
+        report = validate_rivers_map(classify_rivers(canvas))
+        problems = np.concatenate([
+            report.blocks, report.diagonal_connections, report.misplaced_sources, report.detached_tributaries,
+        ]).reshape(-1, 2)
+        if not len(problems) or not simplified.any():
+            return
+        boxes = river_system_boxes(river_systems)
+        near = np.zeros(len(river_systems), dtype=bool)
+        for x, y in problems.tolist():
+            near |= (boxes[:, 0] - 1 <= x) & (x <= boxes[:, 2] + 1) & (boxes[:, 1] - 1 <= y) & (y <= boxes[:, 3] + 1)
+        near &= simplified
+        if not near.any():
+            return
+        if exact_systems is None:
+            exact_systems = scale_river_systems(network, factor, offset)
+        for i in np.flatnonzero(near).tolist():
+            river_systems[i] = exact_systems[i]
+        simplified &= ~near
+
+
+def draw_river_system(canvas: np.ndarray, river: River):
+    """Draw a single river system onto an (H, W, 3) canvas"""
+    draw_river_systems(canvas, [river])
+
+
+@dataclass
+class RiverValidationReport:
+    """Problems found in a CK3 rivers map, as (n, 2) arrays of x, y pixel coordinates"""
+    blocks: np.ndarray                  # Top-left pixel of 2x2 squares of river pixels
+    diagonal_connections: np.ndarray    # Top-left pixel of 2x2 squares where rivers only touch diagonally
+    misplaced_sources: np.ndarray       # SOURCE pixels that are not at the end of a segment
+    detached_tributaries: np.ndarray    # TRIBUTARY pixels that do not join two river pixels
+    untraced: np.ndarray                # River pixels of the original map that were not converted
+
+    @property
+    def is_valid(self) -> bool:
+        """Whether the converted map follows the CK3 rules. Untraced pixels are only reported."""
+        return not (
+            len(self.blocks)
+            or len(self.diagonal_connections)
+            or len(self.misplaced_sources)
+            or len(self.detached_tributaries)
+        )
+
+    def print_summary(self, max_coordinates: int = 10):
+        for name, coordinates in [
+            ("2x2 river blocks", self.blocks),
+            ("diagonal-only connections", self.diagonal_connections),
+            ("sources not at a segment end", self.misplaced_sources),
+            ("tributary markers not joining a river", self.detached_tributaries),
+            ("original river pixels left untraced", self.untraced),
+        ]:
+            if len(coordinates):
+                shown = ", ".join(f"({x}, {y})" for x, y in coordinates[:max_coordinates].tolist())
+                more = "..." if len(coordinates) > max_coordinates else ""
+                print(f"Warning: {len(coordinates)} {name}: {shown}{more}")
+        if self.is_valid:
+            print("Rivers map is valid.")
+
+
+def river_mask(river_classes: np.ndarray) -> np.ndarray:
+    """Pixels drawn as river: widths, markers and unknown colors, not land or water"""
+    return (river_classes != RIVER_CLASSES['LAND']) & (river_classes != RIVER_CLASSES['WATER'])
+
+
+def validate_rivers_map(
+        river_classes: np.ndarray,
+        source_classes: np.ndarray | None = None,
+        traced: np.ndarray | None = None,
+) -> RiverValidationReport:
+    """
+    Check a rivers class raster against the CK3 rules with array shifts.
+    A SOURCE needs exactly one river neighbour, a TRIBUTARY at least two: its tributary and the river it joins.
+    If the class raster of the original map and the mask of traced pixels are given,
+    also lists the original river pixels the tracer never reached.
+    """
+    river = river_mask(river_classes)
+
+    top_left, top_right = river[:-1, :-1], river[:-1, 1:]
+    bottom_left, bottom_right = river[1:, :-1], river[1:, 1:]
+    blocks = top_left & top_right & bottom_left & bottom_right
+    diagonal = (
+        (top_left & bottom_right & ~top_right & ~bottom_left)
+        | (top_right & bottom_left & ~top_left & ~bottom_right)
+    )
+
+    # River 4-neighbours, only counted at marker pixels
+    padded = np.pad(river, 1).astype(np.uint8)
+
+    def neighbour_counts(marker_class: int) -> tuple[np.ndarray, np.ndarray]:
+        ys, xs = np.nonzero(river_classes == marker_class)
+        counts = padded[ys, xs + 1] + padded[ys + 2, xs + 1] + padded[ys + 1, xs] + padded[ys + 1, xs + 2]
+        return np.stack([xs, ys], axis=1), counts
+
+    sources, source_neighbours = neighbour_counts(RIVER_CLASSES['SOURCE'])
+    tributaries, tributary_neighbours = neighbour_counts(RIVER_CLASSES['TRIBUTARY'])
+
+    if source_classes is not None and traced is not None:
+        untraced = river_mask(source_classes) & ~traced
+    else:
+        untraced = np.zeros((0, 0), dtype=bool)
+
+    def coordinates(mask: np.ndarray) -> np.ndarray:
+        return np.argwhere(mask)[:, ::-1]
+
+    return RiverValidationReport(
+        blocks=coordinates(blocks),
+        diagonal_connections=coordinates(diagonal),
+        misplaced_sources=sources[source_neighbours != 1],
+        detached_tributaries=tributaries[tributary_neighbours < 2],
+        untraced=coordinates(untraced),
+    )
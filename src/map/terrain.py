@@ -0,0 +1,242 @@
+from pathlib import Path
+from PIL import Image
+from typing import Dict, Optional
+import numpy as np
+from src.utils.paradox_file_parser import regex_paradox_parser
+from scipy import ndimage
+from .province import open_province_image, province_id_raster
+from .transform import nearest_source_indices
+
+# CK2 terrain type -> CK3 terrain, None for water handled by the CK3 defaults
+CK2_TO_CK3_TERRAIN: Dict[str, Optional[str]] = {
+    'plains': 'plains',
+    'farmlands': 'farmlands',
+    'forest': 'forest',
+    'hills': 'hills',
+    'mountain': 'mountains',
+    'desert': 'desert',
+    'coastal_desert': 'drylands',
+    'desert_mountain': 'desert_mountains',
+    'arctic': 'taiga',
+    'jungle': 'jungle',
+    'marsh': 'wetlands',
+    'steppe': 'steppe',
+    'pti': None,
+    'ocean': None,
+    'inland_ocean': None,
+    'coastal_ocean': None,
+}
+
+
+# CK2 terrain type -> CK3 terrain material, one gfx/map/terrain/<material>_mask.png each
+CK2_TERRAIN_TO_CK3_MATERIAL: Dict[str, Optional[str]] = {
+    'plains': 'plains_01',
+    'farmlands': 'farmland_01',
+    'forest': 'forest_leaf_01',
+    'hills': 'hills_01',
+    'mountain': 'mountain_02',
+    'desert': 'desert_01',
+    'coastal_desert': 'desert_02',
+    'desert_mountain': 'desert_rocky',
+    'arctic': 'snow',
+    'jungle': 'forest_jungle_01',
+    'marsh': 'wetlands_02',
+    'steppe': 'steppe_01',
+    'pti': None,
+    'ocean': None,
+    'inland_ocean': None,
+    'coastal_ocean': None,
+}
+
+
+def read_terrain_palette(terrain_definition_path: Path) -> Dict[int, str]:
+    """
+    Read the palette index -> terrain type assignments of a CK2 map/terrain.txt
+
+    Example input:
+    terrain_0 = { type = plains color = { 0 } }
+
+    Returns: {0: "plains", ...}
+    """
+    parsed = regex_paradox_parser(terrain_definition_path)
+    index_to_type = {}
+    for key, value in parsed.items():
+        if key == 'categories':
+            continue
+        for block in value if isinstance(value, list) else [value]:
+            if not isinstance(block, dict) or 'type' not in block or 'color' not in block:
+                continue
+            indices = block['color'] if isinstance(block['color'], list) else [block['color']]
+            for index in indices:
+                index_to_type[int(index)] = block['type']
+    return index_to_type
+
+
+def majority_terrain(province_ids: np.ndarray, terrain_classes: np.ndarray, n_terrains: int = 256) -> np.ndarray:
+    """
+    Most frequent terrain class of every province id, -1 for ids absent from the map.
+    Counts all (province, terrain) pairs with a single bincount.
+    """
+    n_provinces = int(province_ids.max()) + 1
+    keys = province_ids.astype(np.int64).ravel() * n_terrains + terrain_classes.ravel()
+    counts = np.bincount(keys, minlength=n_provinces * n_terrains).reshape(n_provinces, n_terrains)
+    majority = counts.argmax(axis=1)
+    majority[counts.sum(axis=1) == 0] = -1
+    return majority
+
+
+def write_province_terrain(
+        province_terrain_path: Path,
+        id_to_terrain: Dict[int, str],
+        default_land: str = 'plains',
+):
+    """Write a CK3 common/province_terrain file"""
+    province_terrain_path = Path(province_terrain_path)
+    province_terrain_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(province_terrain_path, "w", encoding="utf-8-sig") as file:
+        file.write(f"default_land={default_land}\n")
+        file.write("default_sea=sea\n")
+        file.write("default_coastal_sea=coastal_sea\n")
+        for province_id, terrain in sorted(id_to_terrain.items()):
+            file.write(f"{province_id}={terrain}\n")
+    print(f"Successfully saved {len(id_to_terrain)} province terrains to {province_terrain_path}")
+
+
+def convert_province_terrain(
+        original_mod_folder: Path,
+        new_mod_folder: Path,
+        color_to_id: Dict[tuple[int, int, int], int],
+        id_to_history_terrain: Dict[int, Optional[str]],
+        terrain_mapping: Dict[str, Optional[str]] = CK2_TO_CK3_TERRAIN,
+) -> Dict[int, str] | None:
+    """
+    take in map/provinces.bmp, map/terrain.bmp and map/terrain.txt
+    Terrain from history/provinces wins, provinces without one get the
+    most common terrain of their pixels in terrain.bmp.
+    return common/province_terrain/00_province_terrain.txt
+    """
+    original_mod_folder = Path(original_mod_folder)
+    terrain_map_path = original_mod_folder / "map" / "terrain.bmp"
+
+    province_image = open_province_image(original_mod_folder / "map" / "provinces.bmp")
+    if province_image is None:
+        return
+    try:
+        terrain_image = Image.open(terrain_map_path)
+    except Exception as e:
+        print(f"Error opening image {terrain_map_path}: {e}")
+        return
+    if terrain_image.mode != 'P':
+        print(f"Error: {terrain_map_path} is not palette indexed ('P' mode)")
+        return
+    if terrain_image.size != province_image.size:
+        print(f"Error: {terrain_map_path} and provinces.bmp have different sizes")
+        return
+
+    print("Computing majority terrain per province")
+    index_to_type = read_terrain_palette(original_mod_folder / "map" / "terrain.txt")
+    # Several palette indices can share a terrain type: count types, not indices
+    types = sorted(set(index_to_type.values()))
+    index_to_class = np.full(256, len(types), dtype=np.int64)
+    for index, terrain_type in index_to_type.items():
+        index_to_class[index] = types.index(terrain_type)
+    province_ids = province_id_raster(np.array(province_image), color_to_id)
+    majority = majority_terrain(province_ids, index_to_class[np.array(terrain_image)], len(types) + 1)
+
+    id_to_terrain = {}
+    for province_id in sorted(color_to_id.values()):
+        ck2_terrain = id_to_history_terrain.get(province_id)
+        if ck2_terrain is None and province_id < len(majority) and majority[province_id] >= 0:
+            terrain_class = int(majority[province_id])
+            ck2_terrain = types[terrain_class] if terrain_class < len(types) else None
+        if ck2_terrain is None:
+            continue
+        ck3_terrain = terrain_mapping.get(ck2_terrain, ck2_terrain)
+        if ck3_terrain is not None:
+            id_to_terrain[province_id] = ck3_terrain
+
+    write_province_terrain(
+        Path(new_mod_folder) / "common" / "province_terrain" / "00_province_terrain.txt",
+        id_to_terrain,
+    )
+    return id_to_terrain
+
+
+def generate_terrain_masks(
+        original_mod_folder: Path,
+        masks_folder: Path,
+        conversion_scale: float,
+        conversion_offset: tuple[int, int],
+        destination_dimensions: tuple[int, int],
+        material_mapping: Dict[str, Optional[str]] = CK2_TERRAIN_TO_CK3_MATERIAL,
+        default_material: str = 'plains_01',
+        blur_sigma: float = 0.,
+        tile_height: int = 512,
+) -> list[Path] | None:
+    """
+    take in map/terrain.bmp and map/terrain.txt
+    Decode terrain.bmp once and paint every CK3 material mask band by band, with the
+    same nearest-neighbour scale and offset as the other maps. Pixels outside the
+    original map or without a material go to default_material.
+    blur_sigma > 0 softens the edges, bands overlap so the blur has no seams.
+    Only the uint8 masks are kept at full size, floats are per band.
+    return gfx/map/terrain/<material>_mask.png
+    """
+    original_mod_folder = Path(original_mod_folder)
+    terrain_map_path = original_mod_folder / "map" / "terrain.bmp"
+    try:
+        terrain_image = Image.open(terrain_map_path)
+    except Exception as e:
+        print(f"Error opening image {terrain_map_path}: {e}")
+        return
+    if terrain_image.mode != 'P':
+        print(f"Error: {terrain_map_path} is not palette indexed ('P' mode)")
+        return
+    terrain_indices = np.array(terrain_image)
+    index_to_type = read_terrain_palette(original_mod_folder / "map" / "terrain.txt")
+
+    # Palette index -> material index, the default material is used for anything unmapped
+    materials = sorted({material for material in material_mapping.values() if material is not None} | {default_material})
+    index_to_material = np.full(256, materials.index(default_material), dtype=np.uint8)
+    for index, terrain_type in index_to_type.items():
+        material = material_mapping.get(terrain_type)
+        if material is not None:
+            index_to_material[index] = materials.index(material)
+
+    width, height = destination_dimensions
+    source_x, valid_x = nearest_source_indices(
+        np.arange(width), terrain_indices.shape[1], conversion_scale, conversion_offset[0]
+    )
+    masks = [np.zeros((height, width), dtype=np.uint8) for _ in materials]
+    halo = int(np.ceil(4 * blur_sigma)) if blur_sigma > 0 else 0
+
+    print(f"Painting {len(materials)} terrain masks")
+    for y in range(0, height, tile_height):
+        y0, y1 = max(y - halo, 0), min(y + tile_height + halo, height)
+        source_y, valid_y = nearest_source_indices(
+            np.arange(y0, y1), terrain_indices.shape[0], conversion_scale, conversion_offset[1]
+        )
+        band = index_to_material[terrain_indices[source_y[:, None], source_x[None, :]]]
+        band[~(valid_y[:, None] & valid_x[None, :])] = materials.index(default_material)
+
+        inner = slice(y - y0, y - y0 + min(tile_height, height - y))
+        for material in np.flatnonzero(np.bincount(band.ravel(), minlength=len(materials))):
+            mask = band == material
+            if halo:
+                mask = ndimage.gaussian_filter(mask.astype(np.float32) * 255, blur_sigma, mode='nearest')
+                masks[material][y:y + tile_height] = np.round(mask[inner]).astype(np.uint8)
+            else:
+                masks[material][y:y + tile_height] = mask[inner] * np.uint8(255)
+
+    masks_folder = Path(masks_folder)
+    masks_folder.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for material, mask in zip(materials, masks):
+        path = masks_folder / f"{material}_mask.png"
+        try:
+            Image.fromarray(mask, 'L').save(path, "PNG")
+            paths.append(path)
+        except Exception as e:
+            print(f"Error saving image {path}: {e}")
+    print(f"Successfully saved {len(paths)} terrain masks to {masks_folder}")
+    return paths
@@ -0,0 +1,23 @@
+import numpy as np
+
+
+def nearest_source_indices(
+        destination_indices: np.ndarray,
+        original_length: int,
+        conversion_scale: float,
+        offset: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Source pixel index of destination pixels along one axis, matching a nearest-neighbour
+    PIL resize to int(original_length * conversion_scale) followed by a paste at offset.
+    Returns the clipped source indices and whether each destination pixel is covered.
+    """
+    resized_length = int(original_length * conversion_scale)
+    step = original_length / resized_length
+    # PIL accumulates the step pixel after pixel, a cumulative sum reproduces its rounding
+    source_of_resized = np.cumsum(np.r_[step * 0.5, np.full(resized_length - 1, step)]).astype(np.int64)
+    source_of_resized = np.clip(source_of_resized, 0, original_length - 1)
+
+    resized = np.asarray(destination_indices) - offset
+    valid = (resized >= 0) & (resized < resized_length)
+    return source_of_resized[np.clip(resized, 0, resized_length - 1)], valid
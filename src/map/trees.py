@@ -0,0 +1,152 @@
+from pathlib import Path
+from PIL import Image
+from scipy.spatial import cKDTree
+import numpy as np
+
+
+def trees_density(
+        trees_image: Image.Image,
+        original_dimensions: tuple[int, int],
+        conversion_scale: float,
+        conversion_offset: tuple[int, int],
+        destination_dimensions: tuple[int, int],
+        tree_indices: list[int] | None = None,
+) -> np.ndarray:
+    """
+    Tree density (H, W) in [0, 1] on the destination map.
+    trees.bmp is smaller than the other CK2 maps: it is first stretched to
+    original_dimensions, then scaled and offset like them, with bilinear filtering.
+    tree_indices are the palette indices holding trees (default.map `tree`), any non-zero index if None.
+    """
+    indices = np.array(trees_image)
+    if tree_indices is None:
+        has_trees = indices != 0
+    else:
+        has_trees = np.isin(indices, tree_indices)
+
+    density = Image.fromarray(has_trees.astype(np.float32)).resize(
+        (
+            int(original_dimensions[0] * conversion_scale),
+            int(original_dimensions[1] * conversion_scale)
+        ),
+        Image.Resampling.BILINEAR
+    )
+    final_density = Image.new('F', destination_dimensions, 0.)
+    final_density.paste(density, conversion_offset)
+    return np.clip(np.array(final_density), 0., 1.)
+
+
+def sample_tree_positions(
+        density: np.ndarray,
+        trees_per_pixel: float,
+        min_spacing: float,
+        seed: int = 0,
+) -> np.ndarray:
+    """
+    Draw (n, 2) x, y tree positions with probability density * trees_per_pixel per pixel.
+    Points closer than min_spacing are thinned with a k-d tree, greedily in drawing order:
+    a point is kept when no point kept before it is too close.
+    """
+    rng = np.random.default_rng(seed)
+    probability = density * trees_per_pixel
+    ys, xs = np.nonzero(rng.random(density.shape, dtype=np.float32) < probability)
+    positions = np.stack([xs, ys], axis=1) + rng.random((len(xs), 2))
+    positions = positions[rng.permutation(len(positions))]
+
+    if min_spacing > 0 and len(positions):
+        pairs = cKDTree(positions).query_pairs(min_spacing, output_type='ndarray')
+        pairs = np.sort(pairs, axis=1)
+        pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+        keep = np.ones(len(positions), dtype=bool)
+        # Pairs of a point come after every pair deciding whether it is kept
+        for first, second in pairs.tolist():
+            if keep[first]:
+                keep[second] = False
+        positions = positions[keep]
+    return positions
+
+
+def write_tree_locators(
+        locators_path: Path,
+        positions: np.ndarray,
+        map_height: int,
+        mesh: str,
+        seed: int = 0,
+):
+    """
+    Write a CK3 gfx/map/map_object_data file with one instance per tree.
+    CK3 world z goes up the map, so z = map_height - y. Trees get a random yaw.
+    """
+    rng = np.random.default_rng(seed)
+    half_yaw = rng.random(len(positions)) * np.pi
+    transforms = np.column_stack([
+        positions[:, 0], np.zeros(len(positions)), map_height - positions[:, 1],
+        np.zeros(len(positions)), np.sin(half_yaw), np.zeros(len(positions)), np.cos(half_yaw),
+        np.ones(len(positions)), np.ones(len(positions)), np.ones(len(positions)),
+    ])
+    locators_path = Path(locators_path)
+    locators_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(locators_path, "w", encoding="utf-8-sig") as file:
+        file.write("object={\n")
+        file.write(f'\tname="{mesh}"\n')
+        file.write("\tclamp_to_water_level=no\n")
+        file.write("\trender_under_water=no\n")
+        file.write("\tgenerated_content=no\n")
+        file.write('\tlayer="trees_layer"\n')
+        file.write(f'\tpdxmesh="{mesh}"\n')
+        file.write(f"\tcount={len(positions)}\n")
+        file.write('\ttransform="')
+        np.savetxt(file, transforms, fmt="%.6f")
+        file.write('"\n}\n')
+
+
+def convert_trees_map(
+        original_trees_map_path: Path,
+        density_map_path: Path,
+        locators_path: Path,
+        original_dimensions: tuple[int, int],
+        conversion_scale: float,
+        conversion_offset: tuple[int, int],
+        destination_dimensions: tuple[int, int],
+        tree_indices: list[int] | None = None,
+        trees_per_pixel: float = 0.05,
+        min_spacing: float = 2.,
+        seed: int = 0,
+        mesh: str = "tree_leaf_01_mesh",
+) -> np.ndarray | None:
+    """
+    take in map/trees.bmp
+    Rescale the trees to a grayscale density map and place tree locators on it.
+    return a density png and a map_object_data locators file
+    """
+    try:
+        trees_image = Image.open(original_trees_map_path)
+    except FileNotFoundError:
+        print(f"Error: Trees map not found at {original_trees_map_path}")
+        return
+    except Exception as e:
+        print(f"Error opening image {original_trees_map_path}: {e}")
+        return
+    if trees_image.mode != 'P':
+        print(f"Converting image {original_trees_map_path} to grayscale ('L' mode)")
+        trees_image = trees_image.convert('L')
+
+    density = trees_density(
+        trees_image,
+        original_dimensions,
+        conversion_scale,
+        conversion_offset,
+        destination_dimensions,
+        tree_indices,
+    )
+    try:
+        Path(density_map_path).parent.mkdir(parents=True, exist_ok=True)
+        Image.fromarray(np.round(density * 255).astype(np.uint8)).save(density_map_path, "PNG")
+        print(f"Successfully saved tree density to {density_map_path}")
+    except Exception as e:
+        print(f"Error saving image {density_map_path}: {e}")
+
+    positions = sample_tree_positions(density, trees_per_pixel, min_spacing, seed)
+    write_tree_locators(locators_path, positions, destination_dimensions[1], mesh, seed)
+    print(f"Successfully saved {len(positions)} tree locators to {locators_path}")
+    return positions
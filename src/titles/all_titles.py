@@ -1,8 +1,9 @@
 from pathlib import Path
 from pydantic import BaseModel, Field
-from .definitions import convert_definitions
+from .definitions import convert_definitions, DefinitionTable
 from typing import Dict, List, Optional, Tuple, Any
 from src.utils.paradox_file_parser import regex_paradox_parser
+from src.map.terrain import convert_province_terrain
 import re
 from pprint import pprint
 
@@ -14,42 +15,18 @@ class Definition(BaseModel):
     name: str
     comment: str
 
-def open_definitions(definitions_path: Path):
+def open_definitions(definitions_path: Path) -> Tuple[List, Dict[str, int]]:
     """
-    Open and keep in memory the comments
+    Open and keep in memory the comments.
+    Returns the Definition models with the comment lines in between, see DefinitionTable.to_definitions,
+    and the position of every id in that list.
     """
-    definitions = []
-    id_to_line = {}
-    with open(definitions_path, "r") as file:
-        lines = file.readlines()
-        line_index = 0
-        for line in lines[1:]:
-            line = line.strip()
-            if line.startswith("#"):
-               definitions.append(line)
-            else:
-               id_to_line[line.split(";")[0]] = line_index
-               values = line.split(";")
-               id = int(values[0]) if len(values[0]) > 0 else None
-               r = int(values[1]) if len(values[1]) > 0 else None
-               g = int(values[2]) if len(values[2]) > 0 else None
-               b = int(values[3]) if len(values[3]) > 0 else None
-               name = " ".join(values[4:-1])
-               x = values[-1]
-               x = x.split("#")
-               if len(x) > 0:
-                   comment = "#".join(x[1:])        
-               else:
-                   comment = None
-               definitions.append(Definition(
-                   id=id,
-                   r=r,
-                   g=g,
-                   b=b,
-                   name=name,
-                   comment=comment
-               ))
-            line_index += 1
+    definitions = DefinitionTable.load(definitions_path).to_definitions()
+    id_to_line = {
+        str(definition.id): line_index
+        for line_index, definition in enumerate(definitions)
+        if isinstance(definition, Definition)
+    }
     return definitions, id_to_line
 
 
@@ -70,6 +47,21 @@ class CountyProvinceHistory(BaseModel):
     terrain: Optional[str] = None
     comments: Optional[str] = None
 
+    def summary(self) -> 'ProvinceSummary':
+        return ProvinceSummary(
+            id=self.id,
+            title=self.title,
+            terrain=self.terrain,
+            baronies=list(self.baronies_history),
+        )
+
+class ProvinceSummary(BaseModel):
+    """What the title conversion keeps of a province history once its CK3 file is written"""
+    id: int
+    title: Optional[str] = None
+    terrain: Optional[str] = None
+    baronies: List[str] = Field(default_factory=list)   # Baronies given a holding in the history
+
 def read_province_history(province_id: int, file_path: Path) -> CountyProvinceHistory:
     """
     Reads and parses a province history file using the general paradox parser.
@@ -132,20 +124,6 @@ def read_province_history(province_id: int, file_path: Path) -> CountyProvinceHi
     return province_history
 
 
-def read_all_histories(indices, original_province_history_folder) -> Dict[int, CountyProvinceHistory]:
-    id_to_history = {}
-    for index in indices:
-        # Get history/province (missing if sea or coastline)
-        ls_result = list(original_province_history_folder.glob(f"{index} - *"))
-        if not ls_result:  # Empty list
-            print(f"No history file found for {index}")
-            continue
-        else:
-            history_file = ls_result[0]
-            history = read_province_history(index, history_file)
-            id_to_history[index] = history
-    return id_to_history
-
 def read_provinces_climate(climate_path: Path) -> Dict[int, str]:
     """
     Read the climate file and return a dictionary mapping province IDs to their climate type.
@@ -226,65 +204,65 @@ title_from_id = {
     "b": Barony
 }
 
+def parse_title_block(title_name: str, title_data: Dict) -> LandedTitle:
+    """Convert a title block to a LandedTitle object"""
+    # Get title type from name prefix
+    title_type = title_name[0]  # e, k, d, c, b
+    title_class = title_from_id[title_type]
+    
+    # Create title object
+    title = title_class(
+        title_name=title_name,
+        children=[]
+    )
+    
+    # Parse properties
+    for key, value in title_data.items():
+        if key == 'color' and isinstance(value, dict) and 'enum' in value:
+            title.color = tuple(int(x) for x in value['enum'][:3])
+        elif key == 'color2' and isinstance(value, dict) and 'enum' in value:
+            title.color2 = tuple(int(x) for x in value['enum'][:3])
+        elif key == 'capital':
+            title.capital = int(value)
+        elif key == 'title':
+            title.title = value
+        elif key == 'title_female':
+            title.title_female = value
+        elif key == 'short_name':
+            title.short_name = value == 'yes'
+        elif key == 'landless':
+            title.landless = value == 'yes'
+        elif key == 'independent':
+            title.independent = value == 'yes'
+        elif key == 'primary':
+            title.primary = value == 'yes'
+        elif key == 'dynasty_title_names':
+            title.dynasty_title_names = value == 'yes'
+        elif key == 'can_be_claimed':
+            title.can_be_claimed = value == 'yes'
+        elif key == 'can_be_usurped':
+            title.can_be_usurped = value == 'yes'
+        elif key == 'assimilate':
+            title.assimilate = value == 'yes'
+        elif key == 'extra_ai_eval_troops':
+            title.extra_ai_eval_troops = int(value)
+        elif isinstance(value, dict):
+            # Nested title
+            if key.startswith(('e_', 'k_', 'd_', 'c_', 'b_')):
+                child = parse_title_block(key, value)
+                title.children.append(child)
+            # Culture-specific names
+            elif not any(key.startswith(x) for x in ['allow', 'gain_effect', 'color']):
+                title.cultural_names[key] = value
+    
+    return title
+
 def read_landed_titles(file_path: Path) -> List[LandedTitle]:
     """
     Reads and parses a landed titles file using the general parser.
     Converts the parsed dict to LandedTitle objects maintaining hierarchy.
     """
     parsed = regex_paradox_parser(file_path)
-    
-    def parse_title_block(title_name: str, title_data: Dict) -> LandedTitle:
-        """Convert a title block to a LandedTitle object"""
-        # Get title type from name prefix
-        title_type = title_name[0]  # e, k, d, c, b
-        title_class = title_from_id[title_type]
-        
-        # Create title object
-        title = title_class(
-            title_name=title_name,
-            children=[]
-        )
-        
-        # Parse properties
-        for key, value in title_data.items():
-            if key == 'color' and isinstance(value, dict) and 'enum' in value:
-                title.color = tuple(int(x) for x in value['enum'][:3])
-            elif key == 'color2' and isinstance(value, dict) and 'enum' in value:
-                title.color2 = tuple(int(x) for x in value['enum'][:3])
-            elif key == 'capital':
-                title.capital = int(value)
-            elif key == 'title':
-                title.title = value
-            elif key == 'title_female':
-                title.title_female = value
-            elif key == 'short_name':
-                title.short_name = value == 'yes'
-            elif key == 'landless':
-                title.landless = value == 'yes'
-            elif key == 'independent':
-                title.independent = value == 'yes'
-            elif key == 'primary':
-                title.primary = value == 'yes'
-            elif key == 'dynasty_title_names':
-                title.dynasty_title_names = value == 'yes'
-            elif key == 'can_be_claimed':
-                title.can_be_claimed = value == 'yes'
-            elif key == 'can_be_usurped':
-                title.can_be_usurped = value == 'yes'
-            elif key == 'assimilate':
-                title.assimilate = value == 'yes'
-            elif key == 'extra_ai_eval_troops':
-                title.extra_ai_eval_troops = int(value)
-            elif isinstance(value, dict):
-                # Nested title
-                if key.startswith(('e_', 'k_', 'd_', 'c_', 'b_')):
-                    child = parse_title_block(key, value)
-                    title.children.append(child)
-                # Culture-specific names
-                elif not any(key.startswith(x) for x in ['allow', 'gain_effect', 'color']):
-                    title.cultural_names[key] = value
-        
-        return title
 
     # Parse all top-level titles
     titles = []
@@ -301,10 +279,39 @@ def read_all_titles(landed_titles_path: Path) -> Dict[str, LandedTitle]:
         all_titles[file.stem] = read_landed_titles(file)
     return all_titles
 
+def county_baronies(
+        titles: Dict[str, List[LandedTitle]],
+        id_to_history: Dict[int, ProvinceSummary],
+        only_in_history: bool = False,
+) -> Dict[int, List[str]]:
+    """
+    Baronies of every county province, in landed titles order.
+    Counties are matched to provinces with the title of history/provinces.
+    With only_in_history, baronies never given a holding in the province history are left out.
+    """
+    county_to_id = {history.title: history.id for history in id_to_history.values() if history.title}
+    baronies = {}
+
+    def visit(title: LandedTitle):
+        if isinstance(title, County) and title.title_name in county_to_id:
+            province_id = county_to_id[title.title_name]
+            names = [child.title_name for child in title.children if isinstance(child, Barony)]
+            if only_in_history:
+                names = [name for name in names if name in id_to_history[province_id].baronies]
+            baronies[province_id] = names
+        for child in title.children:
+            visit(child)
+
+    for file_titles in titles.values():
+        for title in file_titles:
+            visit(title)
+    return baronies
+
 def convert_titles(
         original_mod_folder: str,
         new_mod_folder: str,
         start_definition_id: int,
+        jobs: int = 1,
     ):
     """
     Convert the titles as is for e, d, c, b
@@ -316,6 +323,7 @@ def convert_titles(
     [ ] History in history/titles
     [X] History in history/provinces: title definition, culture, religion,  
          baronies (holding type), terrain, 
+    [X] Terrain in map/terrain.bmp when history has none
     Localization
     CoA in gfx/flags
 
@@ -329,24 +337,40 @@ def convert_titles(
     Need to define history/characters, cultures, religions to have proper history
     Use atlantean placeholders for now
     """
+    from .province_history import convert_province_histories
     original_mod_folder = Path(original_mod_folder)
     # Get all "useful" baronies: present in history/provinces:
 
     print("Opening original definitions")
     original_definitions = Path(original_mod_folder, "map", "definition.csv")
-    original_province_history_folder = Path(original_mod_folder, "history", "provinces")
     new_definitions = Path(original_mod_folder, "map_data", "definition.csv")
 
-    definitions, id_to_line = open_definitions(original_definitions)
-    print("Opening original definitions")
-    id_to_history = read_all_histories(
-        id_to_line.keys(),  
-        original_province_history_folder
+    definitions = DefinitionTable.load(original_definitions)
+    # Histories are streamed to history/provinces, only their summaries stay in memory
+    print("Converting province histories")
+    id_to_summary = convert_province_histories(
+        original_mod_folder,
+        new_mod_folder,
+        definitions.ids.tolist(),
+        jobs=jobs,
     )
     id_to_climate = read_provinces_climate(
         Path(original_mod_folder, "map", "climate.txt")
     )
 
+    terrain_files = [Path(original_mod_folder, "map", name) for name in ("terrain.bmp", "terrain.txt")]
+    missing_terrain_files = [str(path) for path in terrain_files if not path.exists()]
+    if missing_terrain_files:
+        print(f"Skipping province terrain: {', '.join(missing_terrain_files)} not found")
+    else:
+        print("Converting province terrain")
+        convert_province_terrain(
+            original_mod_folder,
+            new_mod_folder,
+            definitions.color_to_id(),
+            {summary.id: summary.terrain for summary in id_to_summary.values()},
+        )
+
     print("Reading all titles")
     
     titles = read_all_titles(
@@ -354,4 +378,3 @@ def convert_titles(
     )
         
     pass
-
@@ -1,3 +1,215 @@
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+import numpy as np
+from src.map.palette import ColorAllocator
+from src.map.province import open_province_image
+from src.utils.paradox_file_parser import read_game_file
+
+
+def _join_strings(strings: List[str]) -> Tuple[str, np.ndarray]:
+    """All strings in one text and their (n + 1) offsets"""
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(string) for string in strings])
+    return "".join(strings), offsets
+
+
+@dataclass
+class DefinitionTable:
+    """
+    definition.csv as columns, row i being the i-th province line of the file.
+    Strings are stored in one text with offsets: names[name_offsets[i]:name_offsets[i + 1]].
+    rests keep the raw text after the b column (name, extra columns and comment) so that
+    unchanged rows are written back as they were read.
+    """
+    ids: np.ndarray                 # int32
+    r: np.ndarray                   # int16, -1 when empty
+    g: np.ndarray
+    b: np.ndarray
+    names: str
+    name_offsets: np.ndarray        # int64, n_rows + 1
+    rests: str
+    rest_offsets: np.ndarray        # int64, n_rows + 1
+    header: str = ""
+    comment_lines: Dict[int, List[str]] = field(default_factory=dict)   # Lines before row i (n_rows: at the end)
+    encoding: str = "utf-8"
+    newline: str = "\n"                 # Line ending of the file, "\r\n" or "\n"
+    final_newline: bool = True          # Whether the last line ends with a line ending
+    _id_to_row: np.ndarray | None = field(default=None, repr=False)
+    _color_lookup: np.ndarray | None = field(default=None, repr=False)
+
+    @classmethod
+    def load(cls, definitions_path: Path) -> 'DefinitionTable':
+        """Read a CK2 (cp1252) or CK3 (UTF-8) definition.csv"""
+        text, encoding = read_game_file(definitions_path)
+        lines = text.splitlines()
+        first_line = text.split("\n", 1)[0]
+
+        columns, names, rests = [], [], []
+        comment_lines = {}
+        for line in lines[1:]:
+            values = line.strip().split(";", 4)
+            if len(values) < 4 or not values[0].isdigit():
+                # Comments, blank lines and anything else that is not a province
+                comment_lines.setdefault(len(rests), []).append(line)
+                continue
+            columns.append(values[:4])
+            rest = values[4] if len(values) > 4 else ""
+            rests.append(rest)
+            # Same name as open_definitions: middle columns joined with spaces
+            names.append(" ".join(rest.split(";")[:-1]))
+
+        # Numbers converted all at once, empty colors become -1
+        columns = np.array(columns, dtype=str).reshape(-1, 4)
+        columns = np.char.strip(columns)
+        columns[columns == ""] = "-1"
+        columns = columns.astype(np.int32)
+        names, name_offsets = _join_strings(names)
+        rests, rest_offsets = _join_strings(rests)
+        return cls(
+            ids=columns[:, 0].copy(),
+            r=columns[:, 1].astype(np.int16),
+            g=columns[:, 2].astype(np.int16),
+            b=columns[:, 3].astype(np.int16),
+            names=names,
+            name_offsets=name_offsets,
+            rests=rests,
+            rest_offsets=rest_offsets,
+            header=lines[0] if lines else "",
+            comment_lines=comment_lines,
+            encoding=encoding,
+            newline="\r\n" if first_line.endswith("\r") else "\n",
+            final_newline=text.endswith("\n"),
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def name(self, row: int) -> str:
+        return self.names[self.name_offsets[row]:self.name_offsets[row + 1]]
+
+    def rest(self, row: int) -> str:
+        return self.rests[self.rest_offsets[row]:self.rest_offsets[row + 1]]
+
+    def comment(self, row: int) -> str | None:
+        """Text after the first # of the last column, like open_definitions"""
+        last_column = self.rest(row).split(";")[-1]
+        return "#".join(last_column.split("#")[1:]) if "#" in last_column else None
+
+    @property
+    def packed_colors(self) -> np.ndarray:
+        """int64 0xRRGGBB of every row, -1 for rows without color"""
+        has_color = (self.r >= 0) & (self.g >= 0) & (self.b >= 0)
+        packed = (self.r.astype(np.int64) << 16) | (self.g.astype(np.int64) << 8) | self.b.astype(np.int64)
+        return np.where(has_color, packed, -1)
+
+    @property
+    def id_to_row(self) -> np.ndarray:
+        """Row of every id, -1 for ids not in the file"""
+        if self._id_to_row is None:
+            self._id_to_row = np.full(int(self.ids.max(initial=0)) + 1, -1, dtype=np.int32)
+            self._id_to_row[self.ids] = np.arange(len(self.ids), dtype=np.int32)
+        return self._id_to_row
+
+    def rows_of(self, ids) -> np.ndarray:
+        """Rows of an array of ids, -1 for unknown ids"""
+        ids = np.asarray(ids, dtype=np.int64)
+        known = (ids >= 0) & (ids < len(self.id_to_row))
+        return np.where(known, self.id_to_row[np.where(known, ids, 0)], -1)
+
+    @property
+    def color_lookup(self) -> np.ndarray:
+        """2^24 int32 table from packed color to province id, 0 for unused colors"""
+        if self._color_lookup is None:
+            self._color_lookup = np.zeros(1 << 24, dtype=np.int32)
+            packed = self.packed_colors
+            # Reversed so that the first row wins when a color is listed twice
+            self._color_lookup[packed[::-1][packed[::-1] >= 0]] = self.ids[::-1][packed[::-1] >= 0]
+        return self._color_lookup
+
+    def ids_of_colors(self, packed_colors) -> np.ndarray:
+        """Province id of packed 0xRRGGBB colors, 0 for unknown colors"""
+        return self.color_lookup[np.asarray(packed_colors, dtype=np.int64) & 0xFFFFFF]
+
+    def color_to_id(self) -> Dict[Tuple[int, int, int], int]:
+        """{(r, g, b): id} for the rows with a color"""
+        has_color = self.packed_colors >= 0
+        return {
+            (r, g, b): province_id
+            for province_id, r, g, b in zip(
+                self.ids[has_color].tolist(), self.r[has_color].tolist(),
+                self.g[has_color].tolist(), self.b[has_color].tolist(),
+            )
+        }
+
+    def to_definitions(self) -> List:
+        """Same list as open_definitions: Definition models with the comment lines in between"""
+        from .all_titles import Definition
+        definitions = []
+        for row in range(len(self) + 1):
+            definitions.extend(line.strip() for line in self.comment_lines.get(row, []))
+            if row == len(self):
+                break
+            r, g, b = (int(channel[row]) for channel in (self.r, self.g, self.b))
+            definitions.append(Definition(
+                id=int(self.ids[row]),
+                r=r if r >= 0 else None,
+                g=g if g >= 0 else None,
+                b=b if b >= 0 else None,
+                name=self.name(row),
+                comment=self.comment(row) or "",
+            ))
+        return definitions
+
+    def reindexed(self, new_ids) -> 'DefinitionTable':
+        """
+        Copy with the id of every row replaced by new_ids (one per row), rows sorted by new id.
+        Comment lines move with the row they precede, those at the end stay at the end.
+        """
+        new_ids = np.asarray(new_ids, dtype=np.int32)
+        order = np.argsort(new_ids, kind="stable")
+        names, name_offsets = _join_strings([self.name(row) for row in order.tolist()])
+        rests, rest_offsets = _join_strings([self.rest(row) for row in order.tolist()])
+        position = np.empty(len(order), dtype=np.int64)
+        position[order] = np.arange(len(order))
+        comment_lines = {
+            int(position[row]) if row < len(self) else len(self): lines
+            for row, lines in self.comment_lines.items()
+        }
+        return DefinitionTable(
+            ids=new_ids[order],
+            r=self.r[order],
+            g=self.g[order],
+            b=self.b[order],
+            names=names,
+            name_offsets=name_offsets,
+            rests=rests,
+            rest_offsets=rest_offsets,
+            header=self.header,
+            comment_lines=dict(sorted(comment_lines.items())),
+            encoding=self.encoding,
+            newline=self.newline,
+            final_newline=self.final_newline,
+        )
+
+    def lines(self) -> List[str]:
+        """File lines, comments included"""
+        lines = [self.header]
+        for row in range(len(self) + 1):
+            lines.extend(self.comment_lines.get(row, []))
+            if row == len(self):
+                break
+            colors = ";".join("" if channel[row] < 0 else str(channel[row]) for channel in (self.r, self.g, self.b))
+            lines.append(f"{self.ids[row]};{colors};{self.rest(row)}")
+        return lines
+
+    def write(self, definitions_path: Path, encoding: str | None = None):
+        """Write definition.csv, by default in the encoding and with the line endings it was read with"""
+        Path(definitions_path).parent.mkdir(parents=True, exist_ok=True)
+        with open(definitions_path, "w", encoding=encoding or self.encoding, newline="") as file:
+            file.write(self.newline.join(self.lines()) + (self.newline if self.final_newline else ""))
+
+
 def convert_definitions(
         original_definitions_path: str,
         destination_definitions_path: str,
@@ -15,4 +227,37 @@ def convert_definitions(
     
 
 
-    pass
\ No newline at end of file
+    pass
+
+
+def definitions_color_allocator(
+        definitions: 'DefinitionTable | List',
+        province_map_path: Path | None = None,
+        min_distance: int = 1,
+        seed: int = 0,
+) -> ColorAllocator:
+    """
+    Color allocator blocking the colors of a DefinitionTable or of open_definitions entries
+    (comment lines are skipped) and, if given, every color drawn on the province map.
+    """
+    allocator = ColorAllocator(min_distance=min_distance, seed=seed)
+    if isinstance(definitions, DefinitionTable):
+        colors = np.stack([definitions.r, definitions.g, definitions.b], axis=1)[definitions.packed_colors >= 0]
+    else:
+        colors = np.array([
+            (definition.r, definition.g, definition.b)
+            for definition in definitions
+            if not isinstance(definition, str) and definition.r is not None
+        ], dtype=np.int32)
+    allocator.mark_used(colors)
+    if province_map_path is not None:
+        image = open_province_image(province_map_path)
+        if image is not None:
+            allocator.mark_image(np.array(image))
+    return allocator
+
+
+def assign_barony_colors(baronies: List[str], allocator: ColorAllocator) -> Dict[str, Tuple[int, int, int]]:
+    """Give every barony a new unique color"""
+    colors = allocator.allocate(len(baronies)).tolist()
+    return {barony: tuple(color) for barony, color in zip(baronies, colors)}
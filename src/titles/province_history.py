@@ -0,0 +1,131 @@
+from pathlib import Path
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, Tuple, TypeVar
+from src.utils.directory_index import index_directory
+from .all_titles import CountyProvinceHistory, ProvinceSummary, read_province_history
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+CK2_TO_CK3_HOLDING = {
+    "castle": "castle_holding",
+    "city": "city_holding",
+    "temple": "church_holding",
+    "tribal": "tribal_holding",
+    "nomad": "nomad_holding",
+}
+
+
+def bounded_map(
+        function: Callable[[T], R],
+        items: Iterable[T],
+        jobs: int = 1,
+        max_pending: int = 64,
+        processes: bool = True,
+) -> Iterator[R]:
+    """
+    Lazy map keeping the input order.
+    With jobs > 1, items are handled by a worker pool (processes, or threads) with at most
+    max_pending items in flight: the input is only read as fast as results are consumed.
+    """
+    if jobs <= 1:
+        yield from map(function, items)
+        return
+    executor_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with executor_class(max_workers=jobs) as executor:
+        executor: Executor
+        pending = deque()
+        for item in items:
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+            pending.append(executor.submit(function, item))
+        while pending:
+            yield pending.popleft().result()
+
+
+def discover_province_histories(history_folder: Path, ids: Iterable[int] | None = None) -> Iterator[Tuple[int, Path]]:
+    """(province id, file) of history/provinces, one directory scan, in id order"""
+    history_files = index_directory(history_folder)
+    if ids is not None:
+        # ids may be a one-shot iterator, the report and the lookups both go through it
+        ids = [int(i) for i in ids]
+    history_files.print_report(ids)
+    if ids is None:
+        keys = sorted(history_files.files)
+    else:
+        missing = history_files.missing(ids)
+        if missing:
+            # Sea and coast provinces have no history
+            print(f"No history file found for {len(missing)} provinces: {missing[:10]}")
+        keys = [i for i in ids if i in history_files.files]
+    for province_id in keys:
+        yield province_id, history_files.files[province_id]
+
+
+def ck3_province_history(history: CountyProvinceHistory) -> str:
+    """
+    CK3 history/provinces block of a CK2 county.
+    The county keeps its first barony only, so its holding is the one of the province.
+    """
+    lines = [f"{history.id} = {{"]
+    if history.base_culture:
+        lines.append(f"\tculture = {history.base_culture}")
+    if history.base_religion:
+        lines.append(f"\treligion = {history.base_religion}")
+
+    first_barony = next(iter(history.baronies_history.values()), None)
+    if first_barony is not None and first_barony.holding not in (None, "none"):
+        lines.append(f"\tholding = {CK2_TO_CK3_HOLDING.get(first_barony.holding, first_barony.holding)}")
+
+    dated = {}
+    for date, changes in history.history.items():
+        for key in ("culture", "religion"):
+            if key in changes and isinstance(changes[key], str):
+                dated.setdefault(date, []).append(f"{key} = {changes[key]}")
+    if first_barony is not None:
+        for date, changes in first_barony.history.items():
+            holding = changes.get("holding")
+            if isinstance(holding, str):
+                dated.setdefault(date, []).append(f"holding = {CK2_TO_CK3_HOLDING.get(holding, holding)}")
+    for date in sorted(dated, key=lambda date: tuple(int(part) for part in date.split("."))):
+        lines.append(f"\t{date} = {{ {' '.join(dated[date])} }}")
+
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def convert_province_history_file(item: Tuple[int, Path]) -> Tuple[Path, str, ProvinceSummary]:
+    """Parse and transform stage of one province: (id, CK2 file) -> (CK2 file, CK3 text, summary)"""
+    province_id, history_file = item
+    history = read_province_history(province_id, history_file)
+    return history_file, ck3_province_history(history), history.summary()
+
+
+def convert_province_histories(
+        original_mod_folder: Path,
+        new_mod_folder: Path,
+        ids: Iterable[int] | None = None,
+        jobs: int = 1,
+        max_pending: int = 64,
+) -> Dict[int, ProvinceSummary]:
+    """
+    take in history/provinces/*.txt
+    return history/provinces/*.txt in CK3 syntax, one file per province with the same name
+
+    Provinces stream one by one through discover -> parse -> transform -> write, so memory
+    does not grow with the number of provinces and files are written as soon as they are ready.
+    With jobs > 1, parse and transform run in a process pool.
+    Returns the summary of every converted province: title, terrain and baronies.
+    """
+    destination_folder = Path(new_mod_folder, "history", "provinces")
+    destination_folder.mkdir(parents=True, exist_ok=True)
+    items = discover_province_histories(Path(original_mod_folder, "history", "provinces"), ids)
+
+    summaries = {}
+    for history_file, text, summary in bounded_map(convert_province_history_file, items, jobs, max_pending):
+        with open(destination_folder / history_file.name, "w", encoding="utf-8-sig") as file:
+            file.write(text)
+        summaries[summary.id] = summary
+    print(f"Successfully converted {len(summaries)} province histories to {destination_folder}")
+    return summaries
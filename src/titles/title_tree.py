@@ -0,0 +1,148 @@
+from pathlib import Path
+from typing import Dict, Iterable, List
+import numpy as np
+from src.utils.paradox_file_parser import regex_paradox_parser
+from .all_titles import LandedTitle, parse_title_block
+
+TITLE_PREFIXES = ('e_', 'k_', 'd_', 'c_', 'b_')
+RANKS = {"e": 1, "k": 2, "d": 3, "c": 4, "b": 5}
+
+
+class TitleTree:
+    """
+    Every landed title in flat arrays, in depth-first (pre-order) order.
+
+    The subtree of title i is the range i:ends[i], so "all counties of a kingdom" is a
+    slice and "is a under b" two comparisons. Parents are indices, -1 for top titles,
+    so ancestors are a few array hops, for one title or for whole arrays at once.
+    The parsed blocks are kept to build the LandedTitle models on demand.
+    """
+
+    def __init__(self, blocks: Iterable[tuple[str, Dict]]):
+        """blocks: (title name, parsed block) of the top-level titles, in file order"""
+        names, parents, depths, capitals, data = [], [], [], [], []
+        stack = [(name, block, -1, 0) for name, block in reversed(list(blocks))]
+        while stack:
+            name, block, parent, depth = stack.pop()
+            index = len(names)
+            names.append(name)
+            parents.append(parent)
+            depths.append(depth)
+            capital = block.get('capital')
+            capitals.append(int(capital) if isinstance(capital, (int, str)) and str(capital).isdigit() else -1)
+            data.append(block)
+            children = [
+                (key, value) for key, value in block.items()
+                if isinstance(value, dict) and key.startswith(TITLE_PREFIXES)
+            ]
+            stack.extend((key, value, index, depth + 1) for key, value in reversed(children))
+
+        self.names: List[str] = names
+        self.index: Dict[str, int] = {}
+        for i, name in enumerate(names):
+            # A title defined twice keeps its first definition
+            self.index.setdefault(name, i)
+        self.parents = np.array(parents, dtype=np.int32)
+        self.depths = np.array(depths, dtype=np.int8)
+        self.ranks = np.array([RANKS.get(name[0], 0) for name in names], dtype=np.int8)
+        self.capitals = np.array(capitals, dtype=np.int32)
+        self.blocks = data
+        self._models: Dict[int, LandedTitle] = {}
+
+        # End of each subtree: the next title that is not deeper, in pre-order
+        n = len(names)
+        self.ends = np.full(n, n, dtype=np.int32)
+        open_titles = []
+        for i, depth in enumerate(depths):
+            while open_titles and depths[open_titles[-1]] >= depth:
+                self.ends[open_titles.pop()] = i
+            open_titles.append(i)
+
+        self.province_titles = np.full(0, -1, dtype=np.int32)
+
+    @classmethod
+    def load(cls, landed_titles_path: Path) -> 'TitleTree':
+        """Read a landed titles file, or every .txt file of a folder in name order"""
+        landed_titles_path = Path(landed_titles_path)
+        files = sorted(landed_titles_path.glob("*.txt")) if landed_titles_path.is_dir() else [landed_titles_path]
+        blocks = []
+        for file in files:
+            blocks.extend(
+                (name, block) for name, block in regex_paradox_parser(file).items()
+                if isinstance(block, dict) and name.startswith(TITLE_PREFIXES)
+            )
+        return cls(blocks)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, name: str) -> int:
+        return self.index[name]
+
+    def model(self, name: str) -> LandedTitle:
+        """LandedTitle of a title with all its children, built once on first access"""
+        i = self.index[name]
+        if i not in self._models:
+            self._models[i] = parse_title_block(name, self.blocks[i])
+        return self._models[i]
+
+    def landed_titles(self) -> List[LandedTitle]:
+        """Same nested models as read_landed_titles, for every top title"""
+        return [self.model(self.names[i]) for i in np.flatnonzero(self.parents < 0)]
+
+    def subtree(self, name: str, rank: int | None = None) -> np.ndarray:
+        """Indices of a title and every title under it, only those of a rank if given"""
+        i = self.index[name]
+        indices = np.arange(i, self.ends[i])
+        return indices if rank is None else indices[self.ranks[i:self.ends[i]] == rank]
+
+    def subtree_names(self, name: str, rank: int | None = None) -> List[str]:
+        return [self.names[i] for i in self.subtree(name, rank)]
+
+    def is_under(self, titles, ancestor: str) -> np.ndarray:
+        """Whether each title index is the ancestor or below it"""
+        i = self.index[ancestor]
+        titles = np.asarray(titles)
+        return (titles >= i) & (titles < self.ends[i])
+
+    def liege(self, name: str) -> str | None:
+        """De jure liege: the title directly above"""
+        parent = self.parents[self.index[name]]
+        return self.names[parent] if parent >= 0 else None
+
+    def ancestors_at_rank(self, titles, rank: int) -> np.ndarray:
+        """
+        For each title index, the title of the given rank above it (or itself),
+        -1 when there is none or for -1 inputs. One hop per level for all titles at once.
+        """
+        titles = np.array(titles, dtype=np.int32)
+        valid = titles >= 0
+        current = np.where(valid, titles, 0)
+        for _ in range(int(self.depths.max(initial=0)) + 1):
+            climbing = valid & (self.ranks[current] > rank) & (self.parents[current] >= 0)
+            if not climbing.any():
+                break
+            current = np.where(climbing, self.parents[current], current)
+        return np.where(valid & (self.ranks[current] == rank), current, -1)
+
+    def set_provinces(self, title_provinces: Dict[str, int]):
+        """
+        Province of the counties (CK2, from history/provinces title) or baronies (CK3).
+        Builds the province id -> title index table used by titles_of_provinces.
+        """
+        known = [(province, self.index[title]) for title, province in title_provinces.items() if title in self.index]
+        size = max((province for province, _ in known), default=-1) + 1
+        self.province_titles = np.full(size, -1, dtype=np.int32)
+        for province, title in known:
+            self.province_titles[province] = title
+
+    def titles_of_provinces(self, province_ids, rank: int | None = None) -> np.ndarray:
+        """
+        Title index of each province id (any shape, e.g. a province id raster), -1 if unknown.
+        With rank, the title of that rank containing the province.
+        """
+        # Climb once per province, then a single lookup per pixel
+        table = self.province_titles if rank is None else self.ancestors_at_rank(self.province_titles, rank)
+        province_ids = np.asarray(province_ids, dtype=np.int64)
+        known = (province_ids >= 0) & (province_ids < len(table))
+        return np.where(known, table[np.where(known, province_ids, 0)], -1)
@@ -0,0 +1,81 @@
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List
+import os
+import re
+
+# "123 - Name.txt" (history/provinces, history/characters...)
+ID_PREFIX = re.compile(r"^(\d+)(?!\d)")
+# "c_name.txt" (history/titles, common/landed_titles...)
+STEM = re.compile(r"^(.+?)\.[^.]*$")
+
+
+@dataclass
+class DirectoryIndex:
+    """Files of a folder by the key their name starts with, listed once."""
+    folder: Path
+    files: Dict[object, Path] = field(default_factory=dict)             # key -> file, the first in name order
+    duplicates: Dict[object, List[Path]] = field(default_factory=dict)  # key -> every file when there are several
+    unparsed: List[Path] = field(default_factory=list)                  # Files whose name has no key
+
+    def get(self, key) -> Path | None:
+        return self.files.get(key)
+
+    def missing(self, keys: Iterable) -> List:
+        """Keys with no file"""
+        return [key for key in keys if key not in self.files]
+
+    def unmatched(self, keys: Iterable) -> List[Path]:
+        """Files whose key is not in keys"""
+        keys = set(keys)
+        return [path for key, path in self.files.items() if key not in keys]
+
+    def print_report(self, keys: Iterable | None = None):
+        """Warn about duplicate keys, files without key and, given the expected keys, files matching none"""
+        for key, paths in self.duplicates.items():
+            print(f"Warning: {len(paths)} files for {key} in {self.folder}, using {paths[0].name}: "
+                  f"{[path.name for path in paths[1:]]}")
+        if self.unparsed:
+            print(f"Warning: {len(self.unparsed)} files without key in {self.folder}: "
+                  f"{[path.name for path in self.unparsed[:10]]}")
+        if keys is not None:
+            unmatched = self.unmatched(keys)
+            if unmatched:
+                print(f"Warning: {len(unmatched)} files in {self.folder} match no known key: "
+                      f"{[path.name for path in unmatched[:10]]}")
+
+
+def index_directory(
+        folder: Path,
+        pattern: re.Pattern = ID_PREFIX,
+        key_type: Callable = int,
+        suffix: str | None = ".txt",
+) -> DirectoryIndex:
+    """
+    List folder once with os.scandir and index its files by the first group of pattern
+    matched at the start of the file name, converted with key_type.
+    By default files are indexed by their leading number, as in history/provinces.
+    Missing folders give an empty index.
+    """
+    index = DirectoryIndex(Path(folder))
+    try:
+        with os.scandir(folder) as entries:
+            names = sorted(entry.name for entry in entries if entry.is_file())
+    except FileNotFoundError:
+        print(f"Warning: folder not found at {folder}")
+        return index
+
+    for name in names:
+        if suffix is not None and not name.endswith(suffix):
+            continue
+        path = Path(folder, name)
+        match = pattern.match(name)
+        if match is None:
+            index.unparsed.append(path)
+            continue
+        key = key_type(match.group(1))
+        if key in index.files:
+            index.duplicates.setdefault(key, [index.files[key]]).append(path)
+        else:
+            index.files[key] = path
+    return index
@@ -0,0 +1,225 @@
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, Iterable, List, Tuple
+import re
+import numpy as np
+
+# Ordinal of values set outside of any date block: before every dated change
+BASE_DATE = -(1 << 40)
+# Combined (entity, date) keys: entity * ENTITY_STRIDE + date - BASE_DATE
+ENTITY_STRIDE = 1 << 42
+
+DATE = re.compile(r"^\s*(-?\d+)\.(\d+)\.(\d+)\s*$")
+
+
+def date_ordinal(date: str) -> int:
+    """
+    Paradox "Y.M.D" date as an integer that sorts like the date: Y * 10000 + M * 100 + D.
+    Raises ValueError for anything else.
+    """
+    match = DATE.match(date)
+    if match is None:
+        raise ValueError(f"Not a date: {date!r}")
+    year, month, day = (int(part) for part in match.groups())
+    return year * 10000 + month * 100 + day
+
+
+def ordinal_date(ordinal: int) -> str:
+    """Inverse of date_ordinal"""
+    year, month_day = divmod(ordinal, 10000)
+    return f"{year}.{month_day // 100}.{month_day % 100}"
+
+
+def is_date(key: Any) -> bool:
+    return isinstance(key, str) and DATE.match(key) is not None
+
+
+@dataclass
+class AttributeHistory:
+    """Changes of one attribute, sorted by entity then date (then file order)."""
+    entities: np.ndarray    # int32 entity index of every change
+    dates: np.ndarray       # int64 date ordinal, BASE_DATE for undated values
+    values: np.ndarray      # int32 index in HistoryIndex.values
+    starts: np.ndarray      # int64, n_entities + 1: changes of entity e are starts[e]:starts[e + 1]
+    keys: np.ndarray        # int64 combined (entity, date) key, for searchsorted
+
+
+class HistoryIndex:
+    """
+    Dated changes of many entities (provinces, baronies, titles, characters...).
+
+    Changes are collected with add, then frozen per attribute into sorted arrays.
+    The state of one entity at a date is a bisection, the state of every entity
+    at a date (a bookmark snapshot) is one searchsorted call per attribute.
+    Values are interned: equal values share one entry of self.values.
+    """
+
+    def __init__(self):
+        self.entities: List[Hashable] = []
+        self.entity_index: Dict[Hashable, int] = {}
+        self.values: List[Any] = []
+        self.value_index: Dict[Any, int] = {}
+        self._changes: Dict[str, List[Tuple[int, int, int]]] = {}
+        self._attributes: Dict[str, AttributeHistory] | None = None
+
+    def entity(self, key: Hashable) -> int:
+        index = self.entity_index.get(key)
+        if index is None:
+            index = self.entity_index[key] = len(self.entities)
+            self.entities.append(key)
+        return index
+
+    def intern(self, value: Any) -> int:
+        try:
+            index = self.value_index.get(value)
+        except TypeError:
+            # Blocks (dicts, lists) are kept as they are, without sharing
+            self.values.append(value)
+            return len(self.values) - 1
+        if index is None:
+            index = self.value_index[value] = len(self.values)
+            self.values.append(value)
+        return index
+
+    def add(self, entity: Hashable, attribute: str, value: Any, date: str | int | None = None):
+        """Record attribute = value for entity, at date ("Y.M.D" or ordinal), or as its base value"""
+        if date is None:
+            ordinal = BASE_DATE
+        elif isinstance(date, str):
+            ordinal = date_ordinal(date)
+        else:
+            ordinal = int(date)
+        self._changes.setdefault(attribute, []).append((self.entity(entity), ordinal, self.intern(value)))
+        self._attributes = None
+
+    @property
+    def attributes(self) -> Dict[str, AttributeHistory]:
+        """Sorted arrays of every attribute, built on first use after the last add"""
+        if self._attributes is None:
+            self._attributes = {}
+            n_entities = len(self.entities)
+            for attribute, changes in self._changes.items():
+                entities, dates, values = (np.array(column, dtype=np.int64) for column in zip(*changes))
+                # Stable sort: changes on the same date stay in the order they were added
+                order = np.lexsort((dates, entities))
+                entities, dates, values = entities[order], dates[order], values[order]
+                starts = np.searchsorted(entities, np.arange(n_entities + 1))
+                self._attributes[attribute] = AttributeHistory(
+                    entities=entities.astype(np.int32),
+                    dates=dates,
+                    values=values.astype(np.int32),
+                    starts=starts,
+                    keys=entities * ENTITY_STRIDE + (dates - BASE_DATE),
+                )
+        return self._attributes
+
+    def value_at(self, entity: Hashable, attribute: str, date: str | int, default: Any = None) -> Any:
+        """Value of an attribute of one entity on a date: its last change up to that date included"""
+        history = self.attributes.get(attribute)
+        index = self.entity_index.get(entity)
+        if history is None or index is None:
+            return default
+        ordinal = date_ordinal(date) if isinstance(date, str) else date
+        start, end = history.starts[index], history.starts[index + 1]
+        position = start + np.searchsorted(history.dates[start:end], ordinal, side='right') - 1
+        return self.values[history.values[position]] if position >= start else default
+
+    def snapshot_codes(self, attribute: str, date: str | int) -> np.ndarray:
+        """Interned value of the attribute of every entity on a date, -1 when it has none yet"""
+        codes = np.full(len(self.entities), -1, dtype=np.int32)
+        history = self.attributes.get(attribute)
+        if history is None or len(history.keys) == 0:
+            return codes
+        ordinal = date_ordinal(date) if isinstance(date, str) else date
+        entities = np.arange(len(self.entities), dtype=np.int64)
+        positions = np.searchsorted(history.keys, entities * ENTITY_STRIDE + (ordinal - BASE_DATE), side='right') - 1
+        found = positions >= history.starts[:-1]
+        codes[found] = history.values[positions[found]]
+        return codes
+
+    def snapshot(self, date: str | int, attributes: Iterable[str] | None = None) -> Dict[str, Dict[Hashable, Any]]:
+        """{attribute: {entity: value}} on a date, for the entities having a value"""
+        snapshot = {}
+        for attribute in self.attributes if attributes is None else attributes:
+            codes = self.snapshot_codes(attribute, date)
+            snapshot[attribute] = {
+                self.entities[entity]: self.values[code]
+                for entity, code in zip(np.flatnonzero(codes >= 0).tolist(), codes[codes >= 0].tolist())
+            }
+        return snapshot
+
+    def changes(self, entity: Hashable, attribute: str) -> List[Tuple[str | None, Any]]:
+        """Every change of an attribute of one entity in date order, None for the base value"""
+        history = self.attributes.get(attribute)
+        index = self.entity_index.get(entity)
+        if history is None or index is None:
+            return []
+        start, end = history.starts[index], history.starts[index + 1]
+        return [
+            (None if date == BASE_DATE else ordinal_date(date), self.values[value])
+            for date, value in zip(history.dates[start:end].tolist(), history.values[start:end].tolist())
+        ]
+
+
+def _add_dated_blocks(index: HistoryIndex, entity: Hashable, history: Dict[str, Any], skip=lambda key: False):
+    """Add {date: {attribute: value}} or {date: [Change]} blocks"""
+    for date, changes in history.items():
+        if not is_date(date):
+            continue
+        if isinstance(changes, dict):
+            changes = changes.items()
+        else:
+            changes = [(getattr(change.key, "value", change.key), change.value) for change in changes]
+        for attribute, value in changes:
+            if not skip(attribute):
+                index.add(entity, attribute, value, date)
+
+
+def province_history_index(id_to_history: Dict[int, Any]) -> HistoryIndex:
+    """
+    Index of CountyProvinceHistory (src.titles.all_titles) by province id:
+    title, culture, religion, max_settlements and terrain as base values, then dated changes.
+    Baronies are left to barony_history_index.
+    """
+    index = HistoryIndex()
+    for province_id, history in id_to_history.items():
+        for attribute, value in (
+            ("title", history.title),
+            ("culture", history.base_culture),
+            ("religion", history.base_religion),
+            ("max_settlements", history.max_settlements),
+            ("terrain", history.terrain),
+        ):
+            if value is not None:
+                index.add(province_id, attribute, value)
+        _add_dated_blocks(index, province_id, history.history, skip=lambda key: key.startswith("b_"))
+    return index
+
+
+def barony_history_index(id_to_history: Dict[int, Any]) -> HistoryIndex:
+    """Index of the BaronyHistory of every province by barony title: holding and province"""
+    index = HistoryIndex()
+    for province_id, history in id_to_history.items():
+        for barony, barony_history in history.baronies_history.items():
+            index.add(barony, "province", province_id)
+            if barony_history.holding not in (None, "none"):
+                index.add(barony, "holding", barony_history.holding)
+            _add_dated_blocks(index, barony, barony_history.history)
+    return index
+
+
+def title_history_index(title_histories: Dict[str, Any]) -> HistoryIndex:
+    """Index of TitleHistory (src.games.ck2.classes) by title: holder, liege, laws..."""
+    index = HistoryIndex()
+    for title, history in title_histories.items():
+        _add_dated_blocks(index, title, history.history)
+        _add_dated_blocks(index, title, history.changes)
+    return index
+
+
+def character_history_index(character_histories: Dict[int, Any]) -> HistoryIndex:
+    """Index of CharacterHistory (src.games.ck2.classes) by character id: birth, death, employer..."""
+    index = HistoryIndex()
+    for character, history in character_histories.items():
+        _add_dated_blocks(index, character, history.history)
+        _add_dated_blocks(index, character, history.changes)
+    return index
@@ -3,6 +3,23 @@ from typing import Dict, Tuple, List, Optional, Union, Any
 import re
 from pprint import pprint   
 
+def read_game_file(file_path: Path, errors: str = 'strict') -> Tuple[str, str]:
+    """
+    Read a whole game file as (text, encoding).
+    CK2 files are mostly cp1252 while CK3 ones are UTF-8 with BOM: try UTF-8 first.
+    The encoding is 'utf-8-sig' when the file has a BOM, so that writing it back keeps it.
+    errors applies to the cp1252 fallback, keep 'strict' for files that are written back.
+    """
+    data = Path(file_path).read_bytes()
+    try:
+        return data.decode('utf-8-sig'), 'utf-8-sig' if data.startswith(b'\xef\xbb\xbf') else 'utf-8'
+    except UnicodeDecodeError:
+        return data.decode('cp1252', errors=errors), 'cp1252'
+
+def read_game_text(file_path: Path) -> str:
+    """Read a whole game file as text, see read_game_file"""
+    return read_game_file(file_path, errors='replace')[0]
+
 def file_reader(file_path: Path) -> List[Tuple[str, Optional[str]]]:
     """
     Reads a file and returns a list of tuples containing (line_content, comment).
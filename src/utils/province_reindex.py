@@ -0,0 +1,341 @@
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Tuple
+import os
+import re
+import numpy as np
+from src.map.default_map import format_id_list, id_runs
+from src.titles.definitions import DefinitionTable
+from src.utils.directory_index import ID_PREFIX, index_directory
+from src.utils.paradox_file_parser import read_game_file, regex_paradox_parser
+
+# Words, numbers and quoted strings, and braces: '=' and spaces are kept as they are
+TOKEN = re.compile(r'[^\s{}=#]+|\{|\}')
+# CK2 default.map top level range: "sea_zones = { first last }"
+CK2_RANGE = re.compile(r'^(?P<indent>\s*)(?P<key>sea_zones)\s*=\s*\{\s*(?P<first>\d+)\s+(?P<last>\d+)\s*\}(?P<trailing>\s*)$')
+# CK3 default.map lists: "sea_zones = RANGE { first last }" and "lakes = LIST { 1 2 3 }"
+CK3_LIST = re.compile(r'^(?P<indent>\s*)(?P<key>\w+)\s*=\s*(?P<kind>RANGE|LIST)\s*\{(?P<ids>[^}]*)\}\s*$')
+MAX_PROVINCES = re.compile(r'^(?P<start>\s*max_provinces\s*=\s*)(?P<value>\d+)')
+
+# Blocks listing province ids, by file
+CLIMATE_BLOCKS = None   # Every block of climate.txt is a list of provinces
+DEFAULT_MAP_BLOCKS = {"sea_zones", "major_rivers"}
+ADJACENCY_COLUMNS = ("from", "to", "through")
+
+
+def sequential_id_map(ids: Iterable[int], first_id: int = 1) -> Dict[int, int]:
+    """Old id -> new id closing the gaps: sorted ids numbered from first_id"""
+    return {old: new for new, old in enumerate(sorted(set(int(i) for i in ids)), start=first_id)}
+
+
+def id_lookup(id_map: Dict[int, int], size: int = 0) -> List[int]:
+    """Old id -> new id table, ids missing from id_map keep their number"""
+    size = max(size, max(id_map, default=-1) + 1)
+    lookup = np.arange(size, dtype=np.int64)
+    if id_map:
+        lookup[np.fromiter(id_map.keys(), dtype=np.int64)] = np.fromiter(id_map.values(), dtype=np.int64)
+    return lookup.tolist()
+
+
+def validate_id_map(id_map: Dict[int, int], existing_ids: Iterable[int]) -> List[int]:
+    """
+    Final ids of existing_ids after renumbering, in the same order.
+    Raises ValueError, before anything is written, when two provinces would end up with
+    the same id or an id is not a positive integer.
+    """
+    invalid = [(old, new) for old, new in id_map.items() if int(old) <= 0 or int(new) <= 0]
+    if invalid:
+        raise ValueError(f"Province ids must be positive: {invalid[:10]}")
+    existing_ids = [int(i) for i in existing_ids]
+    unknown = set(id_map) - set(existing_ids)
+    if unknown:
+        print(f"Warning: {len(unknown)} ids to renumber are not in definition.csv: {sorted(unknown)[:10]}")
+    final_ids = [id_map.get(i, i) for i in existing_ids]
+    values, counts = np.unique(np.array(final_ids, dtype=np.int64), return_counts=True)
+    if (counts > 1).any():
+        clashes = values[counts > 1].tolist()
+        raise ValueError(f"{len(clashes)} ids would be used by several provinces: {clashes[:10]}")
+    return final_ids
+
+
+def split_comment(line: str) -> Tuple[str, str, str]:
+    """(content, comment with its #, line ending) of a line read with its ending"""
+    body = line.rstrip("\r\n")
+    ending = line[len(body):]
+    if "#" in body:
+        content, comment = body.split("#", 1)
+        return content, "#" + comment, ending
+    return body, "", ending
+
+
+class BlockIdRewriter:
+    """
+    Rewrite the province ids of Paradox script one line at a time.
+
+    Numbers are ids when they are directly inside a block whose key is in block_keys
+    (every block when block_keys is None), or the value of a key in value_keys
+    ("capital = 123"). The brace depth is carried from line to line, so blocks can
+    span several lines. Everything else, spacing and comments included, is kept.
+    """
+
+    def __init__(self, remap: Callable[[int], int], block_keys: set | None = None, value_keys: set = frozenset()):
+        self.remap = remap
+        self.block_keys = block_keys
+        self.value_keys = value_keys
+        self.stack: List[str | None] = []
+        self.last_word: str | None = None
+
+    def is_id(self, word: str) -> bool:
+        if not word.isdigit():
+            return False
+        if self.last_word in self.value_keys:
+            return True
+        if not self.stack:
+            return False
+        return self.block_keys is None or self.stack[-1] in self.block_keys
+
+    def token(self, match: re.Match) -> str:
+        word = match.group(0)
+        if word == "{":
+            self.stack.append(self.last_word)
+            self.last_word = None
+        elif word == "}":
+            if self.stack:
+                self.stack.pop()
+            self.last_word = None
+        else:
+            replaced = str(self.remap(int(word))) if self.is_id(word) else word
+            self.last_word = word
+            return replaced
+        return word
+
+    def __call__(self, content: str) -> str:
+        return TOKEN.sub(self.token, content)
+
+
+def default_map_rewriter(
+        remap: Callable[[int], int],
+        max_provinces: int | None = None,
+        province_ids: set | None = None,
+) -> Callable[[str], str]:
+    """
+    default.map, CK2 or CK3 syntax:
+    - top level "sea_zones = { first last }" ranges are expanded, renumbered and written back
+      as ranges again, one per run of consecutive ids. Ids of a range that are not in
+      province_ids, when given, are gaps of the numbering and are dropped
+    - RANGE and LIST lines (CK3) are rewritten with format_id_list
+    - sea_zones of ocean_region blocks and major_rivers lists are renumbered id by id
+    - max_provinces is set to max_provinces when given
+    """
+    blocks = BlockIdRewriter(remap, DEFAULT_MAP_BLOCKS)
+
+    def rewrite(content: str) -> str:
+        if not blocks.stack:
+            match = CK2_RANGE.match(content)
+            if match:
+                ids = [remap(i) for i in range(int(match["first"]), int(match["last"]) + 1)
+                       if province_ids is None or i in province_ids]
+                lines = [f"{match['indent']}{match['key']} = {{ {first} {last} }}" for first, last in id_runs(ids)]
+                return "\n".join(lines) + match["trailing"]
+            match = CK3_LIST.match(content)
+            if match:
+                numbers = [int(i) for i in match["ids"].split()]
+                if match["kind"] == "RANGE" and numbers:
+                    numbers = [i for i in range(numbers[0], numbers[-1] + 1) if province_ids is None or i in province_ids]
+                lines = format_id_list(match["key"], [remap(i) for i in numbers])
+                return "\n".join(match["indent"] + line for line in lines)
+            match = MAX_PROVINCES.match(content)
+            if match and max_provinces is not None:
+                return match["start"] + str(max_provinces) + content[match.end():]
+        return blocks(content)
+    return rewrite
+
+
+def adjacencies_rewriter(remap: Callable[[int], int]) -> Callable[[str], str]:
+    """adjacencies.csv: From, To and Through columns found from the header, -1 is left alone"""
+    columns = None
+
+    def rewrite(content: str) -> str:
+        nonlocal columns
+        if not content.strip():
+            return content
+        values = content.split(";")
+        if columns is None:
+            columns = [i for i, name in enumerate(values) if name.strip().lower() in ADJACENCY_COLUMNS]
+            return content
+        for i in columns:
+            if i < len(values) and values[i].strip().isdigit():
+                values[i] = str(remap(int(values[i])))
+        return ";".join(values)
+    return rewrite
+
+
+def rewrite_file(path: Path, rewrite_content: Callable[[str], str], write: bool = True) -> bool:
+    """
+    One pass over the lines of a file, rewrite_content gets the text before the comment.
+    The result goes to a temporary file that replaces the original once complete, in the
+    encoding and with the line endings it was read with. Returns whether the file changed.
+    """
+    text, encoding = read_game_file(path)
+    lines = []
+    for line in text.splitlines(keepends=True):
+        content, comment, ending = split_comment(line)
+        new_content = rewrite_content(content)
+        if "\n" in new_content:
+            # A line split in several (default.map ranges) keeps the original line ending
+            new_content = new_content.replace("\n", ending or "\n")
+        lines.append(new_content + comment + ending)
+    new_text = "".join(lines)
+    if not write or new_text == text:
+        return False
+    temporary = path.with_name(path.name + ".reindex")
+    with open(temporary, "w", encoding=encoding, newline="") as file:
+        file.write(new_text)
+    os.replace(temporary, path)
+    return True
+
+
+@dataclass
+class ModFiles:
+    """Files of a mod holding province ids"""
+    definitions: Path
+    climate: Path
+    default_map: Path
+    adjacencies: Path
+    landed_titles: List[Path]
+    history_provinces: Path
+
+    @classmethod
+    def of(cls, mod_folder: Path) -> 'ModFiles':
+        """Paths from map/default.map, with the vanilla names for missing entries"""
+        mod_folder = Path(mod_folder)
+        default_map_path = mod_folder / "map" / "default.map"
+        default_map = regex_paradox_parser(default_map_path) if default_map_path.exists() else {}
+        map_file = lambda key, default: mod_folder / "map" / str(default_map.get(key, default)).strip('"')
+        return cls(
+            definitions=map_file("definitions", "definition.csv"),
+            climate=map_file("climate", "climate.txt"),
+            default_map=default_map_path,
+            adjacencies=map_file("adjacencies", "adjacencies.csv"),
+            landed_titles=sorted(Path(mod_folder, "common", "landed_titles").glob("*.txt")),
+            history_provinces=mod_folder / "history" / "provinces",
+        )
+
+    def script_files(self, remap: Callable[[int], int], max_provinces: int | None = None, province_ids: set | None = None):
+        """(file, line rewriter) of every text file, existing ones only"""
+        files = [
+            (self.climate, BlockIdRewriter(remap, CLIMATE_BLOCKS)),
+            (self.default_map, default_map_rewriter(remap, max_provinces, province_ids)),
+            (self.adjacencies, adjacencies_rewriter(remap)),
+        ] + [(path, BlockIdRewriter(remap, set(), {"capital"})) for path in self.landed_titles]
+        return [(path, rewriter) for path, rewriter in files if path.exists()]
+
+
+def rename_history_files(history_folder: Path, lookup: List[int]) -> int:
+    """
+    Rename "<id> - name.txt" files to their new id, keeping the rest of the name.
+    Every file is first moved to a temporary name so that swapped ids never overwrite
+    each other. Returns the number of renamed files.
+    """
+    index = index_directory(history_folder)
+    renames = []
+    for province_id, path in index.files.items():
+        new_id = lookup[province_id] if province_id < len(lookup) else province_id
+        if new_id != province_id:
+            prefix = ID_PREFIX.match(path.name).group(1)
+            renames.append((path, path.with_name(f"{new_id}{path.name[len(prefix):]}")))
+    for paths in index.duplicates.values():
+        print(f"Warning: {[path.name for path in paths[1:]]} are not renamed")
+
+    moved = {path for path, _ in renames}
+    taken = [destination.name for _, destination in renames if destination.exists() and destination not in moved]
+    if taken:
+        raise FileExistsError(f"{len(taken)} history files would be overwritten in {history_folder}: {taken[:10]}")
+
+    staged = []
+    for n, (path, destination) in enumerate(renames):
+        temporary = path.with_name(f".reindex_{n}_{path.name}")
+        os.replace(path, temporary)
+        staged.append((temporary, destination))
+    for temporary, destination in staged:
+        os.replace(temporary, destination)
+    return len(renames)
+
+
+@dataclass
+class ReindexReport:
+    changed_files: List[Path] = field(default_factory=list)
+    renamed_files: int = 0
+    stale_ids: Dict[Path, List[int]] = field(default_factory=dict)    # File -> old ids still in it
+
+    @property
+    def ok(self) -> bool:
+        return not self.stale_ids
+
+
+def find_stale_ids(mod_files: ModFiles, stale: set) -> Dict[Path, List[int]]:
+    """Ids of stale found by the same rewriters in every file, and in history file names"""
+    found: Dict[Path, List[int]] = {}
+    province_ids = set(DefinitionTable.load(mod_files.definitions).ids.tolist())
+    in_definitions = sorted(province_ids & stale)
+    if in_definitions:
+        found[mod_files.definitions] = in_definitions
+
+    ids = []
+
+    def record(province_id: int) -> int:
+        ids.append(province_id)
+        return province_id
+
+    for path, rewriter in mod_files.script_files(record, province_ids=province_ids):
+        ids.clear()
+        rewrite_file(path, rewriter, write=False)
+        stale_in_file = sorted(set(ids) & stale)
+        if stale_in_file:
+            found[path] = stale_in_file
+
+    history_ids = sorted(set(index_directory(mod_files.history_provinces).files) & stale)
+    if history_ids:
+        found[mod_files.history_provinces] = history_ids
+    return found
+
+
+def reindex_provinces(mod_folder: Path, id_map: Dict[int, int] | None = None) -> ReindexReport:
+    """
+    Renumber the provinces of a CK2 mod in place: definition.csv, history/provinces file names,
+    climate.txt, default.map (sea_zones, major_rivers, max_provinces), capital = in landed titles
+    and adjacencies.csv. Without id_map the ids are made sequential from 1.
+
+    The map is checked against definition.csv before anything is written, each file is read
+    once and replaced atomically, comments are kept. Finally every file is scanned again for
+    ids that should no longer exist, reported in ReindexReport.stale_ids.
+    """
+    mod_files = ModFiles.of(mod_folder)
+    definitions = DefinitionTable.load(mod_files.definitions)
+    existing_ids = definitions.ids.tolist()
+    if id_map is None:
+        id_map = sequential_id_map(existing_ids)
+    id_map = {int(old): int(new) for old, new in id_map.items() if int(old) != int(new)}
+    final_ids = validate_id_map(id_map, existing_ids)
+    report = ReindexReport()
+    if not id_map:
+        print("Province ids already match the given map, nothing to do")
+        return report
+
+    lookup = id_lookup(id_map, max(existing_ids, default=0) + 1)
+    remap = lambda i: lookup[i] if i < len(lookup) else i
+
+    definitions.reindexed(final_ids).write(mod_files.definitions)
+    report.changed_files.append(mod_files.definitions)
+    max_provinces = max(final_ids, default=0) + 1
+    for path, rewriter in mod_files.script_files(remap, max_provinces, set(existing_ids)):
+        if rewrite_file(path, rewriter):
+            report.changed_files.append(path)
+    report.renamed_files = rename_history_files(mod_files.history_provinces, lookup)
+
+    report.stale_ids = find_stale_ids(mod_files, set(id_map) - set(final_ids))
+    print(f"Renumbered {len(id_map)} provinces: {len(report.changed_files)} files rewritten, "
+          f"{report.renamed_files} history files renamed")
+    for path, ids in report.stale_ids.items():
+        print(f"Warning: {len(ids)} old ids left in {path}: {ids[:10]}")
+    return report
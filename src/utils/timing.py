@@ -0,0 +1,38 @@
+from contextlib import contextmanager, nullcontext
+from typing import Dict
+import resource
+import sys
+import time
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of the current process"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+class PhaseTimer:
+    """
+    Wall time per named phase, accumulated over calls, and the peak RSS of the process
+    at the end of each phase. The peak only grows: a phase raising it is the one that
+    needed that much memory.
+    """
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.peak_rss_mb: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.) + time.perf_counter() - start
+            self.peak_rss_mb[name] = peak_rss_mb()
+
+
+def timed(timer: PhaseTimer | None, name: str):
+    """timer.phase(name), or nothing when no timer is given"""
+    return nullcontext() if timer is None else timer.phase(name)
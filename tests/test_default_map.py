@@ -0,0 +1,68 @@
+import numpy as np
+from PIL import Image
+from src.map.default_map import classify_provinces, convert_default_map_lists, format_id_list
+from src.map.rivers import RIVER_COLORS
+
+
+def classify(province_ids, water=None, rivers=None, heights=None):
+    shape = province_ids.shape
+    return classify_provinces(
+        province_ids,
+        np.full(shape, 100, dtype=np.uint8) if heights is None else heights,
+        np.zeros(shape, dtype=bool) if water is None else water,
+        np.zeros(shape, dtype=bool) if rivers is None else rivers,
+    )
+
+
+def test_water_next_to_unmapped_pixels_is_sea():
+    # Converted map pasted with an offset: a frame of id 0 all around
+    province_ids = np.zeros((40, 40), dtype=np.int32)
+    province_ids[4:36, 4:36] = 1
+    province_ids[4:36, 4:12] = 3          # Ocean along the unmapped frame
+    province_ids[18:24, 20:26] = 4        # Lake inside land
+    water = np.isin(province_ids, [3, 4])
+
+    lists = classify(province_ids, water=water)
+
+    assert lists["sea_zones"] == [3]
+    assert lists["lakes"] == [4]
+
+
+def test_river_provinces_from_one_pixel_rivers():
+    province_ids = np.ones((60, 60), dtype=np.int32)
+    province_ids[:, 30:35] = 2            # Narrow province drawn along a river
+    rivers = np.zeros(province_ids.shape, dtype=bool)
+    rivers[:, 32] = True                  # River through province 2
+    rivers[10, :20] = True                # River crossing the large province 1
+
+    lists = classify(province_ids, rivers=rivers)
+
+    assert lists["river_provinces"] == [2]
+
+
+def test_format_id_list():
+    assert format_id_list("sea_zones", [5, 1, 2, 3, 7, 8]) == [
+        "sea_zones = RANGE { 1 3 }",
+        "sea_zones = LIST { 5 7 8 }",
+    ]
+
+
+def test_default_map_lists_without_terrain_files(tmp_path):
+    original, mod = tmp_path / "ck2", tmp_path / "ck3"
+    (original / "map").mkdir(parents=True)
+    (mod / "map_data").mkdir(parents=True)
+    provinces = np.zeros((20, 20, 3), dtype=np.uint8)
+    provinces[:, :10] = (10, 20, 30)
+    provinces[:, 10:] = (40, 50, 60)
+    heights = np.full((20, 20), 100, dtype=np.uint8)
+    heights[:, 10:] = 5                   # Below sea level
+    rivers = np.empty((20, 20, 3), dtype=np.uint8)
+    rivers[...] = RIVER_COLORS['LAND']
+    Image.fromarray(provinces).save(mod / "map_data" / "provinces.png")
+    Image.fromarray(heights).save(mod / "map_data" / "heightmap.png")
+    Image.fromarray(rivers).save(mod / "map_data" / "rivers.png")
+
+    lists = convert_default_map_lists(original, mod, {(10, 20, 30): 1, (40, 50, 60): 2}, 1., (0, 0))
+
+    assert lists["sea_zones"] == [2]
+    assert (mod / "map_data" / "default.map").exists()
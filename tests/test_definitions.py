@@ -0,0 +1,25 @@
+import pytest
+from src.titles.definitions import DefinitionTable
+
+DEFINITIONS = [
+    "province;red;green;blue;x;x",
+    "1;10;20;30;Alpha;x",
+    "# comment line",
+    "2;40;50;60;Beta;x # inline",
+    "3;;;;Ærø;x",
+]
+
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n"])
+@pytest.mark.parametrize("final_newline", [True, False])
+@pytest.mark.parametrize("encoding", ["utf-8", "utf-8-sig", "cp1252"])
+def test_definition_table_round_trip(tmp_path, newline, final_newline, encoding):
+    original = (newline.join(DEFINITIONS) + (newline if final_newline else "")).encode(encoding)
+    source, destination = tmp_path / "source.csv", tmp_path / "destination.csv"
+    source.write_bytes(original)
+
+    table = DefinitionTable.load(source)
+    table.write(destination)
+
+    assert destination.read_bytes() == original
+    assert table.ids.tolist() == [1, 2, 3]
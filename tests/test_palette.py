@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+from src.map.palette import ColorAllocator
+from src.map.province import pack_colors
+
+
+def test_allocated_colors_are_unique_and_unused():
+    used = np.array([(10, 20, 30), (200, 100, 50)], dtype=np.uint8)
+    allocator = ColorAllocator(min_distance=2, seed=1)
+    allocator.mark_used(used)
+
+    colors = allocator.allocate(1000).astype(np.int32)
+
+    assert len(np.unique(pack_colors(colors))) == 1000
+    # No channel closer than min_distance to a used or reserved color
+    for color in np.r_[used, [(0, 0, 0), (255, 255, 255)]]:
+        assert (np.abs(colors - color).max(axis=1) >= 2).all()
+
+
+@pytest.mark.parametrize("min_distance", [0, -1])
+def test_min_distance_below_one_is_rejected(min_distance):
+    with pytest.raises(ValueError):
+        ColorAllocator(min_distance=min_distance)
@@ -0,0 +1,10 @@
+from src.titles.province_history import discover_province_histories
+
+
+def test_discover_province_histories_from_iterator(tmp_path):
+    for name in ["1 - Alpha.txt", "2 - Beta.txt", "7 - Gamma.txt"]:
+        (tmp_path / name).write_text("title = c_test\n")
+
+    found = list(discover_province_histories(tmp_path, (i for i in [2, 1, 3])))
+
+    assert found == [(2, tmp_path / "2 - Beta.txt"), (1, tmp_path / "1 - Alpha.txt")]
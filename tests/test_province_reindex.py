@@ -0,0 +1,123 @@
+from pathlib import Path
+import pytest
+from src.utils.province_reindex import reindex_provinces
+
+DEFINITIONS = """province;red;green;blue;x;x
+1;10;20;30;Alpha;x
+2;40;50;60;Beta;x
+5;70;80;90;Gamma;x
+7;100;110;120;Delta;x
+"""
+DEFAULT_MAP = """max_provinces = 8
+definitions = "definition.csv"
+sea_zones = { 5 7 } # Ocean
+major_rivers = { 2 5 }
+"""
+CLIMATE = """mild_winter = { 1 2 }
+severe_winter = {
+\t5 7 # North
+}
+"""
+ADJACENCIES = """From;To;Type;Through;start_x;start_y;stop_x;stop_y;Comment
+1;5;sea;7;-1;-1;-1;-1;Strait
+-1;-1;;-1;-1;-1;-1;-1;
+"""
+LANDED_TITLES = """d_test = {
+\tcapital = 5 # Gamma
+\tc_test = {
+\t\tb_test = { }
+\t}
+}
+"""
+HISTORY = {1: "Alpha", 2: "Beta", 5: "Gamma", 7: "Delta"}
+
+
+def make_mod(folder: Path, history=HISTORY) -> Path:
+    files = {
+        "map/definition.csv": DEFINITIONS,
+        "map/default.map": DEFAULT_MAP,
+        "map/climate.txt": CLIMATE,
+        "map/adjacencies.csv": ADJACENCIES,
+        "common/landed_titles/titles.txt": LANDED_TITLES,
+    }
+    files.update({f"history/provinces/{i} - {name}.txt": f"# {name}\n" for i, name in history.items()})
+    for name, text in files.items():
+        path = folder / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text)
+    return folder
+
+
+def history_names(folder: Path):
+    return {path.name: path.read_text() for path in (folder / "history" / "provinces").iterdir()}
+
+
+def test_sequential_reindex(tmp_path):
+    mod = make_mod(tmp_path)
+
+    report = reindex_provinces(mod)
+
+    assert report.ok
+    assert report.renamed_files == 2
+    assert [line.split(";")[0] for line in (mod / "map" / "definition.csv").read_text().splitlines()[1:]] == [
+        "1", "2", "3", "4",
+    ]
+    assert (mod / "map" / "default.map").read_text() == (
+        'max_provinces = 5\n'
+        'definitions = "definition.csv"\n'
+        'sea_zones = { 3 4 } # Ocean\n'
+        'major_rivers = { 2 3 }\n'
+    )
+    assert (mod / "map" / "climate.txt").read_text() == CLIMATE.replace("5 7", "3 4")
+    assert (mod / "map" / "adjacencies.csv").read_text().splitlines()[1:] == [
+        "1;3;sea;4;-1;-1;-1;-1;Strait",
+        "-1;-1;;-1;-1;-1;-1;-1;",
+    ]
+    assert "capital = 3 # Gamma" in (mod / "common" / "landed_titles" / "titles.txt").read_text()
+    assert history_names(mod) == {
+        "1 - Alpha.txt": "# Alpha\n", "2 - Beta.txt": "# Beta\n",
+        "3 - Gamma.txt": "# Gamma\n", "4 - Delta.txt": "# Delta\n",
+    }
+
+
+def test_ck2_sea_zone_range_skips_gaps(tmp_path):
+    mod = make_mod(tmp_path)
+    default_map = mod / "map" / "default.map"
+    default_map.write_text(DEFAULT_MAP.replace("sea_zones = { 5 7 }", "sea_zones = { 2 7 }"))
+
+    reindex_provinces(mod, {5: 9})
+
+    # 3, 4 and 6 are not provinces: the range becomes the runs of the renumbered ids
+    assert "sea_zones = { 2 2 }\nsea_zones = { 7 7 }\nsea_zones = { 9 9 } # Ocean\n" in default_map.read_text()
+
+
+def test_swapped_history_files(tmp_path):
+    mod = make_mod(tmp_path)
+
+    report = reindex_provinces(mod, {1: 2, 2: 1})
+
+    assert report.ok
+    assert history_names(mod) == {
+        "2 - Alpha.txt": "# Alpha\n", "1 - Beta.txt": "# Beta\n",
+        "5 - Gamma.txt": "# Gamma\n", "7 - Delta.txt": "# Delta\n",
+    }
+    assert (mod / "map" / "climate.txt").read_text().startswith("mild_winter = { 2 1 }")
+
+
+def test_stale_ids_are_reported(tmp_path):
+    # Two history files for province 7: only the first one is renamed
+    mod = make_mod(tmp_path, {**HISTORY, 7: "Delta"})
+    (mod / "history" / "provinces" / "7 - Copy.txt").write_text("# Copy\n")
+
+    report = reindex_provinces(mod)
+
+    assert not report.ok
+    assert report.stale_ids == {mod / "history" / "provinces": [7]}
+
+
+def test_clashing_ids_are_rejected_before_writing(tmp_path):
+    mod = make_mod(tmp_path)
+
+    with pytest.raises(ValueError):
+        reindex_provinces(mod, {5: 2})
+    assert (mod / "map" / "definition.csv").read_text() == DEFINITIONS
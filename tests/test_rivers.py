@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+from PIL import Image
+from src.map.rivers import (
+    RIVER_CACHE_VERSION, RIVER_COLORS, RIVER_WIDTH_COLORS, River, RiverPoint, convert_rivers_map, draw_river_systems,
+)
+
+
+def staircase_rivers() -> np.ndarray:
+    """
+    River going down a staircase of 4 pixels right, 3 down, with a tributary joining one of
+    its vertical stretches from the left, down a staircase of its own. Simplified, both become
+    diagonal lines.
+    """
+    image = np.empty((40, 50, 3), dtype=np.uint8)
+    image[...] = RIVER_COLORS['LAND']
+    x, y = 1, 1
+    for _ in range(8):
+        image[y, x:x + 5] = RIVER_WIDTH_COLORS[0]
+        image[y:y + 4, x + 4] = RIVER_WIDTH_COLORS[0]
+        x, y = x + 4, y + 3
+    image[1, 1] = RIVER_COLORS['SOURCE']
+
+    # Tributary joining the stretch of column 17 from the left
+    image[12, 16] = RIVER_COLORS['TRIBUTARY']
+    x, y = 15, 12
+    for _ in range(5):
+        image[y, x - 3:x + 1] = RIVER_WIDTH_COLORS[3]
+        image[y:y + 4, x - 3] = RIVER_WIDTH_COLORS[3]
+        x, y = x - 3, y + 3
+    return image
+
+
+@pytest.mark.parametrize("scale", [1., 1.4, 2.])
+@pytest.mark.parametrize("simplify_tolerance", [0.8, 1.5, 3.])
+def test_simplified_rivers_stay_valid(tmp_path, scale, simplify_tolerance):
+    source, destination = tmp_path / "rivers.bmp", tmp_path / "rivers.png"
+    Image.fromarray(staircase_rivers()).save(source)
+    dimensions = (int(50 * scale), int(40 * scale))
+
+    exact = convert_rivers_map(source, destination, scale, (0, 0), dimensions)
+    simplified = convert_rivers_map(source, destination, scale, (0, 0), dimensions,
+                                    simplify_tolerance=simplify_tolerance)
+
+    assert exact.is_valid
+    assert simplified.is_valid
+    assert not len(simplified.untraced)
+
+
+def test_river_cache_is_versioned(tmp_path):
+    source, destination = tmp_path / "rivers.bmp", tmp_path / "rivers.png"
+    Image.fromarray(staircase_rivers()).save(source)
+    cache_folder = tmp_path / "cache"
+
+    first = convert_rivers_map(source, destination, 1.4, (0, 0), (70, 56), cache_folder=cache_folder)
+    first_image = np.array(Image.open(destination))
+    second = convert_rivers_map(source, destination, 1.4, (0, 0), (70, 56), cache_folder=cache_folder)
+
+    cache_files = list(cache_folder.iterdir())
+    assert len(cache_files) == 1
+    assert cache_files[0].name.startswith(f"rivers_v{RIVER_CACHE_VERSION}_")
+    assert (np.array(Image.open(destination)) == first_image).all()
+    assert first.is_valid and second.is_valid
+
+
+# Drawn by the per-pixel renderer draw_river_systems replaced, which it has to match exactly
+EXPECTED_RIVERS = """
+....................
+.Sa.............bbbb
+...aa.......bbbb....
+.....aa....b........
+......a....b.......c
+.......a..b.......c.
+.......aTb........c.
+....eee.b........c..
+..ee....b........c..
+..e....b.ac.....c...
+..e...b....ccc..c...
+.e...b........cc....
+.e...b..............
+....S...............
+"""
+LEGEND = {
+    ".": RIVER_COLORS['LAND'], "S": RIVER_COLORS['SOURCE'], "T": RIVER_COLORS['TRIBUTARY'],
+    "a": RIVER_WIDTH_COLORS[0], "b": RIVER_WIDTH_COLORS[1], "c": RIVER_WIDTH_COLORS[2], "e": RIVER_WIDTH_COLORS[4],
+}
+
+
+def river(points, start_pixel_color_type: str) -> River:
+    drawn = River()
+    drawn.points = [RiverPoint(x, y, LEGEND[color]) for x, y, color in points]
+    drawn.start_pixel_color_type = start_pixel_color_type
+    return drawn
+
+
+def test_draw_river_systems_matches_reference():
+    # Diagonal segments, a width change and rounded coordinates
+    main = river([(1, 1, "S"), (6, 3, "a"), (9, 9, "a"), (15, 11, "c"), (18.6, 4.4, "c")], 'SOURCE')
+    # Tributary leaving main point 2, running back over the main river before leaving it
+    tributary = river([(9, 9, "T"), (7.5, 6, "e"), (2, 8, "e"), (1, 12, "e")], 'TRIBUTARY')
+    main.tributaries.append((tributary, 2))
+    # Second system drawn over the first one
+    other = river([(4, 13, "S"), (12, 2, "b"), (19, 1, "b")], 'SOURCE')
+
+    canvas = np.empty((14, 20, 3), dtype=np.uint8)
+    canvas[...] = RIVER_COLORS['LAND']
+    draw_river_systems(canvas, [main, other])
+
+    expected = np.array([[LEGEND[c] for c in row] for row in EXPECTED_RIVERS.split()], dtype=np.uint8)
+    assert (canvas == expected).all()